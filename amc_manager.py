@@ -6,12 +6,25 @@ from pathlib import Path
 import logging
 import csv
 import shutil
+import tempfile
+import hashlib
+import threading
+import time
+import zipfile
 from datetime import datetime # Added for generate_advanced_statistics
 
+from file_hashes import record_file_hash, get_file_entry, file_sha256
+from question_bank import QuestionBank
+import scan_retention
+from disk_usage import refresh_project_usage
+from metrics import record_command, record_cache
+from scan_filter import (prefilter_images, load_corner_marks, check_corner_marks, inspect_scans,
+                         extract_scans_images, CORNER_CHECK_ENABLED, SKIPPED_DIR)
+
 class AMCManager:
     """Gestionnaire pour les opérations Auto Multiple Choice - Version adaptée au format français"""
     
-    def __init__(self, project_path):
+    def __init__(self, project_path, output_callback=None):
         self.project_path = Path(project_path)
         self.data_path = self.project_path / 'data'
         self.cr_path = self.project_path / 'cr'
@@ -25,9 +38,48 @@ class AMCManager:
         # Configuration du logging
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        
+        # Callback optionnel recevant les sorties et étapes en temps réel (suivi SSE)
+        self.output_callback = output_callback
+        
+        # Statistiques d'analyse mémorisées (signature des bases, valeurs)
+        self._analysis_stats_cache = None
+        # Notes de l'exécution, partagées entre statistiques et contrôle qualité
+        self._results_context = None
+    
+    def _emit(self, event_type, **payload):
+        """Transmet un événement de progression au callback s'il est défini"""
+        if self.output_callback is None:
+            return
+        try:
+            self.output_callback({'type': event_type, **payload})
+        except Exception as e:
+            self.logger.warning(f"Erreur callback de progression: {e}")
+    
+    def _emit_step(self, name, label):
+        """Signale le début d'une étape de la correction"""
+        self.logger.info(label)
+        self._emit('step', name=name, label=label)
+    
+    def _progress_options(self, progress_id):
+        """Options AMC activant les lignes de progression (seulement en mode suivi)"""
+        if self.output_callback is None:
+            return ""
+        return f" --progression-id {progress_id} --progression 1"
     
     def run_command(self, command, check=True):
-        """Exécute une commande AMC et retourne le résultat"""
+        """Exécute une commande AMC et retourne le résultat (nombre et durée comptés dans metrics)"""
+        started = time.monotonic()
+        if self.output_callback is not None:
+            result = self._run_command_streaming(command, check)
+        else:
+            result = self._run_command_blocking(command, check)
+        # Avec check=False, success reste vrai malgré un code de retour non nul
+        record_command(command, time.monotonic() - started,
+                       result.get('success', False) and result.get('returncode', 0) == 0)
+        return result
+
+    def _run_command_blocking(self, command, check=True):
         try:
             self.logger.info(f"Exécution: {command}")
             result = subprocess.run(
@@ -64,20 +116,88 @@ class AMCManager:
                 'command': command
             }
 
+    def _run_command_streaming(self, command, check=True):
+        """Exécute une commande en relayant stdout/stderr ligne par ligne au callback"""
+        try:
+            self.logger.info(f"Exécution (suivi): {command}")
+            self._emit('command', command=command)
+            process = subprocess.Popen(
+                command,
+                shell=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                bufsize=1,
+                cwd=self.project_path
+            )
+            
+            captured = {'stdout': [], 'stderr': []}
+            
+            def pump(stream, name):
+                for line in stream:
+                    captured[name].append(line)
+                    self._emit('output', stream=name, line=line.rstrip('\n'))
+                stream.close()
+            
+            readers = [
+                threading.Thread(target=pump, args=(process.stdout, 'stdout'), daemon=True),
+                threading.Thread(target=pump, args=(process.stderr, 'stderr'), daemon=True)
+            ]
+            for reader in readers:
+                reader.start()
+            returncode = process.wait()
+            for reader in readers:
+                reader.join()
+            
+            stdout = ''.join(captured['stdout'])
+            stderr = ''.join(captured['stderr'])
+            
+            if check and returncode != 0:
+                error = f"Command '{command}' returned non-zero exit status {returncode}."
+                self.logger.error(f"Erreur commande: {error}")
+                return {
+                    'success': False,
+                    'stdout': stdout,
+                    'stderr': stderr,
+                    'returncode': returncode,
+                    'command': command,
+                    'error': error
+                }
+            
+            return {
+                'success': True,
+                'stdout': stdout,
+                'stderr': stderr,
+                'returncode': returncode,
+                'command': command
+            }
+        except Exception as e:
+            self.logger.error(f"Erreur inattendue: {e}")
+            return {
+                'success': False,
+                'error': str(e),
+                'command': command
+            }
+
     def _generate_latex_header_french(self, title, subject, duration, instructions, csv_filename=None, num_pages=2):
         """Génère l'en-tête LaTeX compatible avec AMC"""
         
+        # Tout ce qui précède \endofdump est fixe et précompilé en format LaTeX
+        # (voir _ensure_latex_format) ; automultiplechoice reste chargé à chaque
+        # compilation car il dépend des options passées par AMC prepare.
         base_header = r"""\documentclass[12pt,a4paper]{article}
 
     \usepackage{csvsimple,graphicx,pifont}
-    \usepackage[francais,bloc]{automultiplechoice}
-    \usepackage[utf8]{inputenc}    
+    \usepackage[utf8]{inputenc}
     \usepackage[T1]{fontenc}
     \usepackage{verbatimbox}
     \usepackage{tcolorbox}
 
     \newtcolorbox{codebox}{colback=gray!5!white, colframe=black, boxrule=0.5mm, arc=3mm, width=\linewidth}
 
+    \csname endofdump\endcsname
+    \usepackage[francais,bloc]{automultiplechoice}
+
     """
 
         # Si pas de CSV, définir les commandes nécessaires
@@ -193,11 +313,10 @@ class AMCManager:
         # 1. En-tête LaTeX avec num_pages
         latex_content = self._generate_latex_header_french(title, subject, duration, instructions, csv_filename, num_pages)
         
-        # 2. Générer TOUTES les questions
-        print("Génération des questions...")
-        for i, question in enumerate(questions_data):
-            print(f"  Question {i+1}: {question.get('text', '')[:50]}...")
-            latex_content += self._generate_question_latex_french(question)
+        # 2. Générer TOUTES les questions (fragments mémorisés par contenu dans la banque du projet)
+        bank = QuestionBank(self.project_path)
+        latex_content += bank.assemble(questions_data, self._generate_question_latex_french)
+        print(f"Questions assemblées: {bank.hits} fragment(s) en cache, {bank.misses} régénéré(s)")
         
         # 3. Pied de page
         latex_content += self._generate_latex_footer_french(csv_filename)
@@ -239,7 +358,34 @@ class AMCManager:
         
         return csv_filename
     
-    def prepare_project(self, latex_file=None):
+    # Préparation parallèle des sujets personnalisés : nombre d'élèves par lot (0 = désactivée)
+    PREPARE_CHUNK_SIZE = int(os.environ.get('AMC_PREPARE_CHUNK_SIZE', '0'))
+    # Lots compilés simultanément (0 = part du budget CPU global des corrections)
+    PREPARE_WORKERS = int(os.environ.get('AMC_PREPARE_WORKERS', '0'))
+    # Compteur LaTeX du numéro de copie AMC, décalé dans chaque lot
+    PREPARE_COPY_COUNTER = os.environ.get('AMC_COPY_COUNTER', 'etu')
+
+    def _prepare_workers(self):
+        """Lots compilés en parallèle, dans la limite de la part du budget CPU de cette correction"""
+        # Import différé : correction_jobs importe amc_manager
+        from correction_jobs import job_registry
+        share = job_registry.cpu_share()
+        return min(self.PREPARE_WORKERS, share) if self.PREPARE_WORKERS > 0 else share
+
+    @staticmethod
+    def _split_csv_records(text):
+        """Enregistrements bruts d'un CSV (un champ entre guillemets peut contenir des retours à la ligne)"""
+        lines = text.splitlines(keepends=True)
+        reader = csv.reader(lines)
+        records, consumed = [], 0
+        for row in reader:
+            record = ''.join(lines[consumed:reader.line_num])
+            consumed = reader.line_num
+            if any(field.strip() for field in row):
+                records.append(record.rstrip('\r\n'))
+        return records
+
+    def prepare_project(self, latex_file=None, parallel=True):
         """Prépare le projet AMC avec la commande prepare"""
         if latex_file is None:
             latex_file = self.project_path / 'questionnaire.tex'
@@ -255,6 +401,18 @@ class AMCManager:
         # Nettoyer les anciens fichiers
         self._clean_old_files()
         
+        # Sujets personnalisés volumineux : compilation par lots en parallèle, repli sur prepare unique
+        if parallel and self.PREPARE_CHUNK_SIZE > 0:
+            try:
+                parallel_result = self._prepare_project_parallel(latex_file)
+                if parallel_result:
+                    return parallel_result
+            except Exception as e:
+                self.logger.warning(f"Préparation parallèle impossible, prepare unique: {e}")
+        
+        # Format précompilé du préambule fixe, si disponible (repli sans format en cas d'échec)
+        latex_format = self._ensure_latex_format(latex_file)
+        
         # CORRECTION: Ajouter --out-calage pour forcer la génération du fichier de calibrage
         # Cette option est ESSENTIELLE pour générer le layout AMC
         cmd = f"""auto-multiple-choice prepare \
@@ -272,7 +430,14 @@ class AMCManager:
         self.logger.critical(f"DEBUG_COMMAND_TO_EXECUTE: {cmd}") 
         self.logger.info(f"Exécution AMC prepare : {cmd}")
         
-        result = self.run_command(cmd)
+        if latex_format:
+            result = self.run_command(
+                f"{latex_format['env']} {cmd} --with 'pdflatex -fmt={latex_format['name']}'")
+            if not (result['success'] or result.get('returncode') == 0):
+                self.logger.warning("AMC prepare avec format précompilé en échec, nouvel essai sans format")
+                result = self.run_command(cmd)
+        else:
+            result = self.run_command(cmd)
         
         if result['success'] or result['returncode'] == 0:
             self.logger.info("AMC prepare terminé")
@@ -287,28 +452,15 @@ class AMCManager:
                 if meptex_result['success']:
                     self.logger.info("Layout extrait avec succès")
                     
-                    # Vérifier que le layout a été généré
-                    try:
-                        import sqlite3
-                        layout_db = self.data_path / 'layout.sqlite'
-                        if layout_db.exists():
-                            conn = sqlite3.connect(layout_db)
-                            cursor = conn.cursor()
-                            cursor.execute("SELECT COUNT(*) FROM layout_box")
-                            box_count = cursor.fetchone()[0]
-                            cursor.execute("SELECT COUNT(*) FROM layout_question")
-                            question_count = cursor.fetchone()[0]
-                            conn.close()
-                            
-                            self.logger.info(f"Layout généré: {box_count} boxes, {question_count} questions")
-                            
-                            if box_count == 0:
-                                self.logger.warning("Aucune box détectée dans le layout")
-                            if question_count == 0:
-                                self.logger.warning("Aucune question détectée dans le layout")
-                                
-                    except Exception as e:
-                        self.logger.error(f"Erreur vérification layout: {e}")
+                    # Résumé du layout calculé une seule fois, consulté ensuite par la correction
+                    summary = self.write_layout_summary()
+                    if summary:
+                        self.logger.info(f"Layout généré: {summary['box_count']} boxes, {summary['question_count']} questions")
+                        
+                        if summary['box_count'] == 0:
+                            self.logger.warning("Aucune box détectée dans le layout")
+                        if summary['question_count'] == 0:
+                            self.logger.warning("Aucune question détectée dans le layout")
                 else:
                     self.logger.error(f"Échec meptex: {meptex_result.get('stderr')}")
             else:
@@ -329,6 +481,7 @@ class AMCManager:
                     output_pdf = self.project_path / 'questionnaire_output.pdf'
                     try:
                         shutil.copy2(pdf_path, output_pdf)
+                        self._record_subject_pdf(output_pdf)
                         self.logger.info(f"PDF AMC généré : {pdf_path}")
                         pdf_found = True
                         break
@@ -356,9 +509,343 @@ class AMCManager:
         self.logger.warning("AMC prepare a échoué, tentative avec pdflatex")
         return self._fallback_pdflatex_compilation(latex_file)
 
+    def _prepare_project_parallel(self, latex_file):
+        """Compile les sujets personnalisés par lots de liste.csv en parallèle puis fusionne.
+
+        Chaque lot est préparé (prepare + meptex) dans prepare_chunks/chunk_XXX avec le
+        numéro de copie décalé, puis les PDF sont concaténés (pdfunite) et les
+        layout.sqlite fusionnés. Retourne None si le projet ne s'y prête pas ou si un
+        lot échoue : l'appelant lance alors le prepare habituel.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        import re
+        
+        tex_content = latex_file.read_text(encoding='utf-8')
+        match = re.search(r'\\csvreader(?:\[[^\]]*\])?\{([^}]+)\}', tex_content)
+        if not match or '\\begin{document}' not in tex_content:
+            return None
+        
+        csv_path = self.project_path / match.group(1)
+        if not csv_path.exists():
+            return None
+        
+        with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+            records = self._split_csv_records(f.read())
+        if not records:
+            return None
+        header, students = records[0], records[1:]
+        chunk_size = self.PREPARE_CHUNK_SIZE
+        if len(students) <= chunk_size:
+            return None
+        
+        if not shutil.which('pdfunite'):
+            self.logger.warning("pdfunite introuvable, préparation parallèle désactivée")
+            return None
+        
+        chunks_root = self.project_path / 'prepare_chunks'
+        shutil.rmtree(chunks_root, ignore_errors=True)
+        
+        chunks = []
+        for index, start in enumerate(range(0, len(students), chunk_size)):
+            chunk_dir = chunks_root / f'chunk_{index:03d}'
+            chunk_dir.mkdir(parents=True)
+            
+            # Ressources LaTeX partagées (styles, images)
+            for asset in self.project_path.iterdir():
+                if asset.is_file() and asset.suffix.lower() in ('.sty', '.cls', '.png', '.jpg', '.jpeg', '.eps'):
+                    shutil.copy2(asset, chunk_dir / asset.name)
+            
+            with open(chunk_dir / csv_path.name, 'w', encoding='utf-8') as f:
+                f.write('\n'.join([header] + students[start:start + chunk_size]) + '\n')
+            
+            # Les copies du lot sont numérotées à partir de start + 1
+            offset = (
+                f"\\makeatletter\\@ifundefined{{c@{self.PREPARE_COPY_COUNTER}}}{{}}"
+                f"{{\\setcounter{{{self.PREPARE_COPY_COUNTER}}}{{{start}}}}}\\makeatother\n"
+            )
+            chunk_tex = chunk_dir / latex_file.name
+            chunk_tex.write_text(
+                tex_content.replace('\\begin{document}', '\\begin{document}\n' + offset, 1),
+                encoding='utf-8'
+            )
+            chunks.append((chunk_dir, start))
+        
+        self.logger.info(f"Préparation parallèle: {len(students)} élèves en {len(chunks)} lots")
+        
+        def prepare_chunk(chunk):
+            chunk_dir, _ = chunk
+            return AMCManager(chunk_dir).prepare_project(chunk_dir / latex_file.name, parallel=False)
+        
+        with ThreadPoolExecutor(max_workers=self._prepare_workers()) as pool:
+            chunk_results = list(pool.map(prepare_chunk, chunks))
+        
+        for (chunk_dir, start), chunk_result in zip(chunks, chunk_results):
+            if chunk_result.get('method') != 'amc_prepare' or not (chunk_dir / 'data' / 'layout.sqlite').exists():
+                self.logger.warning(f"Échec du lot {chunk_dir.name}: {chunk_result.get('error', '')}")
+                return None
+        
+        merge_result = self._merge_layout_databases(chunks)
+        if not merge_result['success']:
+            self.logger.warning(f"Fusion des layouts impossible: {merge_result['error']}")
+            return None
+        
+        for pdf_name in ('DOC-sujet.pdf', 'DOC-corrige.pdf'):
+            parts = [chunk_dir / pdf_name for chunk_dir, _ in chunks]
+            if not all(part.exists() for part in parts):
+                continue
+            sources = ' '.join(f"'{part.relative_to(self.project_path)}'" for part in parts)
+            unite_result = self.run_command(f"pdfunite {sources} '{pdf_name}'", check=False)
+            # check=False : success reste vrai quel que soit le code de retour
+            if not unite_result['success'] or unite_result.get('returncode') != 0:
+                self.logger.warning(f"Concaténation de {pdf_name} impossible, repli sur prepare unique: "
+                                    f"{unite_result.get('stderr') or unite_result.get('error')}")
+                # Un PDF partiel ne doit pas être pris pour le sujet complet
+                (self.project_path / pdf_name).unlink(missing_ok=True)
+                return None
+        
+        # Le catalogue décrit les questions du sujet, identiques dans tous les lots
+        catalog = chunks[0][0] / 'DOC-catalog.pdf'
+        if catalog.exists():
+            shutil.copy2(catalog, self.project_path / 'DOC-catalog.pdf')
+        
+        sujet_pdf = self.project_path / 'DOC-sujet.pdf'
+        if not sujet_pdf.exists():
+            return None
+        shutil.copy2(sujet_pdf, self.project_path / 'questionnaire_output.pdf')
+        self._record_subject_pdf(self.project_path / 'questionnaire_output.pdf')
+        
+        self.write_layout_summary()
+        shutil.rmtree(chunks_root, ignore_errors=True)
+        
+        self.logger.info(f"Préparation parallèle terminée: {len(chunks)} lots fusionnés")
+        return {
+            'success': True,
+            'method': 'amc_prepare_parallel',
+            'chunks': len(chunks),
+            'stdout': '',
+            'stderr': '',
+            'layout_file': None
+        }
+
+    def _merge_layout_databases(self, chunks):
+        """Fusionne les layout.sqlite des lots dans data/layout.sqlite.
+
+        Les numéros de copie sont déjà décalés par LaTeX (vérifié ici) ; les pages du
+        sujet (subjectpage) sont décalées du nombre de pages des lots précédents et les
+        sources de chaque lot (layout_source) ajoutées avec de nouveaux sourceid.
+        """
+        import sqlite3
+        
+        target = self.data_path / 'layout.sqlite'
+        tmp_target = target.with_name(target.name + '.tmp')
+        shutil.copy2(chunks[0][0] / 'data' / 'layout.sqlite', tmp_target)
+        
+        error = None
+        conn = sqlite3.connect(tmp_target)
+        try:
+            page_offset = 0
+            for position, (chunk_dir, start) in enumerate(chunks):
+                conn.execute("ATTACH DATABASE ? AS chunk", (str(chunk_dir / 'data' / 'layout.sqlite'),))
+                try:
+                    first_student = conn.execute("SELECT MIN(student) FROM chunk.layout_page").fetchone()[0]
+                    if first_student != start + 1:
+                        error = f"{chunk_dir.name}: première copie {first_student}, attendu {start + 1}"
+                        break
+                    
+                    tables = [row[0] for row in conn.execute(
+                        "SELECT name FROM chunk.sqlite_master WHERE type = 'table' AND name LIKE 'layout_%'")]
+                    
+                    # Sources du lot renumérotées : sourceid des pages du lot -> nouvel identifiant
+                    source_map = '{table}.sourceid'
+                    if position > 0 and 'layout_source' in tables:
+                        source_columns = [row[1] for row in conn.execute("PRAGMA chunk.table_info(layout_source)")
+                                          if row[1] != 'sourceid']
+                        conn.execute("DROP TABLE IF EXISTS temp.source_map")
+                        conn.execute("CREATE TEMP TABLE source_map (old INTEGER PRIMARY KEY, new INTEGER)")
+                        for row in conn.execute(f"SELECT sourceid, {', '.join(source_columns)} "
+                                                f"FROM chunk.layout_source").fetchall():
+                            new_id = conn.execute(
+                                f"INSERT INTO main.layout_source ({', '.join(source_columns)}) "
+                                f"VALUES ({', '.join('?' * len(source_columns))})", row[1:]).lastrowid
+                            conn.execute("INSERT INTO temp.source_map VALUES (?, ?)", (row[0], new_id))
+                        source_map = "(SELECT new FROM temp.source_map WHERE old = {table}.sourceid)"
+                    
+                    chunk_pages = 0
+                    for table in tables:
+                        columns = [row[1] for row in conn.execute(f"PRAGMA chunk.table_info({table})")]
+                        if 'subjectpage' in columns:
+                            chunk_pages = max(chunk_pages, conn.execute(
+                                f"SELECT COALESCE(MAX(subjectpage), 0) FROM chunk.{table}").fetchone()[0])
+                        # Tables communes à tous les lots (questions, variables) : reprises du premier lot
+                        if position == 0 or 'student' not in columns:
+                            continue
+                        remapped = {'subjectpage': f"subjectpage + {page_offset}",
+                                    'sourceid': source_map.format(table=f"chunk.{table}")}
+                        selected = ', '.join(remapped.get(col, col) for col in columns)
+                        conn.execute(f"INSERT INTO main.{table} ({', '.join(columns)}) "
+                                     f"SELECT {selected} FROM chunk.{table}")
+                    page_offset += chunk_pages
+                    conn.commit()
+                finally:
+                    conn.execute("DETACH DATABASE chunk")
+        except sqlite3.Error as e:
+            error = str(e)
+        finally:
+            conn.close()
+        
+        if error:
+            tmp_target.unlink()
+            return {'success': False, 'error': error}
+        
+        os.replace(tmp_target, target)
+        return {'success': True, 'layout_file': str(target)}
+
+    def _record_output(self, file_path, **extra):
+        """Enregistre l'empreinte d'un fichier généré (servie comme ETag)"""
+        try:
+            if file_path and Path(file_path).exists():
+                record_file_hash(self.project_path, file_path, **extra)
+        except OSError as e:
+            self.logger.warning(f"Empreinte non enregistrée pour {file_path}: {e}")
+
+    def _record_subject_pdf(self, pdf_path):
+        # L'empreinte des sources permet de savoir si le PDF est à jour sans recompiler
+        self._record_output(pdf_path, source_hash=self._layout_source_hash())
+
+    def subject_pdf_is_fresh(self):
+        """Indique si questionnaire_output.pdf correspond aux sources LaTeX/CSV actuelles"""
+        pdf_path = self.project_path / 'questionnaire_output.pdf'
+        entry = get_file_entry(self.project_path, pdf_path)
+        fresh = bool(entry) and entry.get('source_hash') == self._layout_source_hash()
+        record_cache('subject_pdf', fresh)
+        return fresh
+
+    LAYOUT_SUMMARY_FILE = 'layout_summary.json'
+    # Fichiers sources dont dépend le layout : une modification impose un nouveau prepare
+    LAYOUT_SOURCE_FILES = ('questionnaire.tex', 'liste.csv')
+
+    def _file_sha256(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def _layout_source_hash(self):
+        """Empreinte du contenu des sources LaTeX/CSV utilisées par prepare"""
+        digest = hashlib.sha256()
+        for name in self.LAYOUT_SOURCE_FILES:
+            path = self.project_path / name
+            if path.exists():
+                digest.update(name.encode('utf-8'))
+                digest.update(self._file_sha256(path).encode('ascii'))
+        return digest.hexdigest()
+
+    def write_layout_summary(self):
+        """Calcule le résumé de layout.sqlite (comptes, checksum, version) et l'enregistre dans data/"""
+        import sqlite3
+        
+        layout_db = self.data_path / 'layout.sqlite'
+        if not layout_db.exists():
+            return None
+        
+        try:
+            conn = sqlite3.connect(layout_db)
+            try:
+                box_count, page_count, question_count = conn.execute("""
+                    SELECT (SELECT COUNT(*) FROM layout_box),
+                           (SELECT COUNT(*) FROM layout_page),
+                           (SELECT COUNT(*) FROM layout_question)
+                """).fetchone()
+                try:
+                    row = conn.execute("SELECT value FROM layout_variables WHERE name = 'version'").fetchone()
+                    layout_version = row[0] if row else None
+                except sqlite3.Error:
+                    layout_version = None
+            finally:
+                conn.close()
+            
+            stat = layout_db.stat()
+            summary = {
+                'box_count': box_count,
+                'page_count': page_count,
+                'question_count': question_count,
+                'layout_version': layout_version,
+                'checksum': self._file_sha256(layout_db),
+                'layout_size': stat.st_size,
+                'layout_mtime_ns': stat.st_mtime_ns,
+                'source_hash': self._layout_source_hash(),
+                'created_at': datetime.now().isoformat()
+            }
+            
+            summary_file = self.data_path / self.LAYOUT_SUMMARY_FILE
+            tmp_file = summary_file.with_name(summary_file.name + '.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+            os.replace(tmp_file, summary_file)
+            return summary
+        
+        except Exception as e:
+            self.logger.error(f"Erreur calcul du résumé de layout: {e}")
+            return None
+
+    def get_layout_summary(self):
+        """Retourne le résumé du layout sans interroger layout.sqlite quand il n'a pas changé.
+
+        Le sidecar est relu tel quel si taille/date de layout.sqlite correspondent ;
+        sinon le checksum tranche, et le résumé n'est recalculé que si le contenu diffère.
+        """
+        layout_db = self.data_path / 'layout.sqlite'
+        summary_file = self.data_path / self.LAYOUT_SUMMARY_FILE
+        if not layout_db.exists():
+            return None
+        
+        summary = None
+        if summary_file.exists():
+            try:
+                with open(summary_file, 'r', encoding='utf-8') as f:
+                    summary = json.load(f)
+            except (OSError, ValueError):
+                summary = None
+        
+        if summary is None:
+            return self.write_layout_summary()
+        
+        stat = layout_db.stat()
+        if (summary.get('layout_size'), summary.get('layout_mtime_ns')) == (stat.st_size, stat.st_mtime_ns):
+            return summary
+        
+        if summary.get('checksum') == self._file_sha256(layout_db):
+            # Fichier touché sans modification de contenu : mettre à jour la signature seulement
+            summary['layout_size'] = stat.st_size
+            summary['layout_mtime_ns'] = stat.st_mtime_ns
+            with open(summary_file, 'w', encoding='utf-8') as f:
+                json.dump(summary, f, indent=2)
+            return summary
+        
+        return self.write_layout_summary()
+
+    def layout_needs_prepare(self):
+        """Indique si prepare doit être relancé (layout absent, vide ou sources modifiées)"""
+        summary = self.get_layout_summary()
+        if not summary:
+            needs, reason = True, "layout absent"
+        elif summary['box_count'] == 0 or summary['page_count'] == 0:
+            needs, reason = True, f"layout vide: {summary['box_count']} boxes, {summary['page_count']} pages"
+        elif summary.get('source_hash') != self._layout_source_hash():
+            needs, reason = True, "sources LaTeX/CSV modifiées depuis le dernier prepare"
+        else:
+            needs, reason = False, f"{summary['box_count']} boxes, {summary['page_count']} pages"
+        record_cache('layout_summary', not needs)
+        return needs, reason
+
     def _clean_old_files(self):
-        """Nettoie les anciens fichiers de compilation"""
-        extensions_to_clean = ['*.pdf', '*.aux', '*.log', '*.fls', '*.fdb_latexmk', '*.out', '*.synctex.gz']
+        """Nettoie les anciens fichiers de compilation.
+
+        Les .aux sont conservés : ils permettent aux compilations suivantes
+        de n'effectuer qu'une passe quand les références n'ont pas changé.
+        """
+        extensions_to_clean = ['*.pdf', '*.log', '*.fls', '*.fdb_latexmk', '*.out', '*.synctex.gz']
         for ext in extensions_to_clean:
             for file in self.project_path.glob(ext):
                 try:
@@ -368,74 +855,225 @@ class AMCManager:
                     self.logger.warning(f"Impossible de nettoyer {file}: {e}")
     
     
+    def _sqlite_signature(self, *names):
+        """Taille/date des bases du projet, pour invalider les résultats mémorisés"""
+        signature = []
+        for name in names:
+            path = self.data_path / name
+            if path.exists():
+                stat = path.stat()
+                signature.append((name, stat.st_size, stat.st_mtime_ns))
+        return tuple(signature)
+
     def get_analysis_statistics(self):
-        """Récupère les statistiques de l'analyse (copies détectées, erreurs, etc.)"""
+        """Récupère les statistiques de l'analyse (copies détectées, erreurs, etc.).
+
+        Calculées en SQL directement sur capture.sqlite et association.sqlite, et
+        mémorisées tant que ces bases ne changent pas.
+        """
+        signature = self._sqlite_signature('capture.sqlite', 'association.sqlite')
+        if self._analysis_stats_cache and self._analysis_stats_cache[0] == signature:
+            record_cache('analysis_statistics', True)
+            return dict(self._analysis_stats_cache[1])
+        record_cache('analysis_statistics', False)
+        
         stats = {
             'papers_detected': 0,
+            'pages_detected': 0,
             'papers_with_errors': 0,
             'unreadable_papers': 0,
             'missing_student_codes': 0,
             'duplicate_codes': 0
         }
         
+        capture_db = self.data_path / 'capture.sqlite'
+        association_db = self.data_path / 'association.sqlite'
+        
         try:
-            # Chercher les fichiers de résultats d'analyse dans cr/
-            cr_files = list(self.cr_path.glob('*.xml'))
+            if not capture_db.exists():
+                # Pas encore d'analyse : seulement les éventuels fichiers de résultats dans cr/
+                stats['papers_detected'] = len(list(self.cr_path.glob('*.xml')))
+                return stats
             
-            if cr_files:
-                stats['papers_detected'] = len(cr_files)
-                
-                # Analyser les fichiers XML pour détecter les erreurs
-                # (ici simplifié, vous pourriez parser le XML pour plus de détails)
+            import sqlite3
+            conn = sqlite3.connect(f"file:{capture_db}?mode=ro", uri=True)
+            try:
+                stats['pages_detected'] = conn.execute("SELECT COUNT(*) FROM capture_page").fetchone()[0]
+                stats['papers_detected'] = conn.execute(
+                    "SELECT COUNT(*) FROM (SELECT DISTINCT student, copy FROM capture_page)").fetchone()[0]
+                try:
+                    stats['unreadable_papers'] = conn.execute("SELECT COUNT(*) FROM capture_failed").fetchone()[0]
+                except sqlite3.OperationalError:
+                    pass
                 
-            # Alternative: utiliser la commande AMC pour obtenir des stats
-            # Path for --data is relative to cwd (self.project_path)
-            cmd = f"auto-multiple-choice export --data '{self.data_path.name}' --module CSV --fich-noms liste.csv --stats-only"
-            result = self.run_command(cmd, check=False)
+                if association_db.exists():
+                    conn.execute("ATTACH DATABASE ? AS assoc", (f"file:{association_db}?mode=ro",))
+                    # Copies capturées sans identifiant étudiant (ni manuel ni automatique)
+                    stats['missing_student_codes'] = conn.execute("""
+                        SELECT COUNT(*) FROM (SELECT DISTINCT student, copy FROM capture_page) p
+                        LEFT JOIN assoc.association_association a
+                               ON a.student = p.student AND a.copy = p.copy
+                        WHERE COALESCE(a.manual, a.auto) IS NULL
+                    """).fetchone()[0]
+                    # Identifiants associés à plusieurs copies
+                    stats['duplicate_codes'] = conn.execute("""
+                        SELECT COUNT(*) FROM (
+                            SELECT COALESCE(manual, auto) AS code FROM assoc.association_association
+                            WHERE COALESCE(manual, auto) IS NOT NULL
+                            GROUP BY code HAVING COUNT(*) > 1
+                        )
+                    """).fetchone()[0]
+                else:
+                    stats['missing_student_codes'] = stats['papers_detected']
+            finally:
+                conn.close()
             
-            if result['success'] and result['stdout']:
-                # Parser les stats de la sortie (format dépend de la version AMC)
-                lines = result['stdout'].split('\n')
-                for line in lines:
-                    if 'papers' in line.lower():
-                        # Extraire le nombre de copies
-                        import re
-                        numbers = re.findall(r'\d+', line)
-                        if numbers:
-                            stats['papers_detected'] = int(numbers[0])
+            stats['papers_with_errors'] = stats['missing_student_codes'] + stats['duplicate_codes']
+            self._analysis_stats_cache = (signature, dict(stats))
         
         except Exception as e:
             self.logger.error(f"Erreur statistiques analyse: {e}")
         
         return stats
     
+    LATEX_BUILD_DIR = 'build'
+    LATEX_MAX_PASSES = 3
+    # Messages pdflatex/LaTeX indiquant qu'une passe supplémentaire est nécessaire
+    LATEX_RERUN_MARKERS = ('Rerun to get', 'Label(s) may have changed', 'Rerun LaTeX')
+    # Erreurs après lesquelles le PDF produit (s'il existe) est incomplet
+    LATEX_FATAL_MARKERS = ('Fatal error occurred', 'Emergency stop', '==> Fatal error')
+
+    LATEX_FORMAT_NAME = 'amc-preamble'
+    LATEX_DUMP_MARKER = r'\csname endofdump\endcsname'
+
+    def _ensure_latex_format(self, latex_file):
+        """Construit (ou réutilise) le format LaTeX précompilé du préambule fixe.
+
+        Le préambule jusqu'à \\endofdump est compilé avec mylatexformat dans le
+        répertoire de build ; il n'est reconstruit que si son empreinte change.
+        Retourne {'name', 'env'} ou None si le format est indisponible.
+        """
+        try:
+            tex_content = latex_file.read_text(encoding='utf-8')
+        except OSError:
+            return None
+        
+        if self.LATEX_DUMP_MARKER not in tex_content:
+            return None
+        preamble = tex_content.split(self.LATEX_DUMP_MARKER, 1)[0]
+        digest = hashlib.sha256(preamble.encode('utf-8')).hexdigest()
+        
+        build_dir = self.project_path / self.LATEX_BUILD_DIR
+        build_dir.mkdir(exist_ok=True)
+        fmt_file = build_dir / f"{self.LATEX_FORMAT_NAME}.fmt"
+        stamp_file = build_dir / f"{self.LATEX_FORMAT_NAME}.sha256"
+        latex_format = {
+            'name': self.LATEX_FORMAT_NAME,
+            # Chemin de recherche des formats : build/ puis chemins TeX par défaut
+            'env': f"TEXFORMATS='{build_dir.resolve()}:'"
+        }
+        
+        stamp = stamp_file.read_text().strip() if stamp_file.exists() else ''
+        if stamp == digest and fmt_file.exists():
+            record_cache('latex_format', True)
+            return latex_format
+        if stamp == f"failed:{digest}":
+            return None
+        
+        if not shutil.which('pdftex'):
+            return None
+        
+        record_cache('latex_format', False)
+        self.logger.info("Construction du format LaTeX précompilé du préambule...")
+        source = build_dir / f"{self.LATEX_FORMAT_NAME}.tex"
+        source.write_text(preamble + self.LATEX_DUMP_MARKER + "\n\\begin{document}\n\\end{document}\n",
+                          encoding='utf-8')
+        result = self.run_command(
+            f"pdftex -ini -interaction=nonstopmode -jobname='{self.LATEX_FORMAT_NAME}' "
+            f"-output-directory '{self.LATEX_BUILD_DIR}' '&pdflatex' mylatexformat.ltx "
+            f"'{source.relative_to(self.project_path)}'",
+            check=False
+        )
+        
+        if result['success'] and fmt_file.exists():
+            stamp_file.write_text(digest)
+            self.logger.info(f"Format LaTeX précompilé prêt: {fmt_file}")
+            return latex_format
+        
+        # Ne pas retenter à chaque compilation tant que le préambule est identique
+        stamp_file.write_text(f"failed:{digest}")
+        self.logger.warning(f"Format LaTeX précompilé indisponible: {result.get('stderr', '')[:200]}")
+        return None
+
+    def _compile_latex_incremental(self, latex_file):
+        """Compile avec pdflatex dans un répertoire de build persistant.
+
+        Le .aux de la compilation précédente est conservé : une nouvelle passe
+        n'est lancée que si le log la réclame ou si le .aux a changé pendant la passe.
+        """
+        build_dir = self.project_path / self.LATEX_BUILD_DIR
+        build_dir.mkdir(exist_ok=True)
+        aux_file = build_dir / f"{latex_file.stem}.aux"
+        log_file = build_dir / f"{latex_file.stem}.log"
+        pdf_file = build_dir / f"{latex_file.stem}.pdf"
+        # Un PDF d'une compilation précédente ne doit pas passer pour le résultat de celle-ci
+        if pdf_file.exists():
+            pdf_file.unlink()
+        
+        def aux_digest():
+            return self._file_sha256(aux_file) if aux_file.exists() else None
+        
+        latex_format = self._ensure_latex_format(latex_file)
+        format_env = f"{latex_format['env']} " if latex_format else ''
+        format_option = f"-fmt={latex_format['name']} " if latex_format else ''
+        
+        result = {'success': False, 'stdout': '', 'stderr': ''}
+        passes = 0
+        for passes in range(1, self.LATEX_MAX_PASSES + 1):
+            aux_before = aux_digest()
+            cmd = (f"{format_env}pdflatex {format_option}-interaction=nonstopmode "
+                   f"-output-directory '{self.LATEX_BUILD_DIR}' '{latex_file.name}'")
+            self.logger.info(f"Pass {passes} : {cmd}")
+            result = self.run_command(cmd, check=False)
+            
+            log_text = log_file.read_text(encoding='utf-8', errors='replace') if log_file.exists() else ''
+            # run_command(check=False) rapporte success=True quel que soit le code de retour
+            failed = (result.get('returncode') not in (0, None) or not result.get('success')
+                      or any(marker in log_text for marker in self.LATEX_FATAL_MARKERS))
+            if failed:
+                self.logger.error(f"Échec pdflatex (passe {passes}, code {result.get('returncode')})")
+                result['success'] = False
+                break
+            rerun = any(marker in log_text for marker in self.LATEX_RERUN_MARKERS)
+            if not rerun and aux_digest() == aux_before:
+                break
+            self.logger.info("Références modifiées, nouvelle passe nécessaire")
+        
+        result['passes'] = passes
+        result['pdf_path'] = pdf_file
+        return result
+
     def _fallback_pdflatex_compilation(self, latex_file):
         """Compilation de secours avec pdflatex"""
         self.logger.info("Tentative de compilation directe avec pdflatex...")
         
-        # abs_latex_file = latex_file.resolve() # Not needed as cwd is project_path and file.name is used
-        # abs_project_path = self.project_path.resolve() # Not needed as cwd is project_path
-        
-        # Compiler 2 fois pour résoudre les références
-        for i in range(2):
-            # Command should be relative to cwd which is project_path
-            cmd = f"pdflatex -interaction=nonstopmode -output-directory '.' '{latex_file.name}'"
-            self.logger.info(f"Pass {i+1} : {cmd}")
-            result = self.run_command(cmd, check=False)
+        result = self._compile_latex_incremental(latex_file)
         
         # Vérifier si le PDF existe
-        pdf_output = self.project_path / f"{latex_file.stem}.pdf"
-        if pdf_output.exists() and pdf_output.stat().st_size > 1000:
+        pdf_output = result['pdf_path']
+        if result.get('success') and pdf_output.exists() and pdf_output.stat().st_size > 1000:
             standard_pdf = self.project_path / 'questionnaire_output.pdf'
             try:
                 shutil.copy2(pdf_output, standard_pdf)
-                self.logger.info(f"PDF de secours créé : {standard_pdf}")
+                self._record_subject_pdf(standard_pdf)
+                self.logger.info(f"PDF de secours créé en {result['passes']} passe(s) : {standard_pdf}")
                 
                 return {
                     'success': True,
                     'stdout': result.get('stdout', ''),
                     'stderr': result.get('stderr', ''),
                     'method': 'pdflatex_fallback',
+                    'passes': result['passes'],
                     'pdf_size': pdf_output.stat().st_size,
                     'warnings': 'PDF créé avec pdflatex (sans marques AMC)'
                 }
@@ -463,7 +1101,7 @@ class AMCManager:
             scoring_params = "--bareme default"
         
         # Path for --data is relative to cwd (self.project_path)
-        cmd = f"auto-multiple-choice note --data {self.data_path.name} {scoring_params}"
+        cmd = f"auto-multiple-choice note --data {self.data_path.name} {scoring_params}{self._progress_options('note')}"
         result = self.run_command(cmd)
         
         if result['success']:
@@ -471,63 +1109,243 @@ class AMCManager:
         
         return result
     
+    def _load_student_names(self):
+        """Table numéro de copie AMC -> "NOM Prénom".
+
+        AMC numérote les copies dans l'ordre des lignes de liste.csv (\\csvreader),
+        donc la clé est la position de l'élève dans la liste (1, 2, ...).
+        students.json, écrit dans le même ordre, sert de repli.
+        """
+        names_map = {}
+        liste_file = self.project_path / 'liste.csv'
+        students_file = self.project_path / 'students.json'
+        
+        if liste_file.exists():
+            with open(liste_file, 'r', encoding='utf-8', newline='') as f:
+                for position, row in enumerate(csv.DictReader(f), 1):
+                    if row.get('nom') or row.get('prenom'):
+                        names_map[str(position)] = f"{row.get('nom', '')} {row.get('prenom', '')}".strip()
+        elif students_file.exists():
+            with open(students_file, 'r', encoding='utf-8') as f:
+                for position, student in enumerate(json.load(f), 1):
+                    names_map[str(position)] = f"{student.get('nom', '')} {student.get('prenom', '')}".strip()
+        
+        return names_map
+
     def fix_csv_names(self, csv_file_path):
-        """Corrige les noms dans le fichier CSV généré"""
+        """Corrige les noms dans le fichier CSV généré.
+
+        Le fichier est lu une seule fois ligne par ligne ; chaque nom est retrouvé
+        par la clé élève AMC (première colonne) dans une table de hachage, puis le
+        résultat remplace l'original de façon atomique.
+        """
+        csv_file_path = Path(csv_file_path)
+        tmp_path = None
         try:
-            # Lire le fichier liste.csv pour récupérer les noms
-            names_map = {}
-            liste_file = self.project_path / 'liste.csv'
-            if liste_file.exists():
-                with open(liste_file, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        # Utiliser l'ID comme clé et construire le nom complet
-                        student_id = row['id'].lstrip('0')  # Enlever les zéros devant (001 -> 1)
-                        full_name = f"{row['nom']} {row['prenom']}"
-                        names_map[student_id] = full_name
-            
-            # Corriger le fichier CSV des notes
-            if names_map and csv_file_path.exists():
-                with open(csv_file_path, 'r') as file:
-                    content = file.read()
-                
-                for student_id, name in names_map.items():
-                    old_line = f'"{student_id}","","?","'
-                    new_line = f'"{student_id}","","{name}","'
-                    content = content.replace(old_line, new_line)
+            names_map = self._load_student_names()
+            if not names_map or not csv_file_path.exists():
+                return
+            
+            with open(csv_file_path, 'r', encoding='utf-8', newline='') as source:
+                header_line = source.readline()
+                delimiter = ';' if header_line.count(';') > header_line.count(',') else ','
+                source.seek(0)
+                reader = csv.reader(source, delimiter=delimiter)
+                header = next(reader, None)
+                if not header:
+                    return
                 
-                with open(csv_file_path, 'w') as file:
-                    file.write(content)
+                # Colonne du nom : en-tête explicite, sinon 3e colonne (format AMC)
+                name_index = next((i for i, col in enumerate(header)
+                                   if col.strip().lower() in ('nom', 'name')), 2)
                 
-                self.logger.info(f"Noms corrigés dans {csv_file_path}")
+                fixed_count = 0
+                with tempfile.NamedTemporaryFile('w', encoding='utf-8', newline='', delete=False,
+                                                 dir=csv_file_path.parent, suffix='.tmp') as target:
+                    tmp_path = target.name
+                    writer = csv.writer(target, delimiter=delimiter, quoting=csv.QUOTE_ALL)
+                    writer.writerow(header)
+                    for row in reader:
+                        if len(row) > name_index and row[name_index] in ('', '?'):
+                            name = names_map.get(row[0].lstrip('0'))
+                            if name:
+                                row[name_index] = name
+                                fixed_count += 1
+                        writer.writerow(row)
+            
+            os.replace(tmp_path, csv_file_path)
+            tmp_path = None
+            self.logger.info(f"Noms corrigés dans {csv_file_path} ({fixed_count} lignes)")
         except Exception as e:
             self.logger.error(f"Erreur lors de la correction des noms: {e}")
+        finally:
+            if tmp_path and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
 
-    def export_results(self, format_type='csv'):
-        """Exporte les résultats"""
+    def _write_columnar_results(self, csv_file):
+        """Écrit exports/notes.arrow à partir du CSV des notes"""
+        try:
+            from results_store import write_columnar_results
+        except ImportError:
+            self.logger.warning("Pandas non installé, pas de stockage colonne des résultats")
+            return
+        
+        if csv_file.exists():
+            result = write_columnar_results(csv_file)
+            if result['success']:
+                self.logger.info(f"Résultats colonne écrits: {result['file_path']} ({result['rows']} lignes)")
+            else:
+                self.logger.warning(result['error'])
+
+    def _csv_export_is_fresh(self, csv_file):
+        """notes.csv existe et est postérieur au dernier calcul des notes (scoring.sqlite)"""
+        scoring_db = self.data_path / 'scoring.sqlite'
+        if not csv_file.exists():
+            return False
+        return not scoring_db.exists() or csv_file.stat().st_mtime_ns >= scoring_db.stat().st_mtime_ns
+
+    def export_results(self, format_type='csv', reuse_csv=False):
+        """Exporte les résultats.
+
+        format_type='all' : l'export ODS d'AMC (notes.ods, avec sa mise en forme)
+        tourne en parallèle de l'export CSV ; XLSX et Arrow sont ensuite écrits
+        depuis une seule lecture de notes.csv.
+        reuse_csv : notes.csv déjà exporté depuis le dernier calcul des notes n'est pas régénéré.
+        """
         results = []
+        if format_type == 'ods':
+            results.append(self._export_amc_ods())
+        
+        ods_pool = ods_future = None
+        if format_type == 'all':
+            # L'export ODS d'AMC relit les bases AMC, pas notes.csv : il n'attend pas les autres formats
+            from concurrent.futures import ThreadPoolExecutor
+            ods_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='amc-export-ods')
+            ods_future = ods_pool.submit(self._export_amc_ods)
+            ods_pool.shutdown(wait=False)
+        
         if format_type in ['csv', 'all']:
             # Export CSV
             csv_file = self.exports_path / 'notes.csv'
-            # Path for --data is relative to cwd (self.project_path)
-            cmd = f"auto-multiple-choice export --data {self.data_path.name} --module CSV --fich-noms liste.csv --o '{csv_file.relative_to(self.project_path)}'"
-            result = self.run_command(cmd)
-            results.append(('CSV', result, str(csv_file)))
-            # Corriger les noms dans le fichier CSV
-            self.fix_csv_names(csv_file)
-            
-        if format_type in ['ods', 'all']:
-            # Export OpenDocument
-            ods_file = self.exports_path / 'notes.ods'
-            # Path for --data is relative to cwd (self.project_path)
-            cmd = f"auto-multiple-choice export --data {self.data_path.name} --module ODS --fich-noms liste.csv --o '{ods_file.relative_to(self.project_path)}'"
-            result = self.run_command(cmd)
-            results.append(('ODS', result, str(ods_file)))
+            if reuse_csv and self._csv_export_is_fresh(csv_file):
+                self.logger.info("notes.csv à jour, export CSV AMC non relancé")
+                results.append(('CSV', {'success': True, 'reused': True}, str(csv_file)))
+            else:
+                # Path for --data is relative to cwd (self.project_path)
+                cmd = f"auto-multiple-choice export --data {self.data_path.name} --module CSV --fich-noms liste.csv --o '{csv_file.relative_to(self.project_path)}'"
+                result = self.run_command(cmd)
+                results.append(('CSV', result, str(csv_file)))
+                # Corriger les noms dans le fichier CSV
+                self.fix_csv_names(csv_file)
+            
+            if format_type == 'all' and csv_file.exists():
+                # Une seule lecture des notes pour tous les formats dérivés
+                from results_store import read_results_csv, export_frame
+                frame_results = export_frame(read_results_csv(csv_file), self.exports_path)
+                for fmt, fmt_result in frame_results.items():
+                    if fmt_result['success']:
+                        results.append((fmt.upper(), fmt_result, fmt_result['file_path']))
+                    else:
+                        self.logger.warning(f"Export {fmt} ignoré: {fmt_result['error']}")
+            else:
+                # Version colonne typée pour les statistiques (lecture sans parsing CSV)
+                self._write_columnar_results(csv_file)
+            
+        if ods_future is not None:
+            results.append(ods_future.result())
+        
+        # Empreintes enregistrées à la génération (ETag des téléchargements)
+        for _, result, file_path in results:
+            if result.get('success'):
+                self._record_output(file_path)
         return results
     
+    def _export_amc_ods(self):
+        """Export OpenDocument d'AMC : ('ODS', résultat, chemin)"""
+        ods_file = self.exports_path / 'notes.ods'
+        # Path for --data is relative to cwd (self.project_path)
+        cmd = f"auto-multiple-choice export --data {self.data_path.name} --module ODS --fich-noms liste.csv --o '{ods_file.relative_to(self.project_path)}'"
+        return ('ODS', self.run_command(cmd), str(ods_file))
+
+    # Archive des copies annotées, construite pendant l'annotation et servie telle quelle
+    ANNOTATED_ARCHIVE = 'copies_annotees.zip'
+
+    def _annotated_signature(self, annotated_dir):
+        """Signature (nom, taille, date) du contenu de exports/annotated, sans relire les PDF"""
+        digest = hashlib.sha256()
+        for file_path in sorted(p for p in annotated_dir.rglob('*') if p.is_file()):
+            stat = file_path.stat()
+            digest.update(f"{file_path.relative_to(annotated_dir).as_posix()}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def _archive_compression(file_path):
+        # Les PDF sont déjà compressés : les recompresser coûte du CPU pour rien
+        return zipfile.ZIP_STORED if file_path.suffix.lower() == '.pdf' else zipfile.ZIP_DEFLATED
+
+    def _open_annotated_archive(self):
+        """Ouvre l'archive temporaire dans laquelle chaque copie est ajoutée dès qu'elle est rendue"""
+        archive_file = self.exports_path / self.ANNOTATED_ARCHIVE
+        tmp_file = archive_file.with_name(f"{archive_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        return tmp_file, zipfile.ZipFile(tmp_file, 'w', zipfile.ZIP_STORED)
+
+    def _discard_annotated_archive(self, tmp_file, archive):
+        archive.close()
+        try:
+            tmp_file.unlink()
+        except OSError:
+            pass
+
+    def _close_annotated_archive(self, tmp_file, archive, written=()):
+        """Complète l'archive avec les fichiers du dossier non encore ajoutés, puis la publie"""
+        annotated_dir = self.exports_path / 'annotated'
+        written = set(written)
+        try:
+            for file_path in sorted(p for p in annotated_dir.rglob('*') if p.is_file()):
+                arcname = file_path.relative_to(annotated_dir).as_posix()
+                if arcname not in written:
+                    archive.write(file_path, arcname, compress_type=self._archive_compression(file_path))
+            archive.close()
+        except Exception:
+            self._discard_annotated_archive(tmp_file, archive)
+            raise
+
+        archive_file = self.exports_path / self.ANNOTATED_ARCHIVE
+        os.replace(tmp_file, archive_file)
+        self._record_output(archive_file, source_signature=self._annotated_signature(annotated_dir))
+        return archive_file
+
+    def build_annotated_archive(self):
+        """Reconstruit l'archive ZIP à partir du dossier des copies annotées"""
+        tmp_file, archive = self._open_annotated_archive()
+        return self._close_annotated_archive(tmp_file, archive)
+
+    def annotated_archive(self):
+        """Chemin de l'archive des copies annotées (None s'il n'y en a aucune).
+
+        L'archive n'est reconstruite que si le dossier a changé depuis sa
+        construction (copies ajoutées ou remplacées hors du pipeline).
+        """
+        annotated_dir = self.exports_path / 'annotated'
+        if not annotated_dir.exists() or not any(p.is_file() for p in annotated_dir.rglob('*')):
+            return None
+
+        archive_file = self.exports_path / self.ANNOTATED_ARCHIVE
+        entry = get_file_entry(self.project_path, archive_file)
+        if entry and entry.get('source_signature') == self._annotated_signature(annotated_dir):
+            record_cache('annotated_archive', True)
+            return archive_file
+        record_cache('annotated_archive', False)
+
+        self.logger.info("Archive des copies annotées absente ou périmée, reconstruction")
+        return self.build_annotated_archive()
+
     def generate_annotated_papers(self):
         """Génère les copies annotées - Version manuelle directe"""
         
+        # Pages supprimées par la rétention (prune) régénérées avant de les relire
+        self.ensure_prepared_scans()
+        
         # Nettoyer d'abord les anciens PDF vides si ils existent
         self._cleanup_old_empty_pdfs()
         
@@ -564,6 +1382,8 @@ class AMCManager:
         cr_pdf_dir = self.cr_path / 'corrections' / 'pdf'
         cr_pdf_dir.mkdir(parents=True, exist_ok=True)
         
+        # AMC annotate relit les scans référencés par capture.sqlite (prepared_scans)
+        self.ensure_prepared_scans()
         cmd = f"auto-multiple-choice annotate --data '{self.data_path.name}' --cr '{self.cr_path.name}'"
         result = self.run_command(cmd)
         
@@ -575,6 +1395,7 @@ class AMCManager:
                 for pdf_file in pdf_files:
                     shutil.copy2(pdf_file, annotated_dir)
                 self.logger.info(f"Copies annotées AMC copiées: {len(pdf_files)} fichiers")
+                self.build_annotated_archive()
             except Exception as e:
                 self.logger.error(f"Erreur copie: {e}")
         
@@ -594,6 +1415,7 @@ class AMCManager:
     
     def generate_manual_annotated_papers(self):
         """Génère les copies annotées manuellement (remplacement de la méthode AMC défaillante)"""
+        archive = None
         try:
             from reportlab.pdfgen import canvas
             from reportlab.lib.pagesizes import A4
@@ -632,6 +1454,10 @@ class AMCManager:
             
             generated_files = []
             
+            # Chaque copie est ajoutée à l'archive ZIP dès qu'elle est rendue
+            archive_tmp, archive = self._open_annotated_archive()
+            archived = set()
+            
             # Générer une copie annotée pour chaque étudiant
             for student_id, student_name in students.items():
                 output_file = annotated_dir / f"copie_annotee_{student_id}_{student_name.replace(' ', '_')}.pdf"
@@ -702,11 +1528,14 @@ class AMCManager:
                 
                 # Sauvegarder le PDF
                 c.save()
+                archive.write(output_file, output_file.name, compress_type=zipfile.ZIP_STORED)
+                archived.add(output_file.name)
                 generated_files.append(str(output_file))
                 
                 self.logger.info(f"Copie annotée générée: {output_file}")
             
             self.logger.info(f"Toutes les copies annotées générées: {len(generated_files)} fichiers")
+            archive_file = self._close_annotated_archive(archive_tmp, archive, archived)
             
             return {
                 'success': True,
@@ -714,7 +1543,8 @@ class AMCManager:
                 'stderr': '',
                 'returncode': 0,
                 'command': 'generate_manual_annotated_papers',
-                'generated_files': generated_files
+                'generated_files': generated_files,
+                'archive': str(archive_file)
             }
             
         except ImportError:
@@ -726,6 +1556,8 @@ class AMCManager:
                 'command': 'generate_manual_annotated_papers'
             }
         except Exception as e:
+            if archive is not None:
+                self._discard_annotated_archive(archive_tmp, archive)
             self.logger.error(f"Erreur génération copies annotées manuelles: {e}")
             return {
                 'success': False,
@@ -733,6 +1565,13 @@ class AMCManager:
                 'command': 'generate_manual_annotated_papers'
             }
     
+    def _results_frame(self):
+        """Notes de l'exécution courante, chargées une seule fois (ImportError sans pandas)"""
+        if self._results_context is None:
+            from results_store import ResultsContext
+            self._results_context = ResultsContext(self.exports_path)
+        return self._results_context.frame()
+
     def get_statistics(self):
         """Récupère les statistiques du projet"""
         try:
@@ -748,10 +1587,9 @@ class AMCManager:
             csv_file = self.exports_path / 'notes.csv'
             if csv_file.exists():
                 try:
-                    import pandas as pd
-                    df = pd.read_csv(csv_file)
+                    df = self._results_frame()
                     
-                    if not df.empty and 'Note' in df.columns:
+                    if df is not None and not df.empty and 'Note' in df.columns:
                         stats['total_papers'] = len(df)
                         stats['average_score'] = float(df['Note'].mean())
                         stats['min_score'] = float(df['Note'].min())
@@ -874,32 +1712,80 @@ class AMCManager:
         
         return result
 
-    def auto_scan_detection(self, scan_files):
-        """Détection automatique des paramètres de scan optimaux"""
-        detection_results = []
+    def check_scan_registration(self, image_files=None):
+        """Prépasse rapide : repère les pages dont les marques de calage sont introuvables.
+
+        Les positions attendues viennent de layout_mark ; par défaut les images
+        préparées (ou, à défaut, les images téléversées) sont contrôlées.
+        """
+        if not CORNER_CHECK_ENABLED:
+            return {'success': False, 'error': 'Pillow ou numpy non installé, contrôle des marques désactivé'}
         
-        for scan_file in scan_files:
-            # Convertir pdf_path en chemin relatif au répertoire du projet
-            # input_pdf_relative_to_project = pdf_path.relative_to(self.project_path) # pdf_path is not defined here. Assuming scan_file
-            input_pdf_relative_to_project = scan_file.relative_to(self.project_path)
-            # Le dossier de destination 'prepared_scans' est implicitement relatif au répertoire du projet
-            cmd = f"auto-multiple-choice getimages --vector-density 300 --copy-to 'prepared_scans' '{input_pdf_relative_to_project}'"
-            result = self.run_command(cmd)
-            
-            if result['success']:
-                detection_results.append({
-                    'file': str(scan_file), # Convert Path to string
-                    'pages': result['stdout'].count('\n'),
-                    'detected': True
-                })
-            else:
-                detection_results.append({
-                    'file': str(scan_file), # Convert Path to string
-                    'error': result.get('stderr', 'Erreur de détection'),
-                    'detected': False
-                })
+        marks = load_corner_marks(self.data_path / 'layout.sqlite')
+        if not marks:
+            return {'success': False, 'error': 'Positions des marques de calage indisponibles (layout_mark)'}
+        
+        if image_files is None:
+            image_extensions = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
+            prepared_path = self.project_path / 'prepared_scans'
+            image_files = [f for f in prepared_path.glob('*') if f.suffix.lower() in image_extensions]
+            if not image_files:
+                image_files = [f for f in self.uploads_path.glob('*') if f.suffix.lower() in image_extensions]
         
-        return detection_results
+        pages = check_corner_marks(sorted(image_files), marks)
+        unregistrable = [page for page in pages if not page['registrable']]
+        if unregistrable:
+            self.logger.warning(f"{len(unregistrable)} page(s) sans marques de calage repérables: "
+                                f"{', '.join(page['file'] for page in unregistrable)}")
+        
+        return {
+            'success': True,
+            'checked': len(pages),
+            'unregistrable': unregistrable,
+            'pages': pages
+        }
+
+    def check_uploaded_scans_registration(self):
+        """Contrôle des marques de calage sur les fichiers téléversés actuels (sur demande).
+
+        Les pages des PDF sont les images intégrées extraites par pdfimages, en
+        parallèle sur tous les PDF, sans rastérisation ; prepared_scans
+        (éventuellement périmé) n'est ni lu ni modifié.
+        """
+        if not CORNER_CHECK_ENABLED:
+            return {'success': False, 'status': 'not_checked',
+                    'error': 'Pillow ou numpy non installé, contrôle des marques désactivé'}
+        if not load_corner_marks(self.data_path / 'layout.sqlite'):
+            return {'success': False, 'status': 'not_checked',
+                    'error': 'Positions des marques de calage indisponibles (layout_mark)'}
+        
+        image_extensions = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
+        uploads = sorted(f for f in self.uploads_path.glob('*') if f.is_file())
+        image_files = [f for f in uploads if f.suffix.lower() in image_extensions]
+        pdf_files = [f for f in uploads if f.suffix.lower() == '.pdf']
+        
+        extract_dir = Path(tempfile.mkdtemp(prefix='.scan_check.', dir=self.project_path))
+        try:
+            extracted, errors = extract_scans_images(pdf_files, extract_dir)
+            image_files += extracted
+            if not image_files:
+                return {'success': False, 'status': 'not_checked', 'errors': errors,
+                        'error': 'Aucune page à contrôler'}
+            registration = self.check_scan_registration(image_files)
+        finally:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+        
+        registration['status'] = 'checked' if registration['success'] else 'not_checked'
+        registration['errors'] = errors
+        return registration
+
+    def auto_scan_detection(self, scan_files):
+        """Détection des paramètres des scans (pages, dimensions, DPI) sans rastérisation.
+
+        Les fichiers sont lus en parallèle depuis leur structure (pdfinfo/pdfimages,
+        en-têtes d'image) ; prepared_scans n'est pas modifié.
+        """
+        return inspect_scans(scan_files)
 
     def prepare_scan_images(self, scan_path=None, dpi=300):
         """Prépare et optimise les images scannées pour l'analyse"""
@@ -910,7 +1796,6 @@ class AMCManager:
         self.logger.info(f"DEBUG: scan_path effectif: {str(scan_path)}")
         
         scan_files = []
-        processed_files = [] 
         
         for ext in ['*.pdf', '*.jpg', '*.png', '*.jpeg', '*.tiff', '*.tif']:
             self.logger.debug(f"DEBUG_GLOB_SEARCH: Searching for pattern: {ext} in {scan_path}")
@@ -933,10 +1818,26 @@ class AMCManager:
         for old_file in prepared_path.glob('*'):
             if old_file.is_file():
                 old_file.unlink()
+        shutil.rmtree(prepared_path / SKIPPED_DIR, ignore_errors=True)
         
         self.logger.info(f"DEBUG: Dossier de sortie des scans préparés: {str(prepared_path)}")
         
-        for scan_file in scan_files:
+        # Origine de chaque page (permet à la rétention de supprimer les pages régénérables)
+        scan_sources = {}
+        
+        # Un même contenu uploadé sous plusieurs noms n'est converti et analysé qu'une fois
+        scan_hashes = {}
+        duplicate_uploads = []
+        for scan_file in sorted(scan_files):
+            digest = file_sha256(scan_file)
+            if digest in scan_hashes:
+                duplicate_uploads.append({'file': scan_file.name, 'duplicate_of': scan_hashes[digest].name})
+            else:
+                scan_hashes[digest] = scan_file
+        if duplicate_uploads:
+            self.logger.info(f"Uploads en double ignorés: {duplicate_uploads}")
+        
+        for digest, scan_file in scan_hashes.items():
             self.logger.info(f"DEBUG_LOOP: Traitement du fichier: {str(scan_file)}")
             try:
                 output_dir_relative_to_project = Path('prepared_scans')
@@ -953,6 +1854,7 @@ class AMCManager:
                     )
                     
                     self.logger.info(f"DEBUG_CMD_PDF: Commande AMC getimages pour PDF: {cmd}")
+                    pages_before = {f.name for f in prepared_path.iterdir()}
                     result = self.run_command(cmd)
 
                     if result['stdout']:
@@ -961,63 +1863,151 @@ class AMCManager:
                         self.logger.warning(f"DEBUG_GETIMAGES_STDERR: Stderr de getimages pour {str(scan_file)}:\n{result['stderr']}")
 
                     if result['success']:
-                        # Attendre un peu que les fichiers soient créés
-                        import time
-                        time.sleep(1.0)  # Augmenté à 1 seconde
-        
-                        # Chercher TOUS les fichiers images dans prepared_scans
-                        image_extensions = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
-                        generated_images = [f for f in prepared_path.iterdir() 
-                                        if f.is_file() and f.suffix.lower() in image_extensions]
-                        
-                        self.logger.info(f"DEBUG_GENERATED: Images générées après conversion PDF pour {str(scan_file.stem)}: {len(generated_images)} images")
-
-                        if generated_images:
-                            # CORRECTION: Filtrer et garder seulement les images principales
-                            main_images = []
-                            for img_path in generated_images:
-                                # Garder seulement les images sans suffixe numérique multiple
-                                if not any(img_path.stem.endswith(f'_{i:04d}') for i in range(1, 50)):
-                                    main_images.append(img_path)
-                                    processed_files.append(str(img_path))
-                            
-                            self.logger.info(f"DEBUG_SUCCESS_PDF: Fichier PDF {str(scan_file)} converti. {len(main_images)} images principales sur {len(generated_images)} générées.")
-                            
-                            # Supprimer les images en trop pour éviter la surcharge
-                            if len(generated_images) > len(main_images):
-                                for img in generated_images:
-                                    if img not in main_images:
-                                        try:
-                                            img.unlink()
-                                            self.logger.debug(f"Image supprimée: {img.name}")
-                                        except:
-                                            pass
-                        else:
-                            self.logger.warning(f"DEBUG_WARN_PDF: Conversion de {str(scan_file)} réussie, mais aucune image trouvée dans {str(prepared_path)}.")
+                        self.logger.info(f"DEBUG_SUCCESS_PDF: Fichier PDF {str(scan_file)} converti.")
+                        source_entry = {'source': input_pdf_relative_to_project.as_posix(),
+                                        'sha256': digest, 'method': 'getimages', 'dpi': dpi}
+                        for page in prepared_path.iterdir():
+                            if page.is_file() and page.name not in pages_before:
+                                scan_sources[page.name] = dict(source_entry, path=page.name)
                     else:
                         self.logger.error(f"DEBUG_ERROR_PDF: Erreur conversion PDF {str(scan_file)}: {result.get('stderr', 'Erreur inconnue')}. Stdout: {result.get('stdout', '')}")
                 else:
                     dest_file = prepared_path / scan_file.name
                     if scan_file != dest_file: 
                         shutil.copy2(scan_file, dest_file)
+                        scan_sources[dest_file.name] = {
+                            'source': scan_file.relative_to(self.project_path).as_posix(),
+                            'sha256': digest, 'method': 'copy', 'path': dest_file.name
+                        }
                         self.logger.info(f"DEBUG_COPY_IMG: Image copiée de {str(scan_file)} vers {str(dest_file)}")
                     else:
                         self.logger.info(f"DEBUG_IMG_ALREADY_THERE: Image déjà à la bonne place: {str(scan_file)}")
 
-                    processed_files.append(str(dest_file))
-
             except Exception as e:
                 self.logger.error(f"DEBUG_EXCEPTION: Erreur inattendue lors du traitement de {str(scan_file)}: {e}")
         
+        # Pré-filtrage : pages blanches et doublons écartés (avec motif) avant l'analyse
+        image_extensions = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
+        prepared_images = [f for f in prepared_path.iterdir()
+                           if f.is_file() and f.suffix.lower() in image_extensions]
+        filter_result = prefilter_images(prepared_images, report_dir=self.project_path,
+                                         skipped_dir=prepared_path / SKIPPED_DIR)
+        processed_files = filter_result['kept']
+        skipped_pages = filter_result['skipped']
+        if filter_result.get('warning'):
+            self.logger.warning(filter_result['warning'])
+        for skipped in skipped_pages:
+            if skipped['file'] in scan_sources:
+                scan_sources[skipped['file']]['path'] = f"{SKIPPED_DIR}/{skipped['file']}"
+        try:
+            scan_retention.write_scan_sources(self.project_path, scan_sources)
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"Origine des pages préparées non enregistrée: {e}")
+        self.logger.info(f"Pré-filtrage: {len(processed_files)} page(s) conservée(s), {len(skipped_pages)} écartée(s)")
+        
         self.logger.info(f"DEBUG_END: prepare_scan_images - Résultat final. Fichiers traités: {len(processed_files)}, chemin préparé: {str(prepared_path)}")
         return {
             'success': len(processed_files) > 0,
             'processed_files': processed_files, 
             'prepared_path': str(prepared_path),
             'total_files_processed': len(processed_files),
-            'total_files_found': len(scan_files)
+            'total_files_found': len(scan_files),
+            'skipped_pages': skipped_pages,
+            'duplicate_uploads': duplicate_uploads
         }
 
+    def apply_scan_retention(self, policy=None):
+        """Réduit l'espace occupé par prepared_scans une fois la correction terminée (voir scan_retention)"""
+        try:
+            report = scan_retention.apply_scan_retention(self.project_path, policy)
+        except Exception as e:
+            self.logger.error(f"Erreur rétention des pages préparées: {e}")
+            return {'success': False, 'error': str(e)}
+        if report.get('success'):
+            self.logger.info(f"Rétention ({report['policy']}): {report['bytes_reclaimed']} octets récupérés, "
+                             f"{len(report['pruned'])} page(s) supprimée(s), {len(report['compacted'])} réencodée(s)")
+        return report
+
+    def schedule_scan_retention(self, policy=None):
+        """Planifie la rétention (puis la mise à jour de l'occupation disque) en tâche de fond"""
+        def task():
+            report = self.apply_scan_retention(policy)
+            self._refresh_disk_usage()
+            return report
+        
+        scan_retention.schedule_scan_retention(self.project_path, task)
+        return {'success': True, 'scheduled': True, 'policy': policy or scan_retention.SCAN_RETENTION_POLICY}
+
+    def _refresh_disk_usage(self):
+        """Met à jour l'occupation disque du projet dans l'index (quotas)"""
+        try:
+            refresh_project_usage(self.project_path)
+        except Exception as e:
+            self.logger.warning(f"Occupation disque non mise à jour: {e}")
+
+    def ensure_prepared_scans(self):
+        """Régénère à la demande les pages supprimées par la rétention (galerie, annotation)"""
+        if not scan_retention.missing_pages(self.project_path):
+            return {'success': True, 'restored': [], 'errors': []}
+        result = self.restore_prepared_scans()
+        if result['errors']:
+            self.logger.warning(f"Pages préparées non régénérées: {result['errors']}")
+        self._refresh_disk_usage()
+        return result
+
+    def restore_prepared_scans(self):
+        """Régénère les pages préparées supprimées par la rétention, à partir de leurs sources"""
+        with scan_retention.project_lock(self.project_path):
+            return self._restore_prepared_scans()
+
+    def _restore_prepared_scans(self):
+        prepared_path = self.project_path / 'prepared_scans'
+        missing = scan_retention.missing_pages(self.project_path)
+        restored, errors = [], []
+
+        by_source = {}
+        for name, entry in missing.items():
+            by_source.setdefault((entry['source'], entry['method']), []).append(name)
+
+        for (source, method), names in by_source.items():
+            source_file = self.project_path / source
+            if not source_file.is_file() or file_sha256(source_file) != missing[names[0]].get('sha256'):
+                errors.append({'source': source, 'error': 'Source absente ou modifiée'})
+                continue
+
+            if method == 'copy':
+                for name in names:
+                    target = prepared_path / missing[name].get('path', name)
+                    target.parent.mkdir(parents=True, exist_ok=True)
+                    shutil.copy2(source_file, target)
+                    restored.append(name)
+                continue
+
+            # getimages : reconversion du PDF dans un dossier temporaire, puis remise en place des pages manquantes
+            restore_dir = prepared_path / '.restore'
+            shutil.rmtree(restore_dir, ignore_errors=True)
+            restore_dir.mkdir(parents=True)
+            try:
+                cmd = (f"auto-multiple-choice getimages --vector-density {missing[names[0]].get('dpi', 300)} "
+                       f"--copy-to '{restore_dir.relative_to(self.project_path)}' '{source}'")
+                result = self.run_command(cmd)
+                if not result['success']:
+                    errors.append({'source': source, 'error': result.get('stderr') or result.get('error')})
+                    continue
+                for name in names:
+                    page = restore_dir / name
+                    if page.exists():
+                        target = prepared_path / missing[name].get('path', name)
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        os.replace(page, target)
+                        restored.append(name)
+                    else:
+                        errors.append({'source': source, 'error': f"Page {name} non régénérée"})
+            finally:
+                shutil.rmtree(restore_dir, ignore_errors=True)
+
+        return {'success': not errors, 'restored': restored, 'errors': errors}
+
     def advanced_analysis(self, scan_path=None, auto_capture=True, threshold=0.5, try_harder=True):
         """Analyse avancée des copies scannées avec options optimisées"""
         if scan_path is None:
@@ -1031,37 +2021,8 @@ class AMCManager:
         # Utiliser les images préparées
         prepared_path = Path(prep_result['prepared_path'])
         
-        # CORRECTION 1: Filtrer uniquement les images principales (sans les copies multiples)
-        scan_files = []
-        
-        # Chercher d'abord les images principales (sans suffixe _0001, _0002, etc.)
-        main_images = []
-        for ext in ['*.jpg', '*.png', '*.jpeg', '*.tiff', '*.tif']:
-            potential_files = list(prepared_path.glob(ext))
-            for f in potential_files:
-                # Ne prendre que les images principales (celles sans _0001, _0002 à la fin)
-                if not any(f.stem.endswith(f'_{i:04d}') for i in range(1, 100)):
-                    main_images.append(f)
-        
-        # Si pas d'images principales, prendre un échantillon des images disponibles
-        if not main_images:
-            all_images = []
-            for ext in ['*.jpg', '*.png', '*.jpeg', '*.tiff', '*.tif']:
-                all_images.extend(list(prepared_path.glob(ext)))
-            
-            # Grouper par page et prendre une image par page
-            pages = {}
-            for img in all_images:
-                # Extraire le numéro de page du nom de fichier
-                stem = img.stem
-                if 'page-' in stem:
-                    page_part = stem.split('page-')[1].split('-')[0]
-                    if page_part not in pages:
-                        pages[page_part] = img
-            
-            main_images = list(pages.values())
-        
-        scan_files = main_images
+        # Pages retenues par le pré-filtrage (pages blanches et doublons déjà écartés)
+        scan_files = [Path(f) for f in prep_result['processed_files']]
         
         self.logger.info(f"Images sélectionnées pour analyse: {len(scan_files)} sur {len(list(prepared_path.glob('*')))}")
         for f in scan_files:
@@ -1116,24 +2077,17 @@ class AMCManager:
         """Génère des rapports détaillés"""
         reports = {}
         
-        # 1. Export CSV détaillé
-        csv_export_results = self.export_results('csv')
-        # export_results returns a list of tuples, so we need to extract the actual result dict
-        if csv_export_results and csv_export_results[0][1]['success']:
-            reports['csv'] = csv_export_results[0][1]
-            reports['csv']['file_path'] = csv_export_results[0][2] # Add file path
-        else:
-            reports['csv'] = {'success': False, 'error': 'Failed to export CSV'}
-        
-        # 2. Export ODS (LibreOffice)
-        ods_export_results = self.export_results('ods')
-        if ods_export_results and ods_export_results[0][1]['success']:
-            reports['ods'] = ods_export_results[0][1]
-            reports['ods']['file_path'] = ods_export_results[0][2] # Add file path
-        else:
-            reports['ods'] = {'success': False, 'error': 'Failed to export ODS'}
-        
-        # 3. Rapport statistique détaillé
+        # 1. Exports CSV, ODS, XLSX (une seule lecture des données ; notes.csv de la correction réutilisé)
+        exports = {fmt.lower(): (result, file_path)
+                   for fmt, result, file_path in self.export_results('all', reuse_csv=True)}
+        for fmt in ('csv', 'ods', 'xlsx'):
+            if fmt in exports and exports[fmt][0]['success']:
+                reports[fmt] = exports[fmt][0]
+                reports[fmt]['file_path'] = exports[fmt][1] # Add file path
+            elif fmt in ('csv', 'ods'):
+                reports[fmt] = {'success': False, 'error': f'Failed to export {fmt.upper()}'}
+        
+        # 2. Rapport statistique détaillé
         if include_statistics:
             stats_file = self.exports_path / 'statistics.json'
             detailed_stats = self.generate_advanced_statistics()
@@ -1150,7 +2104,7 @@ class AMCManager:
             except Exception as e:
                 reports['statistics'] = {'success': False, 'error': f"Failed to write statistics file: {str(e)}"}
         
-        # 4. Copies individuelles annotées
+        # 3. Copies individuelles annotées
         if include_individual:
             annotated_result = self.generate_annotated_papers()
             reports['annotated'] = annotated_result
@@ -1171,10 +2125,9 @@ class AMCManager:
         csv_file = self.exports_path / 'notes.csv'
         if csv_file.exists():
             try:
-                import pandas as pd
-                df = pd.read_csv(csv_file)
+                df = self._results_frame()
                 
-                if not df.empty:
+                if df is not None and not df.empty:
                     # Distribution détaillée des notes
                     if 'Note' in df.columns:
                         scores = df['Note'].dropna()
@@ -1277,106 +2230,84 @@ class AMCManager:
 
 
 
-    def create_layout_xml_from_sqlite(self):
-        """Convertit layout.sqlite vers layout.xml pour compatibilité"""
-        import xml.etree.ElementTree as ET
+    # Éléments exportés dans layout.xml : (balise, requête, attributs, colonne texte)
+    LAYOUT_XML_ELEMENTS = [
+        ("variable", "SELECT name, value FROM layout_variables", ("name",), "value"),
+        ("question", "SELECT question, name FROM layout_question", ("id", "name"), None),
+        ("page", "SELECT student, page, width, height, dpi FROM layout_page",
+         ("student", "page", "width", "height", "dpi"), None),
+        # Boxes (zones de réponse) - IMPORTANT pour la correction
+        ("box", """SELECT student, page, question, answer, xmin, xmax, ymin, ymax, role, flags
+                   FROM layout_box ORDER BY student, page, question, answer""",
+         ("student", "page", "question", "answer", "xmin", "xmax", "ymin", "ymax", "role", "flags"), None),
+        ("association", "SELECT student, id, filename FROM layout_association",
+         ("student", "id", "filename"), None),
+        ("zone", "SELECT student, page, zone, xmin, xmax, ymin, ymax FROM layout_zone",
+         ("student", "page", "zone", "xmin", "xmax", "ymin", "ymax"), None),
+    ]
+
+    def create_layout_xml_from_sqlite(self, force=False):
+        """Convertit layout.sqlite vers layout.xml pour compatibilité.
+
+        Le XML est écrit au fil des curseurs SQLite (mémoire bornée, sans arbre
+        complet en mémoire) et n'est régénéré que si layout.sqlite a changé.
+        """
+        from xml.sax.saxutils import XMLGenerator
         import sqlite3
         
         db_path = self.data_path / 'layout.sqlite'
         xml_path = self.data_path / 'layout.xml'
+        stamp_path = self.data_path / 'layout.xml.stamp'
         
         if not db_path.exists():
             return {'success': False, 'error': 'layout.sqlite not found'}
         
+        stat = db_path.stat()
+        signature = f"{stat.st_size}:{stat.st_mtime_ns}"
+        
+        if not force and xml_path.exists() and stamp_path.exists():
+            if stamp_path.read_text().strip() == signature:
+                self.logger.info("layout.sqlite inchangé, layout.xml conservé")
+                return {'success': True, 'xml_path': str(xml_path), 'skipped': True}
+        
+        tmp_path = xml_path.with_name(xml_path.name + '.tmp')
         try:
             conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            root = ET.Element("layout")
-            
-            # Variables
-            cursor.execute("SELECT name, value FROM layout_variables")
-            variables_data = cursor.fetchall()
-            if variables_data:
-                for name, value in variables_data:
-                    var = ET.SubElement(root, "variable")
-                    var.set("name", str(name))
-                    var.text = str(value) if value else ""
-            
-            # Questions
-            cursor.execute("SELECT question, name FROM layout_question")
-            questions_data = cursor.fetchall()
-            if questions_data:
-                for question_id, name in questions_data:
-                    q = ET.SubElement(root, "question")
-                    q.set("id", str(question_id))
-                    q.set("name", str(name) if name else "")
-            
-            # Pages
-            cursor.execute("SELECT student, page, width, height, dpi FROM layout_page")
-            pages_data = cursor.fetchall()
-            if pages_data:
-                for student, page, width, height, dpi in pages_data:
-                    p = ET.SubElement(root, "page")
-                    p.set("student", str(student))
-                    p.set("page", str(page))
-                    p.set("width", str(width) if width else "")
-                    p.set("height", str(height) if height else "")
-                    p.set("dpi", str(dpi) if dpi else "")
-            
-            # Boxes (zones de réponse) - IMPORTANT pour la correction
-            cursor.execute("""
-                SELECT student, page, question, answer, xmin, xmax, ymin, ymax, role, flags 
-                FROM layout_box ORDER BY student, page, question, answer
-            """)
-            boxes_data = cursor.fetchall()
-            if boxes_data:
-                for student, page, question, answer, xmin, xmax, ymin, ymax, role, flags in boxes_data:
-                    box = ET.SubElement(root, "box")
-                    box.set("student", str(student))
-                    box.set("page", str(page))
-                    box.set("question", str(question) if question else "")
-                    box.set("answer", str(answer) if answer else "")
-                    box.set("xmin", str(xmin) if xmin else "")
-                    box.set("xmax", str(xmax) if xmax else "")
-                    box.set("ymin", str(ymin) if ymin else "")
-                    box.set("ymax", str(ymax) if ymax else "")
-                    box.set("role", str(role) if role else "")
-                    box.set("flags", str(flags) if flags else "")
-            
-            # Associations étudiants
-            cursor.execute("SELECT student, id, filename FROM layout_association")
-            associations_data = cursor.fetchall()
-            if associations_data:
-                for student, student_id, filename in associations_data:
-                    assoc = ET.SubElement(root, "association")
-                    assoc.set("student", str(student))
-                    assoc.set("id", str(student_id) if student_id else "")
-                    assoc.set("filename", str(filename) if filename else "")
-            
-            # Zones générales
-            cursor.execute("SELECT student, page, zone, xmin, xmax, ymin, ymax FROM layout_zone")
-            zones_data = cursor.fetchall()
-            if zones_data:
-                for student, page, zone, xmin, xmax, ymin, ymax in zones_data:
-                    z = ET.SubElement(root, "zone")
-                    z.set("student", str(student))
-                    z.set("page", str(page))
-                    z.set("zone", str(zone) if zone else "")
-                    z.set("xmin", str(xmin) if xmin else "")
-                    z.set("xmax", str(xmax) if xmax else "")
-                    z.set("ymin", str(ymin) if ymin else "")
-                    z.set("ymax", str(ymax) if ymax else "")
-            
-            # Sauvegarder le XML
-            tree = ET.ElementTree(root)
-            tree.write(xml_path, encoding="utf-8", xml_declaration=True)
-            conn.close()
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    xml = XMLGenerator(f, encoding='utf-8', short_empty_elements=True)
+                    xml.startDocument()
+                    xml.startElement("layout", {})
+                    
+                    for tag, query, attributes, text_column in self.LAYOUT_XML_ELEMENTS:
+                        # Le curseur est parcouru ligne à ligne, sans fetchall()
+                        for row in conn.execute(query):
+                            # Premier attribut (clé) toujours renseigné, autres champs vides si nuls
+                            attrs = {
+                                name: str(value) if (value or index == 0 or name == "page") else ""
+                                for index, (name, value) in enumerate(zip(attributes, row))
+                            }
+                            xml.startElement(tag, attrs)
+                            if text_column:
+                                value = row[len(attributes)]
+                                xml.characters(str(value) if value else "")
+                            xml.endElement(tag)
+                            xml.ignorableWhitespace("\n")
+                    
+                    xml.endElement("layout")
+                    xml.endDocument()
+            finally:
+                conn.close()
+            
+            os.replace(tmp_path, xml_path)
+            stamp_path.write_text(signature)
             
             self.logger.info(f"Conversion SQLite vers XML terminée: {xml_path}")
             return {'success': True, 'xml_path': str(xml_path)}
         
         except Exception as e:
+            if tmp_path.exists():
+                tmp_path.unlink()
             self.logger.error(f"Erreur conversion SQLite vers XML: {e}")
             return {'success': False, 'error': str(e)}
 
@@ -1388,35 +2319,15 @@ class AMCManager:
 
         try:
             # 1. Vérifier ET forcer la préparation du projet si nécessaire
-            layout_sqlite = self.data_path / 'layout.sqlite'
-            layout_ready = False
+            self._emit_step('prepare_project', "Vérification du layout AMC...")
+            # Décision prise sur le résumé du layout (O(1)) et l'empreinte des sources
+            needs_prepare, reason = self.layout_needs_prepare()
             
-            if layout_sqlite.exists():
-                # Vérifier que le layout contient des données
-                try:
-                    import sqlite3
-                    conn = sqlite3.connect(layout_sqlite)
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT COUNT(*) FROM layout_box")
-                    box_count = cursor.fetchone()[0]
-                    cursor.execute("SELECT COUNT(*) FROM layout_page")
-                    page_count = cursor.fetchone()[0]
-                    conn.close()
-                    
-                    if box_count > 0 and page_count > 0:
-                        layout_ready = True
-                        self.logger.info(f"Layout AMC valide trouvé: {box_count} boxes, {page_count} pages")
-                    else:
-                        self.logger.warning(f"Layout AMC vide: {box_count} boxes, {page_count} pages")
-                        
-                except Exception as e:
-                    self.logger.error(f"Erreur vérification layout: {e}")
-            
-            if not layout_ready:
-                self.logger.info("Préparation/Régénération du projet AMC...")
+            if needs_prepare:
+                self.logger.info(f"Préparation/Régénération du projet AMC ({reason})...")
                 
                 # Supprimer les anciens fichiers de layout
-                for db_file in ['layout.sqlite', 'report.sqlite']:
+                for db_file in ['layout.sqlite', 'report.sqlite', self.LAYOUT_SUMMARY_FILE]:
                     db_path = self.data_path / db_file
                     if db_path.exists():
                         try:
@@ -1433,28 +2344,22 @@ class AMCManager:
                     self.logger.error(f"Échec de la préparation du projet: {prep_project_result.get('error', '')}")
                     return results
                 
-                # Vérifier à nouveau le layout après préparation
-                try:
-                    conn = sqlite3.connect(layout_sqlite)
-                    cursor = conn.cursor()
-                    cursor.execute("SELECT COUNT(*) FROM layout_box")
-                    box_count = cursor.fetchone()[0]
-                    conn.close()
-                    
-                    if box_count == 0:
-                        self.logger.error("ERREUR CRITIQUE: Le layout n'a toujours pas été généré après prepare")
-                        return results + [('layout_error', {'success': False, 'error': 'Layout non généré par AMC prepare'})]
-                    else:
-                        self.logger.info(f"Layout correctement généré: {box_count} zones détectées")
-                        
-                except Exception as e:
-                    self.logger.error(f"Impossible de vérifier le layout après préparation: {e}")
-                    return results + [('layout_verification_error', {'success': False, 'error': str(e)})]
+                # Vérifier à nouveau le layout après préparation (résumé écrit par prepare_project)
+                summary = self.get_layout_summary()
+                if not summary:
+                    self.logger.error("Impossible de vérifier le layout après préparation")
+                    return results + [('layout_verification_error', {'success': False, 'error': 'Résumé du layout indisponible'})]
+                
+                if summary['box_count'] == 0:
+                    self.logger.error("ERREUR CRITIQUE: Le layout n'a toujours pas été généré après prepare")
+                    return results + [('layout_error', {'success': False, 'error': 'Layout non généré par AMC prepare'})]
+                else:
+                    self.logger.info(f"Layout correctement généré: {summary['box_count']} zones détectées")
             else:
-                self.logger.info("Projet AMC déjà préparé avec layout valide.")
+                self.logger.info(f"Projet AMC déjà préparé avec layout valide: {reason}")
             
             # 2. Préparation et optimisation des scans
-            self.logger.info("Étape 1/4: Préparation des images scannées...")
+            self._emit_step('prepare_scan_images', "Étape 1/4: Préparation des images scannées...")
             prep_result = self.prepare_scan_images(scan_path=self.uploads_path)
             results.append(('prepare_scan_images', prep_result))
             if not prep_result['success']:
@@ -1463,7 +2368,7 @@ class AMCManager:
             self.logger.info(f"Préparation des images terminée. Succès: {prep_result['success']}")
 
             # 3. Analyse des copies avec vérification préalable
-            self.logger.info("Étape 2/4: Analyse des copies...")
+            self._emit_step('analyse_papers', "Étape 2/4: Analyse des copies...")
             
             # Vérifier qu'on a bien des images à analyser
             prepared_path = Path(prep_result['prepared_path'])
@@ -1478,6 +2383,13 @@ class AMCManager:
             
             self.logger.info(f"Images trouvées pour analyse: {len(image_files)}")
             
+            # Prépasse des marques de calage : pages non recalables signalées avant l'analyse
+            registration = self.check_scan_registration(image_files)
+            if registration['success']:
+                results.append(('scan_registration', registration))
+                if registration['unregistrable']:
+                    self._emit('warning', message=f"{len(registration['unregistrable'])} page(s) sans marques de calage détectées")
+            
             # Analyse simple et directe
             cmd_parts = [
                 "auto-multiple-choice",
@@ -1491,7 +2403,7 @@ class AMCManager:
                 relative_path = image_file.relative_to(self.project_path)
                 cmd_parts.append(f"'{relative_path}'")
             
-            cmd = " ".join(cmd_parts)
+            cmd = " ".join(cmd_parts) + self._progress_options('analyse')
             self.logger.info(f"Commande d'analyse: {cmd}")
             
             analysis_result = self.run_command(cmd)
@@ -1506,7 +2418,7 @@ class AMCManager:
             self.logger.info(f"Analyse des copies terminée. Succès: {analysis_result['success']}")
 
             # 4. Calculer les notes
-            self.logger.info("Étape 3/4: Calcul des notes...")
+            self._emit_step('calculate_marks', "Étape 3/4: Calcul des notes...")
             marks_result = self.calculate_marks(scoring_strategy=scoring_strategy)
             results.append(('calculate_marks', marks_result))
             if not marks_result['success']:
@@ -1515,7 +2427,7 @@ class AMCManager:
             self.logger.info(f"Calcul des notes terminé. Succès: {marks_result['success']}")
 
             # 5. Exporter les résultats
-            self.logger.info("Étape 4/4: Exportation des résultats...")
+            self._emit_step('export_results', "Étape 4/4: Exportation des résultats...")
             export_result_csv = self.export_results(format_type='csv')
             results.append(('export_results_csv', export_result_csv))
             if export_result_csv and export_result_csv[0][1]['success']:
@@ -1533,6 +2445,14 @@ class AMCManager:
             final_stats = self.generate_advanced_statistics()
             results.append(('Statistiques finales', {'success': True, 'stats': final_stats}))
             
+            # 7. Rétention : les pages préparées ne servent plus une fois les résultats exportés ;
+            # réencodage en tâche de fond pour ne pas retarder la fin de la correction.
+            # Sans export réussi, les pages restent intactes pour une nouvelle tentative
+            if export_result_csv and all(result.get('success') for _, result, _ in export_result_csv):
+                results.append(('scan_retention', self.schedule_scan_retention()))
+            else:
+                self.logger.warning("Export des résultats en échec : rétention des pages préparées non appliquée")
+            
             self.logger.info("Processus de correction automatique terminé avec succès")
             
         except Exception as e:
@@ -1580,10 +2500,9 @@ class AMCManager:
         csv_file = self.exports_path / 'notes.csv'
         if csv_file.exists():
             try:
-                import pandas as pd
-                df = pd.read_csv(csv_file)
+                df = self._results_frame()
                 
-                if not df.empty and 'Note' in df.columns:
+                if df is not None and not df.empty and 'Note' in df.columns:
                     scores = df['Note'].dropna()
                     
                     # Détecter les anomalies statistiques
@@ -1609,30 +2528,3 @@ class AMCManager:
             'quality_score': max(0, 100 - len(issues) * 20),  # Score sur 100
             'status': 'excellent' if not issues else 'attention' if len(issues) < 3 else 'problematique'
         }
-    def fix_csv_names(self, csv_file_path):
-        """Corrige les noms dans le fichier CSV généré"""
-        try:
-            # Lire le fichier liste.csv pour récupérer les noms
-            names_map = {}
-            liste_file = self.project_path / 'liste.csv'
-            if liste_file.exists():
-                with open(liste_file, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for i, row in enumerate(reader, 1):
-                        if 'nom' in row and 'prenom' in row:
-                            names_map[str(i)] = f"{row['nom']} {row['prenom']}"
-            
-            # Corriger le fichier CSV des notes
-            if names_map and os.path.exists(csv_file_path):
-                with open(csv_file_path, 'r') as file:
-                    content = file.read()
-                
-                for student_id, name in names_map.items():
-                    content = content.replace(f'"{student_id}","","?",', f'"{student_id}","","{name}",')
-                
-                with open(csv_file_path, 'w') as file:
-                    file.write(content)
-                
-                self.logger.info(f"Noms corrigés dans {csv_file_path}")
-        except Exception as e:
-            self.logger.error(f"Erreur lors de la correction des noms: {e}")
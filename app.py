@@ -1,5 +1,10 @@
 from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
 from dashboard import register_dashboard_routes
+from correction_jobs import register_job_routes, job_registry, load_project_owner
+from thumbnails import register_thumbnail_routes
+import disk_usage
+import upload_store
+from metrics import register_metrics_routes
 import os
 import subprocess
 import json
@@ -96,7 +101,7 @@ if AUTH_ENABLED:
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
-AMC_PROJECTS_FOLDER = 'amc-projects'
+AMC_PROJECTS_FOLDER = os.environ.get('AMC_PROJECTS_FOLDER', 'amc-projects')
 RESULTS_FOLDER = 'results'
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg'}
 
@@ -107,6 +112,15 @@ for folder in [UPLOAD_FOLDER, AMC_PROJECTS_FOLDER, RESULTS_FOLDER]:
 # Enregistrer les routes du dashboard
 register_dashboard_routes(app, AMC_PROJECTS_FOLDER)
 
+# Enregistrer les routes de suivi des corrections (SSE)
+register_job_routes(app, AMC_PROJECTS_FOLDER)
+
+# Enregistrer les routes des vignettes de copies scannées
+register_thumbnail_routes(app, AMC_PROJECTS_FOLDER)
+
+# Mesure des requêtes et point de collecte /metrics
+register_metrics_routes(app)
+
 def init_reset_tokens_table():
     """Créer la table des tokens de réinitialisation"""
     conn = sqlite3.connect(USER_DB)
@@ -346,12 +360,24 @@ def index():
     else:
         return redirect(url_for('dashboard'))
 
+def send_generated_file(file_path, project_path, **kwargs):
+    """Envoie un fichier généré avec un ETag fort (empreinte enregistrée à la génération).
+
+    send_file gère alors If-None-Match / If-Modified-Since (304) et les requêtes
+    Range (206), utiles pour l'aperçu des PDF dans le navigateur.
+    """
+    from file_hashes import get_file_hash
+    # Chemin absolu : send_file résoudrait sinon un chemin relatif depuis app.root_path
+    file_path = os.path.abspath(file_path)
+    return send_file(file_path, etag=get_file_hash(project_path, file_path),
+                     conditional=True, max_age=0, **kwargs)
+
 @app.route('/download_csv/<project_id>')
 def download_csv_results(project_id):
     """Télécharger le fichier de résultats CSV"""
     try:
         # Utiliser le même chemin que dans vos autres routes
-        project_path = Path('amc-projects') / project_id  # ou la variable que vous utilisez
+        project_path = Path(AMC_PROJECTS_FOLDER) / project_id
         if not project_path.exists():
             flash(f'Projet {project_id} non trouvé', 'error')
             return redirect(url_for('index'))
@@ -370,8 +396,9 @@ def download_csv_results(project_id):
         
         app.logger.info(f"Téléchargement du CSV: {csv_file} -> notes_{project_id}.csv")
         
-        return send_file(
+        return send_generated_file(
             csv_file,
+            project_path,
             as_attachment=True,
             download_name=f'notes_{project_id}.csv',
             mimetype='text/csv'
@@ -387,7 +414,7 @@ def download_annotated_zip(project_id):
     """Télécharger les copies annotées en ZIP"""
     try:
         # Utiliser le même chemin que dans vos autres routes
-        project_path = Path('amc-projects') / project_id  # ou la variable que vous utilisez
+        project_path = Path(AMC_PROJECTS_FOLDER) / project_id
         if not project_path.exists():
             flash(f'Projet {project_id} non trouvé', 'error')
             return redirect(url_for('index'))
@@ -399,27 +426,18 @@ def download_annotated_zip(project_id):
             flash('Copies annotées non trouvées. Effectuez d\'abord la correction.', 'error')
             return redirect(url_for('project_detail', project_id=project_id))  # Correction: project_detail
         
-        # Créer un fichier ZIP temporaire
-        import zipfile
-        import tempfile
-        import os
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
-            with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for file_path in annotated_dir.rglob('*'):
-                    if file_path.is_file():
-                        # Nom relatif dans le ZIP
-                        arcname = file_path.relative_to(annotated_dir)
-                        zf.write(file_path, arcname)
-            
-            app.logger.info(f"Téléchargement des copies annotées: {temp_zip.name} -> copies_annotees_{project_id}.zip")
-            
-            return send_file(
-                temp_zip.name,
-                as_attachment=True,
-                download_name=f'copies_annotees_{project_id}.zip',
-                mimetype='application/zip'
-            )
+        # Archive construite pendant l'annotation : reconstruite seulement si elle est périmée
+        archive_file = AMCManager(project_path).annotated_archive()
+        
+        app.logger.info(f"Téléchargement des copies annotées: {archive_file} -> copies_annotees_{project_id}.zip")
+        
+        return send_generated_file(
+            archive_file,
+            project_path,
+            as_attachment=True,
+            download_name=f'copies_annotees_{project_id}.zip',
+            mimetype='application/zip'
+        )
         
     except Exception as e:
         app.logger.error(f"Erreur téléchargement copies annotées pour {project_id}: {e}")
@@ -473,40 +491,44 @@ def download_qcm(project_id):
                     formatted_sample.append(formatted_q)
                 amc.create_complete_questionnaire(formatted_sample)
         
-        # Nettoyer les anciens PDFs pour forcer la régénération
-        pdf_files_to_clean = [
-            'amc-compiled.pdf',
-            'questionnaire_output.pdf', 
-            'questionnaire.pdf'
-        ]
-        
-        for pdf_file in pdf_files_to_clean:
-            pdf_path = os.path.join(project_path, pdf_file)
-            if os.path.exists(pdf_path):
-                try:
-                    os.remove(pdf_path)
-                    print(f"Ancien PDF supprimé: {pdf_path}")
-                except OSError as e:
-                    print(f"Impossible de supprimer {pdf_path}: {e}")
-        
-        # Préparer le projet (compilation LaTeX vers PDF)
-        print(f"Compilation du projet dans: {project_path}")
-        result = amc.prepare_project()
-        
-        # Affichage des détails du résultat pour debug
-        print(f"Résultat compilation: {result}")
+        # Recompiler seulement si le PDF ne correspond plus aux sources (empreinte enregistrée)
+        if amc.subject_pdf_is_fresh():
+            print("PDF à jour, pas de recompilation")
+        else:
+            # Nettoyer les anciens PDFs pour forcer la régénération
+            pdf_files_to_clean = [
+                'amc-compiled.pdf',
+                'questionnaire_output.pdf', 
+                'questionnaire.pdf'
+            ]
         
-        if not result['success']:
-            error_msg = result.get('stderr', result.get('error', 'Erreur inconnue'))
-            print(f"Erreur compilation LaTeX: {error_msg}")
-            flash(f'Erreur compilation LaTeX: {error_msg}', 'error')
+            for pdf_file in pdf_files_to_clean:
+                pdf_path = os.path.join(project_path, pdf_file)
+                if os.path.exists(pdf_path):
+                    try:
+                        os.remove(pdf_path)
+                        print(f"Ancien PDF supprimé: {pdf_path}")
+                    except OSError as e:
+                        print(f"Impossible de supprimer {pdf_path}: {e}")
+        
+            # Préparer le projet (compilation LaTeX vers PDF)
+            print(f"Compilation du projet dans: {project_path}")
+            result = amc.prepare_project()
+        
+            # Affichage des détails du résultat pour debug
+            print(f"Résultat compilation: {result}")
+        
+            if not result['success']:
+                error_msg = result.get('stderr', result.get('error', 'Erreur inconnue'))
+                print(f"Erreur compilation LaTeX: {error_msg}")
+                flash(f'Erreur compilation LaTeX: {error_msg}', 'error')
             
-            # En cas d'échec, proposer le téléchargement du LaTeX
-            if os.path.exists(latex_file):
-                return send_file(latex_file, as_attachment=True, download_name=f'qcm_{project_id}.tex')
-            else:
-                flash('Aucun fichier à télécharger', 'error')
-                return redirect(url_for('project_detail', project_id=project_id))
+                # En cas d'échec, proposer le téléchargement du LaTeX
+                if os.path.exists(latex_file):
+                    return send_file(latex_file, as_attachment=True, download_name=f'qcm_{project_id}.tex')
+                else:
+                    flash('Aucun fichier à télécharger', 'error')
+                    return redirect(url_for('project_detail', project_id=project_id))
         
         # Chercher le PDF généré (avec plus de vérifications)
         possible_pdf_paths = [
@@ -543,7 +565,7 @@ def download_qcm(project_id):
             download_name = f"{safe_project_name}_{project_id}.pdf"
             
             print(f"Téléchargement du PDF: {pdf_file} -> {download_name}")
-            return send_file(pdf_file, as_attachment=True, download_name=download_name)
+            return send_generated_file(pdf_file, project_path, as_attachment=True, download_name=download_name)
         else:
             print("Aucun PDF valide trouvé")
             flash('PDF non généré ou corrompu', 'error')
@@ -574,7 +596,7 @@ def preview_qcm(project_id):
         amc = AMCManager(project_path)
         
         # Générer le PDF si nécessaire
-        result = amc.prepare_project()
+        result = {'success': True} if amc.subject_pdf_is_fresh() else amc.prepare_project()
         
         if result['success']:
             possible_pdf_paths = [
@@ -585,7 +607,7 @@ def preview_qcm(project_id):
             
             for pdf_path in possible_pdf_paths:
                 if os.path.exists(pdf_path) and os.path.getsize(pdf_path) > 1000:
-                    return send_file(pdf_path, mimetype='application/pdf')
+                    return send_generated_file(pdf_path, project_path, mimetype='application/pdf')
         
         flash('Impossible de générer la prévisualisation', 'error')
         return redirect(url_for('project_detail', project_id=project_id))
@@ -653,6 +675,8 @@ def create_project():
             with open(os.path.join(project_path, 'project_info.json'), 'w') as f:
                 json.dump(project_info, f, indent=2)
             
+            disk_usage.refresh_project_usage(project_path)
+            
             flash(f'Projet "{project_name}" créé avec succès!', 'success')
             return redirect(url_for('project_detail', project_id=f"{project_name}_{project_id}"))
             
@@ -695,7 +719,16 @@ def list_projects():
                     print(f"Erreur lors du chargement du projet {project_folder}: {e}")
                     continue
     
-    return render_template('projects.html', projects=projects)
+    # Tailles lues dans l'index ; seuls les projets encore non suivis sont mesurés
+    disk_usage.backfill_untracked_projects(AMC_PROJECTS_FOLDER, [p['folder'] for p in projects])
+    usage = disk_usage.get_projects_usage(p['folder'] for p in projects)
+    for project_info in projects:
+        project_info['disk_usage'] = disk_usage.format_bytes(usage.get(project_info['folder']))
+    user_usage = disk_usage.get_user_usage(current_user.id)
+    
+    return render_template('projects.html', projects=projects,
+                           used_space=disk_usage.format_bytes(user_usage['bytes']),
+                           quota=disk_usage.format_bytes(user_usage['quota_bytes']) if user_usage['quota_bytes'] else None)
 
 
 
@@ -704,24 +737,38 @@ def list_projects():
 def upload_file(project_id):
     project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
     
-    if 'file' not in request.files:
-        return jsonify({'success': False, 'error': 'Aucun fichier sélectionné'})
-    
-    file = request.files['file']
-    if file.filename == '':
+    files = [f for f in request.files.getlist('file') if f.filename]
+    if not files:
         return jsonify({'success': False, 'error': 'Aucun fichier sélectionné'})
     
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        uploads_path = os.path.join(project_path, 'uploads')
-        os.makedirs(uploads_path, exist_ok=True)
-        
-        file_path = os.path.join(uploads_path, filename)
-        file.save(file_path)
-        
-        return jsonify({'success': True, 'filename': filename})
+    if not all(allowed_file(f.filename) for f in files):
+        return jsonify({'success': False, 'error': 'Type de fichier non autorisé'})
+    
+    # Quota du propriétaire du projet : vérification en O(1) sur l'index d'occupation
+    owner_id = load_project_owner(project_path)
+    # Projets antérieurs au suivi mesurés une fois, sinon ils compteraient pour 0
+    disk_usage.ensure_projects_tracked(AMC_PROJECTS_FOLDER)
+    allowed, used, quota = disk_usage.check_quota(owner_id, request.content_length)
+    if not allowed:
+        return jsonify({'success': False, 'error': f'Quota disque dépassé ({disk_usage.format_bytes(used)} utilisés '
+                                                  f'sur {disk_usage.format_bytes(quota)})'}), 413
+    
+    # Contenu haché pendant l'écriture : un fichier déjà présent sous un autre nom n'est pas stocké deux fois
+    stored, duplicates = [], []
+    for file in files:
+        result = upload_store.store_upload(project_path, secure_filename(file.filename), file.stream)
+        disk_usage.add_project_usage(project_path, result['added_bytes'])
+        if result['duplicate_of']:
+            duplicates.append({'file': secure_filename(file.filename), 'duplicate_of': result['duplicate_of']})
+        else:
+            stored.append(result['filename'])
     
-    return jsonify({'success': False, 'error': 'Type de fichier non autorisé'})
+    return jsonify({
+        'success': True,
+        'filename': (stored or [duplicates[0]['duplicate_of']])[0],
+        'files': stored,
+        'duplicates': duplicates
+    })
 
 @app.route('/process/<project_id>')
 def process_project(project_id):
@@ -801,7 +848,7 @@ def api_export_results(project_id, format_type):
     if format_type == 'csv':
         csv_file = os.path.join(project_path, 'exports', 'notes.csv')
         if os.path.exists(csv_file):
-            return send_file(csv_file, as_attachment=True, download_name=f'notes_{project_id}.csv')
+            return send_generated_file(csv_file, project_path, as_attachment=True, download_name=f'notes_{project_id}.csv')
         else:
             return jsonify({'success': False, 'error': 'Fichier CSV non trouvé'}), 404
     
@@ -815,7 +862,8 @@ def delete_file(project_id, filename):
     
     try:
         if os.path.exists(file_path):
-            os.remove(file_path)
+            size = upload_store.remove_upload(project_path, os.path.basename(file_path))
+            disk_usage.add_project_usage(project_path, -size)
             return jsonify({'success': True})
         else:
             return jsonify({'success': False, 'error': 'Fichier non trouvé'})
@@ -1075,6 +1123,41 @@ def api_correction_preview(project_id):
 
 
 
+@app.route('/api/scan-retention/<project_id>', methods=['GET', 'POST'])
+def api_scan_retention(project_id):
+    """Rapport de rétention des pages préparées (GET) ou application de la politique (POST)"""
+    from scan_retention import load_retention_report, RETENTION_POLICIES
+    project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
+    if not os.path.exists(project_path):
+        return jsonify({'success': False, 'error': 'Projet non trouvé'}), 404
+    
+    if request.method == 'GET':
+        report = load_retention_report(project_path)
+        return jsonify({'success': True, 'report': report})
+    
+    params = request.get_json(silent=True) or {}
+    policy = params.get('policy')
+    if policy is not None and policy not in RETENTION_POLICIES:
+        return jsonify({'success': False, 'error': f"Politique inconnue (valeurs: {', '.join(RETENTION_POLICIES)})"}), 400
+    
+    amc = AMCManager(project_path)
+    if params.get('restore'):
+        result = amc.restore_prepared_scans()
+        disk_usage.refresh_project_usage(project_path)
+        return jsonify(result)
+    report = amc.apply_scan_retention(policy)
+    disk_usage.refresh_project_usage(project_path)
+    return jsonify(report), 200 if report.get('success') else 500
+
+@app.route('/api/disk-usage')
+@login_required
+def api_disk_usage():
+    """Espace disque occupé par les projets de l'utilisateur connecté, et son quota"""
+    disk_usage.ensure_projects_tracked(AMC_PROJECTS_FOLDER)
+    usage = disk_usage.get_user_usage(current_user.id)
+    usage['success'] = True
+    return jsonify(usage)
+
 @app.route('/reprocess/<project_id>')
 def reprocess_project(project_id):
     """Relancer le processus de correction avec de nouveaux paramètres"""
@@ -1091,6 +1174,7 @@ def reprocess_project(project_id):
             if os.path.exists(path):
                 shutil.rmtree(path)
                 os.makedirs(path, exist_ok=True)
+        disk_usage.refresh_project_usage(project_path)
         
         flash('Projet nettoyé, vous pouvez relancer la correction', 'info')
         return redirect(url_for('correct_project', project_id=project_id))
@@ -1119,13 +1203,23 @@ def scan_check(project_id):
         if not scan_files:
             return jsonify({'success': False, 'error': 'Aucun fichier scanné trouvé'})
         
-        # Détecter les propriétés des scans
+        # Détecter les propriétés des scans (lecture de la structure des fichiers, sans rastérisation)
         detection_results = amc.auto_scan_detection(scan_files)
+        total_pages = sum(result.get('pages', 0) for result in detection_results)
+        
+        # Sur demande (?marks=1) : pages dont les marques de calage sont introuvables
+        # (non recalables par AMC), contrôlées sur les images intégrées des fichiers téléversés
+        registration = None
+        if request.args.get('marks') == '1':
+            registration = amc.check_uploaded_scans_registration()
         
         return jsonify({
             'success': True,
             'files_count': len(scan_files),
+            'total_pages': total_pages,
             'detection_results': detection_results,
+            'registration': registration,
+            'unregistrable_pages': registration.get('unregistrable', []) if registration else [],
             'recommendations': [
                 'Utilisez une résolution de 300 DPI minimum',
                 'Assurez-vous que les codes étudiants sont bien lisibles',
@@ -1219,6 +1313,66 @@ def api_optimize_project(project_id):
             'error': f'Erreur optimisation: {str(e)}'
         }), 500
 
+def get_correction_status(project_path, check_quality=True):
+    """Calcule l'état d'avancement de la correction d'un projet"""
+    status = {
+        'questionnaire_ready': os.path.exists(os.path.join(project_path, 'questionnaire.tex')),
+        'project_prepared': os.path.exists(os.path.join(project_path, 'data')),
+        'scans_uploaded': False,
+        'analysis_completed': False,
+        'scoring_completed': False,
+        'exports_generated': False,
+        'last_correction': None,
+        'scan_count': 0,
+        'correction_quality': None
+    }
+    
+    # Vérifier les scans
+    uploads_path = os.path.join(project_path, 'uploads')
+    if os.path.exists(uploads_path):
+        scan_files = [f for f in os.listdir(uploads_path) 
+                     if f.lower().endswith(('.pdf', '.jpg', '.jpeg', '.png', '.tiff'))]
+        status['scans_uploaded'] = len(scan_files) > 0
+        status['scan_count'] = len(scan_files)
+    
+    # Vérifier l'analyse
+    cr_path = os.path.join(project_path, 'cr')
+    if os.path.exists(cr_path) and os.listdir(cr_path):
+        status['analysis_completed'] = True
+    
+    # Vérifier la notation
+    exports_path = os.path.join(project_path, 'exports')
+    csv_file = os.path.join(exports_path, 'notes.csv')
+    if os.path.exists(csv_file):
+        status['scoring_completed'] = True
+        status['exports_generated'] = True
+        
+        # Date de dernière correction
+        status['last_correction'] = datetime.fromtimestamp(
+            os.path.getmtime(csv_file)
+        ).isoformat()
+        
+        # Évaluer la qualité de correction
+        if check_quality:
+            try:
+                amc = AMCManager(project_path)
+                quality_check = amc.verify_correction_quality()
+                status['correction_quality'] = quality_check['status']
+            except:
+                status['correction_quality'] = 'unknown'
+    
+    # Calculer le pourcentage de progression
+    steps_completed = sum([
+        status['questionnaire_ready'],
+        status['project_prepared'], 
+        status['scans_uploaded'],
+        status['analysis_completed'],
+        status['scoring_completed']
+    ])
+    status['completion_percentage'] = (steps_completed / 5) * 100
+    
+    return status
+
 @app.route('/api/correction/status/<project_id>')
 def api_correction_status(project_id):
     """API pour obtenir le statut de correction d'un projet"""
@@ -1228,65 +1382,9 @@ def api_correction_status(project_id):
         if not os.path.exists(project_path):
             return jsonify({'success': False, 'error': 'Projet non trouvé'}), 404
         
-        # Vérifier les étapes de correction
-        status = {
-            'questionnaire_ready': os.path.exists(os.path.join(project_path, 'questionnaire.tex')),
-            'project_prepared': os.path.exists(os.path.join(project_path, 'data')),
-            'scans_uploaded': False,
-            'analysis_completed': False,
-            'scoring_completed': False,
-            'exports_generated': False,
-            'last_correction': None,
-            'scan_count': 0,
-            'correction_quality': None
-        }
-        
-        # Vérifier les scans
-        uploads_path = os.path.join(project_path, 'uploads')
-        if os.path.exists(uploads_path):
-            scan_files = [f for f in os.listdir(uploads_path) 
-                         if f.lower().endswith(('.pdf', '.jpg', '.jpeg', '.png', '.tiff'))]
-            status['scans_uploaded'] = len(scan_files) > 0
-            status['scan_count'] = len(scan_files)
-        
-        # Vérifier l'analyse
-        cr_path = os.path.join(project_path, 'cr')
-        if os.path.exists(cr_path) and os.listdir(cr_path):
-            status['analysis_completed'] = True
-        
-        # Vérifier la notation
-        exports_path = os.path.join(project_path, 'exports')
-        csv_file = os.path.join(exports_path, 'notes.csv')
-        if os.path.exists(csv_file):
-            status['scoring_completed'] = True
-            status['exports_generated'] = True
-            
-            # Date de dernière correction
-            status['last_correction'] = datetime.fromtimestamp(
-                os.path.getmtime(csv_file)
-            ).isoformat()
-            
-            # Évaluer la qualité de correction
-            try:
-                amc = AMCManager(project_path)
-                quality_check = amc.verify_correction_quality()
-                status['correction_quality'] = quality_check['status']
-            except:
-                status['correction_quality'] = 'unknown'
-        
-        # Calculer le pourcentage de progression
-        steps_completed = sum([
-            status['questionnaire_ready'],
-            status['project_prepared'], 
-            status['scans_uploaded'],
-            status['analysis_completed'],
-            status['scoring_completed']
-        ])
-        status['completion_percentage'] = (steps_completed / 5) * 100
-        
         return jsonify({
             'success': True,
-            'status': status
+            'status': get_correction_status(project_path)
         })
     
     except Exception as e:
@@ -1297,7 +1395,7 @@ def api_correction_status(project_id):
 
 @app.route('/api/correction/batch-process', methods=['POST'])
 def api_batch_correction():
-    """API pour corriger plusieurs projets en lot"""
+    """API pour corriger plusieurs projets en lot (exécution parallèle en tâche de fond)"""
     try:
         data = request.get_json()
         project_ids = data.get('project_ids', [])
@@ -1306,84 +1404,41 @@ def api_batch_correction():
         if not project_ids:
             return jsonify({'success': False, 'error': 'Aucun projet spécifié'}), 400
         
-        results = []
+        batch = job_registry.create_batch(correction_params)
         
         for project_id in project_ids:
             project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
             
             if not os.path.exists(project_path):
-                results.append({
-                    'project_id': project_id,
-                    'success': False,
-                    'error': 'Projet non trouvé'
-                })
+                batch.add(project_id, error='Projet non trouvé')
                 continue
             
             try:
-                amc = AMCManager(project_path)
-                
-                # Vérifier que le projet est prêt
-                status_response = api_correction_status(project_id)
-                status_data = json.loads(status_response.data)
-                
-                if not status_data['success']:
-                    results.append({
-                        'project_id': project_id,
-                        'success': False,
-                        'error': 'Impossible de vérifier le statut'
-                    })
-                    continue
-                
-                project_status = status_data['status']
+                # Vérifier que le projet est prêt (sans contrôle qualité, inutile ici)
+                project_status = get_correction_status(project_path, check_quality=False)
                 if not (project_status['questionnaire_ready'] and 
                        project_status['project_prepared'] and 
                        project_status['scans_uploaded']):
-                    results.append({
-                        'project_id': project_id,
-                        'success': False,
-                        'error': 'Projet non prêt pour correction'
-                    })
+                    batch.add(project_id, error='Projet non prêt pour correction')
                     continue
                 
-                # Lancer la correction
-                correction_results = amc.full_correction_process(
-                    scoring_strategy=correction_params.get('scoring_strategy', 'adaptive'),
-                    auto_optimize=correction_params.get('auto_optimize', True),
-                    generate_reports=correction_params.get('generate_reports', True)
-                )
-                
-                # Vérifier le succès global
-                success_count = sum(1 for _, result in correction_results if result.get('success', False))
-                overall_success = success_count == len(correction_results)
-                
-                results.append({
-                    'project_id': project_id,
-                    'success': overall_success,
-                    'steps_completed': success_count,
-                    'total_steps': len(correction_results),
-                    'details': correction_results if not overall_success else None
+                # Mettre la correction en file d'attente du pool de workers
+                job, _ = job_registry.submit(project_id, project_path, {
+                    'scoring_strategy': correction_params.get('scoring_strategy', 'adaptive'),
+                    'auto_optimize': correction_params.get('auto_optimize', True),
+                    'generate_reports': correction_params.get('generate_reports', True)
                 })
+                batch.add(project_id, job=job)
                 
             except Exception as e:
-                results.append({
-                    'project_id': project_id,
-                    'success': False,
-                    'error': str(e)
-                })
-        
-        # Résumé global
-        successful_corrections = sum(1 for r in results if r['success'])
+                batch.add(project_id, error=str(e))
         
         return jsonify({
             'success': True,
-            'summary': {
-                'total_projects': len(project_ids),
-                'successful_corrections': successful_corrections,
-                'failed_corrections': len(project_ids) - successful_corrections,
-                'success_rate': (successful_corrections / len(project_ids)) * 100
-            },
-            'results': results
-        })
+            'batch_id': batch.id,
+            'status_url': url_for('api_correction_batch_status', batch_id=batch.id),
+            'batch': batch.to_dict()
+        }), 202
     
     except Exception as e:
         return jsonify({
@@ -1406,7 +1461,8 @@ def api_global_correction_stats():
         if os.path.exists(AMC_PROJECTS_FOLDER):
             for project_folder in os.listdir(AMC_PROJECTS_FOLDER):
                 project_path = os.path.join(AMC_PROJECTS_FOLDER, project_folder)
-                if os.path.isdir(project_path):
+                # Dossiers cachés : stockage partagé (blobs, vignettes), pas des projets
+                if os.path.isdir(project_path) and not project_folder.startswith('.'):
                     total_projects += 1
                     
                     # Vérifier si corrigé
@@ -1565,8 +1621,11 @@ def delete_project(project_id):
         if not os.path.exists(project_path):
             return jsonify({'success': False, 'error': 'Projet non trouvé'}), 404
         
-        # Supprimer complètement le dossier du projet
+        # Supprimer complètement le dossier du projet, puis les blobs qu'il était seul à référencer
+        upload_digests = upload_store.load_upload_index(project_path).values()
         shutil.rmtree(project_path)
+        upload_store.release_blobs(upload_digests)
+        disk_usage.remove_project_usage(project_id)
         
         return jsonify({'success': True, 'message': f'Projet {project_id} supprimé avec succès'})
         
@@ -1843,7 +1902,7 @@ def configure_project(project_id):
 def download_results(project_id):
     """Télécharger le fichier de résultats CSV"""
     try:
-        project_path = Path('amc-projects') / project_id
+        project_path = Path(AMC_PROJECTS_FOLDER) / project_id
         if not project_path.exists():
             flash(f'Projet {project_id} non trouvé', 'error')
             return redirect(url_for('index'))
@@ -1862,8 +1921,9 @@ def download_results(project_id):
         
         app.logger.info(f"Téléchargement du CSV: {csv_file} -> notes_{project_id}.csv")
         
-        return send_file(
+        return send_generated_file(
             csv_file,
+            project_path,
             as_attachment=True,
             download_name=f'notes_{project_id}.csv',
             mimetype='text/csv'
@@ -1878,7 +1938,7 @@ def download_results(project_id):
 def download_annotated(project_id):
     """Télécharger les copies annotées en ZIP"""
     try:
-        project_path = PROJECTS_DIR / project_id
+        project_path = Path(AMC_PROJECTS_FOLDER) / project_id
         if not project_path.exists():
             flash(f'Projet {project_id} non trouvé', 'error')
             return redirect(url_for('index'))
@@ -1888,93 +1948,130 @@ def download_annotated(project_id):
         
         if not annotated_dir.exists() or not any(annotated_dir.iterdir()):
             flash('Copies annotées non trouvées. Effectuez d\'abord la correction.', 'error')
-            return redirect(url_for('project_details', project_id=project_id))
+            return redirect(url_for('project_detail', project_id=project_id))
         
-        # Créer un fichier ZIP temporaire
-        import zipfile
-        import tempfile
+        # Même archive que /download_zip
+        archive_file = AMCManager(project_path).annotated_archive()
         
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.zip') as temp_zip:
-            with zipfile.ZipFile(temp_zip.name, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for file_path in annotated_dir.rglob('*'):
-                    if file_path.is_file():
-                        # Nom relatif dans le ZIP
-                        arcname = file_path.relative_to(annotated_dir)
-                        zf.write(file_path, arcname)
-            
-            app.logger.info(f"Téléchargement des copies annotées: {temp_zip.name} -> copies_annotees_{project_id}.zip")
-            
-            def remove_file(response):
-                try:
-                    os.unlink(temp_zip.name)
-                except Exception:
-                    pass
-                return response
-            
-            return send_file(
-                temp_zip.name,
-                as_attachment=True,
-                download_name=f'copies_annotees_{project_id}.zip',
-                mimetype='application/zip'
-            )
+        app.logger.info(f"Téléchargement des copies annotées: {archive_file} -> copies_annotees_{project_id}.zip")
+        
+        return send_generated_file(
+            archive_file,
+            project_path,
+            as_attachment=True,
+            download_name=f'copies_annotees_{project_id}.zip',
+            mimetype='application/zip'
+        )
         
     except Exception as e:
         app.logger.error(f"Erreur téléchargement copies annotées pour {project_id}: {e}")
         flash(f'Erreur lors du téléchargement: {str(e)}', 'error')
-        return redirect(url_for('project_details', project_id=project_id))
+        return redirect(url_for('project_detail', project_id=project_id))
+
+def parse_results_query(args):
+    """Extrait les paramètres de tri, filtre et pagination des résultats"""
+    def as_float(name):
+        try:
+            return float(args[name]) if args.get(name) not in (None, '') else None
+        except ValueError:
+            return None
+    
+    try:
+        limit = min(max(int(args.get('limit', 50)), 1), 500)
+    except ValueError:
+        limit = 50
+    
+    return {
+        'sort': args.get('sort', 'row'),
+        'order': 'desc' if args.get('order') == 'desc' else 'asc',
+        'min_score': as_float('min_score'),
+        'max_score': as_float('max_score'),
+        'search': args.get('q', '').strip() or None,
+        'limit': limit
+    }
+
+@app.route('/api/results/<project_id>')
+def api_results_page(project_id):
+    """Page de résultats triée/filtrée, servie depuis l'index du projet"""
+    try:
+        from results_store import ResultsIndex
+        
+        project_path = Path(AMC_PROJECTS_FOLDER) / project_id
+        if not project_path.exists():
+            return jsonify({'success': False, 'error': 'Projet non trouvé'}), 404
+        
+        index = ResultsIndex(project_path / 'exports')
+        if not index.ensure():
+            return jsonify({'success': False, 'error': 'Aucun résultat disponible'}), 404
+        
+        query = parse_results_query(request.args)
+        page = index.page(cursor=request.args.get('cursor'), **query)
+        summary = index.summary(query['min_score'], query['max_score'], query['search'])
+        
+        return jsonify({
+            'success': True,
+            'rows': page['rows'],
+            'next_cursor': page['next_cursor'],
+            'columns': index.columns(),
+            'total': summary['total'],
+            'summary': summary
+        })
+    
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error(f"Erreur pagination résultats pour {project_id}: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/view_results/<project_id>')  
 def view_results(project_id):
     """Afficher les résultats de correction avec statistiques"""
     try:
+        from results_store import ResultsIndex
+        
         # Utiliser le même chemin que dans vos autres routes
-        project_path = Path('amc-projects') / project_id  # ou la variable que vous utilisez
+        project_path = Path(AMC_PROJECTS_FOLDER) / project_id
         if not project_path.exists():
             flash(f'Projet {project_id} non trouvé', 'error')
             return redirect(url_for('index'))
         
-        # Chercher le fichier notes.csv
-        csv_file = project_path / 'exports' / 'notes.csv'
-        
         results_data = []
         stats = {}
+        total_results = 0
+        next_cursor = None
+        query = parse_results_query(request.args)
         
-        if csv_file.exists():
-            try:
-                import csv as csv_module
-                with open(csv_file, 'r', encoding='utf-8') as f:
-                    reader = csv_module.DictReader(f)
-                    results_data = list(reader)
+        try:
+            # Seule la première page est lue, depuis l'index (reconstruit si notes.csv a changé)
+            index = ResultsIndex(project_path / 'exports')
+            if index.ensure():
+                page = index.page(**query)
+                results_data = page['rows']
+                next_cursor = page['next_cursor']
+                
+                summary = index.summary(query['min_score'], query['max_score'], query['search'])
+                total_results = summary['total']
                 
-                # Calculer les statistiques
-                if results_data:
-                    notes = []
-                    for row in results_data:
-                        try:
-                            if 'Note' in row and row['Note']:
-                                note = float(row['Note'])
-                                notes.append(note)
-                        except (ValueError, TypeError):
-                            continue
+                if summary['scored']:
+                    stats = {
+                        'total_students': summary['total'],
+                        'average': round(summary['average'], 2),
+                        'min_score': summary['min_score'],
+                        'max_score': summary['max_score'],
+                        'passed': summary['passed']
+                    }
                     
-                    if notes:
-                        stats = {
-                            'total_students': len(results_data),
-                            'average': round(sum(notes) / len(notes), 2),
-                            'min_score': min(notes),
-                            'max_score': max(notes),
-                            'passed': len([n for n in notes if n >= 10])
-                        }
-                        
-            except Exception as e:
-                app.logger.error(f"Erreur lecture CSV: {e}")
-                flash('Erreur lors de la lecture des résultats.', 'error')
+        except Exception as e:
+            app.logger.error(f"Erreur lecture résultats: {e}")
+            flash('Erreur lors de la lecture des résultats.', 'error')
         
         return render_template('results.html', 
                              project_id=project_id, 
-                             results=results_data[:50] if results_data else [],  # Limit to first 50
+                             results=results_data,
                              stats=stats,
-                             total_results=len(results_data))
+                             total_results=total_results,
+                             next_cursor=next_cursor,
+                             query=query)
         
     except Exception as e:
         app.logger.error(f"Erreur affichage résultats pour {project_id}: {e}")
@@ -0,0 +1,494 @@
+# correction_jobs.py - Exécution des corrections en tâche de fond et suivi en temps réel (SSE)
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from flask import Response, jsonify, request, stream_with_context
+
+from amc_manager import AMCManager
+from metrics import register_gauge
+
+# Lignes de progression émises par AMC avec --progression-id : "===<analyse>=+0.0250"
+AMC_PROGRESS_RE = re.compile(r'^===<(?P<id>[^>]*)>=\+(?P<delta>[0-9.]+)')
+
+# Poids de chaque étape dans la progression globale (somme = 1)
+STEP_WEIGHTS = {
+    'prepare_project': 0.10,
+    'prepare_scan_images': 0.15,
+    'analyse_papers': 0.50,
+    'calculate_marks': 0.10,
+    'export_results': 0.15,
+}
+
+# Nombre d'événements conservés par tâche (les plus anciens sont oubliés)
+MAX_EVENTS = 2000
+
+# Budget CPU global : nombre de corrections AMC exécutées simultanément
+MAX_PARALLEL_CORRECTIONS = int(os.environ.get(
+    'AMC_MAX_PARALLEL_CORRECTIONS', max(1, (os.cpu_count() or 2) - 1)))
+
+# Partage équitable : corrections simultanées autorisées par enseignant
+MAX_JOBS_PER_USER = int(os.environ.get('AMC_MAX_JOBS_PER_USER', 2))
+
+# Vieillissement : le coût d'une tâche en attente est divisé par deux toutes les N secondes,
+# pour qu'un gros projet finisse par passer devant les petits
+FAIR_SHARE_AGING_SECONDS = int(os.environ.get('AMC_FAIR_SHARE_AGING_SECONDS', 300))
+
+# Tâches terminées conservées en mémoire : au plus N secondes après leur fin, et au plus M tâches
+FINISHED_JOB_TTL_SECONDS = int(os.environ.get('AMC_FINISHED_JOB_TTL_SECONDS', 3600))
+MAX_FINISHED_JOBS = int(os.environ.get('AMC_MAX_FINISHED_JOBS', 200))
+
+SCAN_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tiff', '.tif')
+
+
+def load_project_owner(project_path):
+    """Retourne le user_id enregistré dans project_info.json (None si absent)"""
+    info_file = os.path.join(project_path, 'project_info.json')
+    try:
+        with open(info_file, 'r') as f:
+            return json.load(f).get('user_id')
+    except (OSError, ValueError):
+        return None
+
+
+def estimate_job_cost(project_path):
+    """Estime le coût d'une correction à partir du volume de scans uploadés (en octets)"""
+    uploads_path = os.path.join(project_path, 'uploads')
+    total = 0
+    try:
+        with os.scandir(uploads_path) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(SCAN_EXTENSIONS):
+                    total += entry.stat().st_size
+    except OSError:
+        pass
+    return total
+
+
+class CorrectionJob:
+    """Tâche de correction d'un projet, avec journal d'événements consultable en flux"""
+
+    def __init__(self, project_id, project_path, params=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.project_id = project_id
+        self.project_path = project_path
+        self.params = params or {}
+        self.user_id = load_project_owner(project_path)
+        self.cost = estimate_job_cost(project_path)
+        self.status = 'queued'
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.step = None
+        self.step_label = ''
+        self.step_fraction = 0.0
+        self.completed_weight = 0.0
+        self.results = None
+        self.error = None
+        self._events = []
+        self._next_seq = 1
+        self._condition = threading.Condition()
+
+    # --- Journal d'événements -------------------------------------------------
+
+    def emit(self, event):
+        """Ajoute un événement au journal et réveille les clients en attente"""
+        with self._condition:
+            self._update_progress(event)
+            event = dict(event, seq=self._next_seq, time=time.time(),
+                         progress=round(self.progress() * 100, 1))
+            self._next_seq += 1
+            self._events.append(event)
+            if len(self._events) > MAX_EVENTS:
+                del self._events[:len(self._events) - MAX_EVENTS]
+            self._condition.notify_all()
+
+    def _update_progress(self, event):
+        """Met à jour l'étape courante et la fraction réalisée à partir d'un événement"""
+        if event.get('type') == 'step':
+            if self.step in STEP_WEIGHTS:
+                self.completed_weight += STEP_WEIGHTS[self.step]
+            self.step = event.get('name')
+            self.step_label = event.get('label', '')
+            self.step_fraction = 0.0
+        elif event.get('type') == 'output':
+            match = AMC_PROGRESS_RE.match(event.get('line', ''))
+            if match:
+                self.step_fraction = min(1.0, self.step_fraction + float(match.group('delta')))
+
+    def events_since(self, last_seq, timeout=15):
+        """Retourne les événements postérieurs à last_seq, en attendant au plus timeout secondes"""
+        with self._condition:
+            if not self._has_events_after(last_seq) and not self.is_finished():
+                self._condition.wait(timeout)
+            return [e for e in self._events if e['seq'] > last_seq]
+
+    def _has_events_after(self, last_seq):
+        return bool(self._events) and self._events[-1]['seq'] > last_seq
+
+    # --- État -----------------------------------------------------------------
+
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    def progress(self):
+        """Progression globale entre 0 et 1"""
+        if self.status == 'done':
+            return 1.0
+        current = STEP_WEIGHTS.get(self.step, 0.0) * self.step_fraction
+        return min(0.99, self.completed_weight + current)
+
+    def eta_seconds(self):
+        """Estimation du temps restant à partir de la progression observée"""
+        progress = self.progress()
+        if not self.started or progress <= 0.02 or self.is_finished():
+            return None
+        elapsed = time.time() - self.started
+        return int(elapsed / progress * (1 - progress))
+
+    def effective_cost(self, now=None):
+        """Coût pondéré par le temps d'attente (vieillissement)"""
+        waited = (now or time.time()) - self.created
+        return self.cost / (2 ** (waited / FAIR_SHARE_AGING_SECONDS))
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'project_id': self.project_id,
+            'user_id': self.user_id,
+            'status': self.status,
+            'step': self.step,
+            'step_label': self.step_label,
+            'progress': round(self.progress() * 100, 1),
+            'eta_seconds': self.eta_seconds(),
+            'created': datetime.fromtimestamp(self.created).isoformat(),
+            'started': datetime.fromtimestamp(self.started).isoformat() if self.started else None,
+            'finished': datetime.fromtimestamp(self.finished).isoformat() if self.finished else None,
+            'error': self.error,
+        }
+
+    # --- Exécution ------------------------------------------------------------
+
+    def run(self):
+        """Lance full_correction_process en relayant les sorties AMC dans le journal"""
+        self.status = 'running'
+        self.started = time.time()
+        self.emit({'type': 'status', 'status': 'running'})
+
+        try:
+            amc = AMCManager(self.project_path, output_callback=self.emit)
+            results = amc.full_correction_process(
+                scoring_strategy=self.params.get('scoring_strategy', 'adaptive'),
+                auto_optimize=self.params.get('auto_optimize', True),
+                generate_reports=self.params.get('generate_reports', True)
+            )
+            self.results = json.loads(json.dumps(results, default=str))
+
+            first_failure = next(((step, res) for step, res in results
+                                  if isinstance(res, dict) and 'success' in res and not res['success']), None)
+            if first_failure:
+                self.error = f"La correction a échoué à l'étape '{first_failure[0]}': {first_failure[1].get('error', 'Erreur inconnue')}"
+                self.status = 'failed'
+            else:
+                self.status = 'done'
+        except Exception as e:
+            self.error = f"Erreur interne: {e}"
+            self.status = 'failed'
+
+        self.finished = time.time()
+        self.emit({'type': 'status', 'status': self.status, 'error': self.error})
+
+
+class CorrectionBatch:
+    """Lot de corrections lancé sur plusieurs projets"""
+
+    def __init__(self, params=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.params = params or {}
+        self.created = time.time()
+        self.entries = []
+
+    def add(self, project_id, job=None, error=None):
+        """Ajoute un projet au lot, avec sa tâche ou l'erreur qui empêche de le corriger"""
+        self.entries.append({'project_id': project_id, 'job': job, 'error': error})
+
+    def to_dict(self):
+        projects = []
+        for entry in self.entries:
+            job = entry['job']
+            if job is None:
+                projects.append({
+                    'project_id': entry['project_id'],
+                    'state': 'rejected',
+                    'success': False,
+                    'error': entry['error']
+                })
+            else:
+                data = job.to_dict()
+                data['state'] = job.status
+                data['success'] = job.status == 'done'
+                projects.append(data)
+
+        states = [p['state'] for p in projects]
+        finished = sum(1 for state in states if state in ('done', 'failed', 'rejected'))
+        successful = states.count('done')
+
+        return {
+            'batch_id': self.id,
+            'created': datetime.fromtimestamp(self.created).isoformat(),
+            'finished': finished == len(projects),
+            'summary': {
+                'total_projects': len(projects),
+                'queued': states.count('queued'),
+                'running': states.count('running'),
+                'successful_corrections': successful,
+                'failed_corrections': states.count('failed') + states.count('rejected'),
+                'success_rate': (successful / len(projects)) * 100 if projects else 0
+            },
+            'projects': projects
+        }
+
+
+class JobRegistry:
+    """Registre en mémoire des tâches de correction, avec ordonnancement équitable
+    entre enseignants sur un pool de workers borné"""
+
+    def __init__(self, max_workers=MAX_PARALLEL_CORRECTIONS, max_jobs_per_user=MAX_JOBS_PER_USER):
+        self.max_workers = max(1, max_workers)
+        self.max_jobs_per_user = max(1, max_jobs_per_user)
+        self._jobs = {}
+        self._batches = {}
+        self._queue = []
+        self._running = {}
+        self._lock = threading.RLock()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_batch(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def active_job_for(self, project_id):
+        """Tâche en attente ou en cours pour un projet, s'il y en a une"""
+        with self._lock:
+            for job in self._jobs.values():
+                if job.project_id == project_id and not job.is_finished():
+                    return job
+        return None
+
+    def submit(self, project_id, project_path, params=None):
+        """Crée une tâche (ou réutilise celle déjà en cours) et la place en file d'attente"""
+        with self._lock:
+            existing = self.active_job_for(project_id)
+            if existing:
+                return existing, False
+
+            self._prune()
+            job = CorrectionJob(project_id, project_path, params)
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            job.emit({'type': 'status', 'status': 'queued', 'queue_position': len(self._queue)})
+            self._dispatch()
+        return job, True
+
+    def create_batch(self, params=None):
+        """Crée un lot vide ; les projets y sont ajoutés par l'appelant"""
+        batch = CorrectionBatch(params)
+        with self._lock:
+            self._prune()
+            self._batches[batch.id] = batch
+        return batch
+
+    def stats(self):
+        """Nombre de tâches en attente et en cours, globalement et par enseignant"""
+        with self._lock:
+            per_user = {}
+            for job in self._queue:
+                per_user.setdefault(str(job.user_id), {'queued': 0, 'running': 0})['queued'] += 1
+            for job in self._running.values():
+                per_user.setdefault(str(job.user_id), {'queued': 0, 'running': 0})['running'] += 1
+            return {
+                'queued': len(self._queue),
+                'running': len(self._running),
+                'max_workers': self.max_workers,
+                'max_jobs_per_user': self.max_jobs_per_user,
+                'per_user': per_user
+            }
+
+    def _prune(self, now=None):
+        """Oublie les tâches terminées trop anciennes, puis les plus anciennes au-delà de MAX_FINISHED_JOBS"""
+        now = now or time.time()
+        with self._lock:
+            finished = sorted((job for job in self._jobs.values() if job.is_finished()),
+                              key=lambda job: job.finished or job.created)
+            excess = len(finished) - MAX_FINISHED_JOBS
+            for position, job in enumerate(finished):
+                if position < excess or now - (job.finished or job.created) > FINISHED_JOB_TTL_SECONDS:
+                    del self._jobs[job.id]
+
+            # Lots dont toutes les tâches sont terminées (ou oubliées) depuis plus de la durée de rétention
+            for batch_id, batch in list(self._batches.items()):
+                jobs = [entry['job'] for entry in batch.entries if entry['job'] is not None]
+                if all(job.is_finished() for job in jobs):
+                    ended = max([job.finished or job.created for job in jobs], default=batch.created)
+                    if now - ended > FINISHED_JOB_TTL_SECONDS:
+                        del self._batches[batch_id]
+
+    def cpu_share(self):
+        """Part du budget CPU (max_workers) disponible pour chaque correction en cours"""
+        with self._lock:
+            return max(1, self.max_workers // max(1, len(self._running)))
+
+    def _running_for(self, user_id):
+        return sum(1 for job in self._running.values() if job.user_id == user_id)
+
+    def _next_job(self):
+        """Choisit la prochaine tâche selon le partage équitable.
+
+        Seuls les enseignants sous leur quota de tâches simultanées sont éligibles ;
+        on sert d'abord celui qui a le moins de corrections en cours, puis le projet
+        le plus petit (coût vieilli), puis le plus ancien. Retourne None si aucune
+        tâche n'est éligible.
+        """
+        now = time.time()
+        running_by_user = {}
+        candidates = []
+        for job in self._queue:
+            if job.user_id not in running_by_user:
+                running_by_user[job.user_id] = self._running_for(job.user_id)
+            if running_by_user[job.user_id] < self.max_jobs_per_user:
+                candidates.append(job)
+
+        if not candidates:
+            return None
+
+        job = min(candidates, key=lambda j: (running_by_user[j.user_id], j.effective_cost(now), j.created))
+        self._queue.remove(job)
+        return job
+
+    def _dispatch(self):
+        """Lance des tâches tant que le budget de workers n'est pas atteint"""
+        with self._lock:
+            while self._queue and len(self._running) < self.max_workers:
+                job = self._next_job()
+                if job is None:
+                    break
+                self._running[job.id] = job
+                threading.Thread(target=self._run_job, args=(job,),
+                                 name=f'correction-{job.id}', daemon=True).start()
+
+    def _run_job(self, job):
+        try:
+            job.run()
+        finally:
+            with self._lock:
+                self._running.pop(job.id, None)
+                self._prune()
+                self._dispatch()
+
+
+job_registry = JobRegistry()
+
+
+def _jobs_by_state():
+    stats = job_registry.stats()
+    return {('queued',): stats['queued'], ('running',): stats['running']}
+
+
+register_gauge('amc_correction_jobs', 'Tâches de correction en attente et en cours', _jobs_by_state,
+               labels=('state',))
+register_gauge('amc_correction_workers', 'Nombre maximal de corrections simultanées',
+               lambda: {(): job_registry.max_workers})
+
+
+def format_sse(event):
+    """Formate un événement au format text/event-stream"""
+    payload = json.dumps(event, default=str, ensure_ascii=False)
+    return f"id: {event['seq']}\nevent: {event['type']}\ndata: {payload}\n\n"
+
+
+def register_job_routes(app, AMC_PROJECTS_FOLDER):
+    """Enregistre les routes de suivi des tâches de correction"""
+
+    @app.route('/api/correction/jobs/<project_id>', methods=['POST'])
+    def api_start_correction_job(project_id):
+        """Démarre une correction en tâche de fond et retourne l'identifiant de la tâche"""
+        project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
+        if not os.path.exists(project_path):
+            return jsonify({'success': False, 'error': 'Projet non trouvé'}), 404
+
+        params = request.get_json(silent=True) or {}
+        job, created = job_registry.submit(project_id, project_path, params)
+
+        return jsonify({
+            'success': True,
+            'created': created,
+            'job': job.to_dict(),
+            'stream_url': f'/api/correction/jobs/{job.id}/stream'
+        }), 202 if created else 200
+
+    @app.route('/api/correction/jobs/<job_id>/status')
+    def api_correction_job_status(job_id):
+        """État courant d'une tâche de correction"""
+        job = job_registry.get(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Tâche inconnue'}), 404
+
+        data = job.to_dict()
+        if job.is_finished():
+            data['results'] = job.results
+        return jsonify({'success': True, 'job': data})
+
+    @app.route('/api/correction/batch/<batch_id>')
+    def api_correction_batch_status(batch_id):
+        """État d'un lot de corrections (à interroger périodiquement)"""
+        batch = job_registry.get_batch(batch_id)
+        if not batch:
+            return jsonify({'success': False, 'error': 'Lot inconnu'}), 404
+
+        return jsonify({'success': True, 'batch': batch.to_dict(), 'scheduler': job_registry.stats()})
+
+    @app.route('/api/correction/jobs/<job_id>/stream')
+    def api_correction_job_stream(job_id):
+        """Flux Server-Sent Events des sorties AMC et de la progression"""
+        job = job_registry.get(job_id)
+        if not job:
+            return jsonify({'success': False, 'error': 'Tâche inconnue'}), 404
+
+        # Reprise après reconnexion du navigateur
+        last_seq = request.headers.get('Last-Event-ID', request.args.get('last_event_id', 0))
+        try:
+            last_seq = int(last_seq)
+        except (TypeError, ValueError):
+            last_seq = 0
+
+        def generate():
+            seq = last_seq
+            yield 'retry: 3000\n\n'
+            while True:
+                events = job.events_since(seq)
+                for event in events:
+                    seq = event['seq']
+                    if event['type'] == 'output':
+                        event = dict(event, eta_seconds=job.eta_seconds())
+                    yield format_sse(event)
+
+                if job.is_finished() and not job.events_since(seq, timeout=0):
+                    yield f"event: end\ndata: {json.dumps(job.to_dict(), default=str)}\n\n"
+                    return
+
+                if not events:
+                    # Commentaire de maintien de la connexion
+                    yield ': keep-alive\n\n'
+
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
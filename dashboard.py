@@ -1,14 +1,25 @@
 from flask import render_template, jsonify, request
 import os
 import json
+import threading
+import time
 from datetime import datetime, timedelta
 import pandas as pd
 from collections import defaultdict
 from pathlib import Path
+from results_store import load_results
+from metrics import performance_summary
+
+# Durée de validité du nombre de copies traitées utilisé par les métriques de performance
+# (son calcul parcourt tous les projets)
+PERFORMANCE_STATS_TTL = int(os.environ.get('AMC_PERFORMANCE_STATS_TTL', '300'))
 
 def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
     """Enregistre les routes du dashboard"""
     
+    papers_cache = {'value': None, 'time': 0.0}
+    papers_cache_lock = threading.Lock()
+    
     @app.route('/dashboard')
     def dashboard():
         """Page principale du dashboard avec statistiques"""
@@ -35,6 +46,11 @@ def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
         project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
         return jsonify(get_scores_distribution(project_path))
     
+    @app.route('/api/stats/performance')
+    def api_stats_performance():
+        """API pour les métriques de fonctionnement (commandes AMC, requêtes, caches)"""
+        return jsonify(get_system_performance_metrics())
+    
     @app.route('/api/chart/questions/<project_id>')
     def api_chart_questions(project_id):
         """API pour l'analyse par question"""
@@ -152,7 +168,7 @@ def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
             return stats
         
         try:
-            df = pd.read_csv(csv_file)
+            df = load_results(os.path.dirname(csv_file), columns=['Note'], include_questions=True)
             
             if df.empty:
                 return stats
@@ -213,7 +229,7 @@ def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
             return {'labels': [], 'data': []}
         
         try:
-            df = pd.read_csv(csv_file)
+            df = load_results(os.path.dirname(csv_file), columns=['Note'])
             
             if 'Note' in df.columns:
                 scores = df['Note'].dropna()
@@ -243,7 +259,7 @@ def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
             return {'labels': [], 'data': []}
         
         try:
-            df = pd.read_csv(csv_file)
+            df = load_results(os.path.dirname(csv_file), columns=[], include_questions=True)
             
             question_cols = [col for col in df.columns if col.startswith('Q:')]
             
@@ -310,8 +326,7 @@ def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
                 
                 try:
                     # Analyser les résultats
-                    import pandas as pd
-                    df = pd.read_csv(csv_file)
+                    df = load_results(exports_path, columns=['Note'], include_questions=True)
                     
                     if not df.empty and 'Note' in df.columns:
                         stats['total_students_corrected'] += len(df)
@@ -391,8 +406,7 @@ def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
             status['is_corrected'] = True
             
             try:
-                import pandas as pd
-                df = pd.read_csv(csv_file)
+                df = load_results(os.path.dirname(csv_file), columns=['Note'])
                 
                 if not df.empty and 'Note' in df.columns:
                     scores = df['Note'].dropna()
@@ -580,18 +594,44 @@ def register_dashboard_routes(app, AMC_PROJECTS_FOLDER):
         
         return patterns
 
+    def get_processed_papers_count():
+        """Nombre de copies traitées, recalculé au plus toutes les PERFORMANCE_STATS_TTL secondes"""
+        with papers_cache_lock:
+            if papers_cache['value'] is None or time.monotonic() - papers_cache['time'] > PERFORMANCE_STATS_TTL:
+                papers_cache['value'] = get_global_statistics().get('total_papers_processed', 0)
+                papers_cache['time'] = time.monotonic()
+            return papers_cache['value']
+
     def get_system_performance_metrics():
-        """Récupère les métriques de performance du système"""
+        """Récupère les métriques de performance du système (mesurées depuis le démarrage, voir metrics.py)"""
+        summary = performance_summary()
+        commands = summary['commands']
+        
+        succeeded = sum(c['success'] for c in commands.values())
+        failed = sum(c['failure'] for c in commands.values())
+        executed = succeeded + failed
+        
         metrics = {
-            'total_processing_time': 0,
+            'total_processing_time': round(sum(c.get('total_seconds', 0) for c in commands.values()), 3),
             'average_time_per_student': 0,
-            'success_rate': 0,
-            'error_rate': 0,
+            'success_rate': round(succeeded / executed * 100, 1) if executed else 0,
+            'error_rate': round(failed / executed * 100, 1) if executed else 0,
             'most_efficient_settings': {},
-            'bottlenecks': []
+            # Commandes les plus coûteuses en temps cumulé
+            'bottlenecks': [
+                {'command': name, 'total_seconds': c.get('total_seconds', 0),
+                 'average_seconds': c.get('average_seconds', 0), 'runs': c['success'] + c['failure']}
+                for name, c in sorted(commands.items(), key=lambda item: item[1].get('total_seconds', 0),
+                                      reverse=True)[:5]
+            ],
+            'commands': commands,
+            'routes': summary['routes'],
+            'caches': summary['caches']
         }
         
-        # Ces métriques pourraient être collectées via des logs
-        # ou des mesures en temps réel lors des corrections
+        # Temps moyen par copie : durée cumulée des analyses rapportée au nombre de copies détectées
+        analysed = get_processed_papers_count()
+        if analysed and 'analyse' in commands:
+            metrics['average_time_per_student'] = round(commands['analyse'].get('total_seconds', 0) / analysed, 3)
         
         return metrics
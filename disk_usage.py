@@ -0,0 +1,187 @@
+# disk_usage.py - Espace disque occupé par projet et quotas par utilisateur (table project_usage)
+import json
+import os
+import sqlite3
+import threading
+
+USER_DB = 'amc_users.db'
+
+# Quota par utilisateur en Mo (0 = illimité) ; désactivé tant que AMC_USER_QUOTA_MB n'est pas défini
+USER_QUOTA_MB = int(os.environ.get('AMC_USER_QUOTA_MB', '0'))
+USER_QUOTA_BYTES = USER_QUOTA_MB * 1024 * 1024
+
+_table_ready = False
+_table_lock = threading.Lock()
+# Dossiers de projets dont tous les projets ont déjà été mesurés par ce processus
+_backfilled_folders = set()
+_backfill_lock = threading.Lock()
+
+
+def _connect():
+    global _table_ready
+    conn = sqlite3.connect(USER_DB, timeout=30)
+    if not _table_ready:
+        with _table_lock:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS project_usage (
+                    project_id TEXT PRIMARY KEY,
+                    user_id INTEGER,
+                    bytes INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_project_usage_user ON project_usage(user_id)')
+            conn.commit()
+            _table_ready = True
+    return conn
+
+
+def directory_size(path):
+    """Taille totale des fichiers d'un répertoire (parcours os.scandir, liens ignorés)"""
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            total += entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+def _project_owner(project_path):
+    try:
+        with open(os.path.join(project_path, 'project_info.json'), 'r') as f:
+            return json.load(f).get('user_id')
+    except (OSError, ValueError):
+        return None
+
+
+def refresh_project_usage(project_path):
+    """Recalcule la taille d'un seul projet (après une correction ou un nettoyage)"""
+    project_path = str(project_path)
+    size = directory_size(project_path)
+    conn = _connect()
+    try:
+        conn.execute('''
+            INSERT INTO project_usage (project_id, user_id, bytes, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(project_id) DO UPDATE SET
+                user_id = excluded.user_id, bytes = excluded.bytes, updated_at = CURRENT_TIMESTAMP
+        ''', (os.path.basename(os.path.normpath(project_path)), _project_owner(project_path), size))
+        conn.commit()
+    finally:
+        conn.close()
+    return size
+
+
+def add_project_usage(project_path, delta):
+    """Ajoute delta octets au total d'un projet (upload, suppression de fichier) sans parcourir le disque"""
+    project_id = os.path.basename(os.path.normpath(str(project_path)))
+    conn = _connect()
+    try:
+        updated = conn.execute('''
+            UPDATE project_usage SET bytes = MAX(0, bytes + ?), updated_at = CURRENT_TIMESTAMP
+            WHERE project_id = ?
+        ''', (delta, project_id)).rowcount
+        conn.commit()
+    finally:
+        conn.close()
+    if not updated:
+        # Projet antérieur au suivi : une seule mesure complète, les suivantes seront incrémentales
+        refresh_project_usage(project_path)
+
+
+def remove_project_usage(project_id):
+    conn = _connect()
+    try:
+        conn.execute('DELETE FROM project_usage WHERE project_id = ?', (project_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_projects_usage(project_ids):
+    """Octets occupés par projet : {project_id: bytes} (projets inconnus absents)"""
+    project_ids = list(project_ids)
+    if not project_ids:
+        return {}
+    conn = _connect()
+    try:
+        placeholders = ','.join('?' * len(project_ids))
+        rows = conn.execute(f'SELECT project_id, bytes FROM project_usage WHERE project_id IN ({placeholders})',
+                            project_ids).fetchall()
+    finally:
+        conn.close()
+    return dict(rows)
+
+
+def get_user_usage(user_id):
+    """Espace occupé par tous les projets d'un utilisateur, et son quota"""
+    conn = _connect()
+    try:
+        used, projects = conn.execute('SELECT COALESCE(SUM(bytes), 0), COUNT(*) FROM project_usage WHERE user_id = ?',
+                                      (user_id,)).fetchone()
+    finally:
+        conn.close()
+    return {'user_id': user_id, 'bytes': used, 'projects': projects, 'quota_bytes': USER_QUOTA_BYTES}
+
+
+def backfill_untracked_projects(projects_folder, project_ids=None):
+    """Mesure les projets absents de l'index (créés avant le suivi de l'occupation).
+
+    Sans project_ids, tous les projets du dossier sont examinés. Les projets déjà
+    suivis ne sont pas reparcourus ; retourne le nombre de projets mesurés.
+    """
+    if project_ids is None:
+        try:
+            # Dossiers cachés (.blobs, .thumbnails) : stockage partagé, pas des projets
+            project_ids = [entry.name for entry in os.scandir(projects_folder)
+                           if entry.is_dir() and not entry.name.startswith('.')]
+        except OSError:
+            return 0
+    project_ids = list(project_ids)
+    tracked = get_projects_usage(project_ids)
+    missing = [project_id for project_id in project_ids if project_id not in tracked]
+    for project_id in missing:
+        refresh_project_usage(os.path.join(projects_folder, project_id))
+    return len(missing)
+
+
+def ensure_projects_tracked(projects_folder):
+    """Rattrapage unique (par processus) des projets non suivis avant un calcul de quota"""
+    key = os.path.abspath(projects_folder)
+    if key in _backfilled_folders:
+        return
+    with _backfill_lock:
+        if key not in _backfilled_folders:
+            backfill_untracked_projects(projects_folder)
+            _backfilled_folders.add(key)
+
+
+def check_quota(user_id, incoming_bytes):
+    """Vérifie qu'un ajout de incoming_bytes reste dans le quota de l'utilisateur.
+
+    Retourne (autorisé, octets utilisés, quota) ; toujours autorisé sans quota
+    ou pour un projet sans propriétaire.
+    """
+    if not USER_QUOTA_BYTES or user_id is None:
+        return True, None, USER_QUOTA_BYTES
+    used = get_user_usage(user_id)['bytes']
+    return used + max(0, incoming_bytes or 0) <= USER_QUOTA_BYTES, used, USER_QUOTA_BYTES
+
+
+def format_bytes(size):
+    """Taille lisible (Ko, Mo, Go)"""
+    size = float(size or 0)
+    for unit in ('o', 'Ko', 'Mo', 'Go'):
+        if size < 1024 or unit == 'Go':
+            return f"{size:.0f} {unit}" if unit == 'o' else f"{size:.1f} {unit}"
+        size /= 1024
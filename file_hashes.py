@@ -0,0 +1,78 @@
+# file_hashes.py - Empreintes des fichiers générés (ETag des téléchargements, fraîcheur des PDF)
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+MANIFEST_FILE = 'file_hashes.json'
+
+_manifest_lock = threading.Lock()
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _manifest_path(project_path):
+    return Path(project_path) / MANIFEST_FILE
+
+
+def _load_manifest(project_path):
+    try:
+        with open(_manifest_path(project_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(project_path, manifest):
+    manifest_file = _manifest_path(project_path)
+    tmp_file = manifest_file.with_name(f"{manifest_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_file, manifest_file)
+
+
+def _key(project_path, file_path):
+    return Path(file_path).resolve().relative_to(Path(project_path).resolve()).as_posix()
+
+
+def record_file_hash(project_path, file_path, **extra):
+    """Enregistre l'empreinte d'un fichier au moment où il est généré.
+
+    extra : informations complémentaires conservées avec l'empreinte
+    (par ex. l'empreinte des sources qui ont produit le fichier).
+    """
+    file_path = Path(file_path)
+    stat = file_path.stat()
+    entry = {'sha256': file_sha256(file_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, **extra}
+    with _manifest_lock:
+        manifest = _load_manifest(project_path)
+        manifest[_key(project_path, file_path)] = entry
+        _save_manifest(project_path, manifest)
+    return entry
+
+
+def get_file_entry(project_path, file_path):
+    """Empreinte enregistrée, si le fichier n'a pas changé depuis ; None sinon"""
+    file_path = Path(file_path)
+    if not file_path.exists():
+        return None
+    entry = _load_manifest(project_path).get(_key(project_path, file_path))
+    stat = file_path.stat()
+    if entry and (entry.get('size'), entry.get('mtime_ns')) == (stat.st_size, stat.st_mtime_ns):
+        return entry
+    return None
+
+
+def get_file_hash(project_path, file_path):
+    """Empreinte du fichier : celle enregistrée à la génération, sinon calculée et enregistrée"""
+    entry = get_file_entry(project_path, file_path)
+    if entry is None:
+        entry = record_file_hash(project_path, file_path)
+    return entry['sha256']
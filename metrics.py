@@ -0,0 +1,261 @@
+# metrics.py - Métriques de fonctionnement (latence des requêtes, tâches, commandes AMC, caches) au format Prometheus
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, abort, g, request
+
+# Adresses autorisées à lire /metrics (collecte locale par défaut)
+METRICS_ALLOWED_HOSTS = {h.strip() for h in os.environ.get('AMC_METRICS_ALLOWED_HOSTS', '127.0.0.1,::1').split(',')
+                         if h.strip()}
+
+# Bornes des histogrammes, en secondes
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COMMAND_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+AMC_COMMAND_RE = re.compile(r'auto-multiple-choice\s+([\w-]+)')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Compteur croissant, éventuellement décliné par étiquettes"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in sorted(self.values().items())]
+
+
+class Gauge:
+    """Valeur instantanée, lue au moment de la collecte par une fonction {étiquettes: valeur}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labels=(), callback=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.callback = callback
+
+    def values(self):
+        if self.callback is None:
+            return {}
+        try:
+            return self.callback()
+        except Exception:
+            return {}
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}'
+                for key, value in sorted(self.values().items())]
+
+
+class Histogram:
+    """Histogramme cumulatif (bornes fixes) avec somme et nombre d'observations"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = {'counts': [0] * (len(self.buckets) + 1),
+                                                       'sum': 0.0, 'count': 0}
+            series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def summary(self):
+        """{étiquettes: (nombre, somme)} — utilisé par le tableau de bord"""
+        with self._lock:
+            return {key: (s['count'], s['sum']) for key, s in self._series.items()}
+
+    def render(self):
+        with self._lock:
+            series = {key: {'counts': list(s['counts']), 'sum': s['sum'], 'count': s['count']}
+                      for key, s in self._series.items()}
+        lines = []
+        for key, s in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), s['counts']):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), key + (_format_value(float(bound)),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(s["sum"])}')
+            lines.append(f'{self.name}_count{labels} {s["count"]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        lines = []
+        for metric in sorted(self._metrics.values(), key=lambda m: m.name):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'amc_http_requests_total', 'Requêtes HTTP traitées', ('route', 'method', 'status')))
+http_request_duration = registry.register(Histogram(
+    'amc_http_request_duration_seconds', 'Durée de traitement des requêtes HTTP', ('route', 'method'),
+    REQUEST_BUCKETS))
+_in_flight = {'value': 0}
+_in_flight_lock = threading.Lock()
+registry.register(Gauge(
+    'amc_http_requests_in_flight', 'Requêtes HTTP en cours', callback=lambda: {(): _in_flight['value']}))
+
+amc_commands = registry.register(Counter(
+    'amc_commands_total', 'Commandes externes exécutées (AMC, LaTeX...)', ('command', 'outcome')))
+amc_command_duration = registry.register(Histogram(
+    'amc_command_duration_seconds', 'Durée des commandes externes', ('command',), COMMAND_BUCKETS))
+
+cache_requests = registry.register(Counter(
+    'amc_cache_requests_total', 'Accès aux caches (hit : réutilisé, miss : recalculé)', ('cache', 'result')))
+
+
+def command_name(command):
+    """Nom court d'une commande : sous-commande AMC (prepare, analyse...) ou exécutable"""
+    match = AMC_COMMAND_RE.search(command)
+    if match:
+        return match.group(1)
+    parts = command.split() if isinstance(command, str) else list(command)
+    # Variables d'environnement en préfixe (TEXFORMATS=... pdflatex ...)
+    parts = [part for part in parts if '=' not in part.split('/')[0]]
+    return os.path.basename(parts[0]).strip("'\"") if parts else 'unknown'
+
+
+def record_command(command, duration, success):
+    """Compte une commande exécutée et sa durée (success : code de retour nul)"""
+    name = command_name(command)
+    amc_commands.inc(name, 'success' if success else 'failure')
+    amc_command_duration.observe(duration, name)
+
+
+def record_cache(cache, hit):
+    cache_requests.inc(cache, 'hit' if hit else 'miss')
+
+
+def register_gauge(name, help_text, callback, labels=()):
+    """Ajoute une jauge lue à la collecte (callback -> {tuple d'étiquettes: valeur})"""
+    return registry.register(Gauge(name, help_text, labels, callback))
+
+
+def cache_hit_rates():
+    """Taux de réussite par cache : {cache: {'hits', 'misses', 'hit_rate'}}"""
+    rates = {}
+    for (cache, result), count in cache_requests.values().items():
+        rates.setdefault(cache, {'hits': 0, 'misses': 0})['hits' if result == 'hit' else 'misses'] += count
+    for stats in rates.values():
+        total = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / total, 4) if total else None
+    return rates
+
+
+def performance_summary():
+    """Vue synthétique des métriques pour le tableau de bord"""
+    commands = {}
+    for (name, outcome), count in amc_commands.values().items():
+        commands.setdefault(name, {'success': 0, 'failure': 0})[outcome] += count
+    for (name,), (count, total) in amc_command_duration.summary().items():
+        commands.setdefault(name, {'success': 0, 'failure': 0}).update(
+            total_seconds=round(total, 3), average_seconds=round(total / count, 3) if count else 0)
+
+    routes = {}
+    for (route, method), (count, total) in http_request_duration.summary().items():
+        routes[f'{method} {route}'] = {'count': count, 'average_seconds': round(total / count, 4) if count else 0}
+
+    return {'commands': commands, 'routes': routes, 'caches': cache_hit_rates()}
+
+
+def register_metrics_routes(app):
+    """Mesure la latence de chaque route et expose /metrics (format texte Prometheus)"""
+
+    @app.before_request
+    def _metrics_start():
+        g._metrics_started = time.perf_counter()
+        with _in_flight_lock:
+            _in_flight['value'] += 1
+
+    @app.teardown_request
+    def _metrics_end(exc=None):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        with _in_flight_lock:
+            _in_flight['value'] -= 1
+        # Gabarit de la route (et non l'URL) : nombre de séries borné
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        status = g.pop('_metrics_status', 500 if exc else 200)
+        http_request_duration.observe(time.perf_counter() - started, route, request.method)
+        http_requests.inc(route, request.method, status)
+
+    @app.after_request
+    def _metrics_status(response):
+        g._metrics_status = response.status_code
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if METRICS_ALLOWED_HOSTS and request.remote_addr not in METRICS_ALLOWED_HOSTS:
+            abort(403)
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
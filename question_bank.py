@@ -0,0 +1,131 @@
+# question_bank.py - Banque de questions : fragments LaTeX mémorisés par empreinte de contenu
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from metrics import record_cache
+
+# À incrémenter quand le gabarit LaTeX d'une question change (invalide tous les fragments)
+FRAGMENT_FORMAT_VERSION = 1
+
+QUESTION_BANK_DIR = 'question_bank'
+# Banque partagée entre projets (optionnelle) : répertoire commun des fragments
+SHARED_QUESTION_BANK = os.environ.get('AMC_SHARED_QUESTION_BANK', '')
+
+MEMORY_CACHE_SIZE = 5000
+
+_memory_cache = OrderedDict()
+_memory_lock = threading.Lock()
+
+
+def question_hash(question):
+    """Empreinte SHA-256 des champs d'une question qui influencent son rendu LaTeX"""
+    payload = {
+        'version': FRAGMENT_FORMAT_VERSION,
+        'id': question.get('id', 'q1'),
+        'text': question.get('text', ''),
+        'choices': [
+            {'text': choice.get('text', ''), 'correct': bool(choice.get('correct', False))}
+            for choice in question.get('choices', [])
+        ]
+    }
+    canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _remember(key, fragment):
+    with _memory_lock:
+        _memory_cache[key] = fragment
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+
+def _recall(key):
+    with _memory_lock:
+        fragment = _memory_cache.get(key)
+        if fragment is not None:
+            _memory_cache.move_to_end(key)
+        return fragment
+
+
+class QuestionBank:
+    """Fragments LaTeX d'un projet, un fichier <empreinte>.tex par question.
+
+    Un fragment n'est rendu qu'une fois par contenu : les lectures passent par
+    un cache mémoire, puis la banque du projet, puis la banque partagée.
+    """
+
+    def __init__(self, project_path, shared_path=None):
+        self.path = Path(project_path) / QUESTION_BANK_DIR
+        shared_path = shared_path if shared_path is not None else SHARED_QUESTION_BANK
+        self.shared_path = Path(shared_path) if shared_path else None
+        self.hits = 0
+        self.misses = 0
+
+    def _read(self, directory, key):
+        fragment_file = directory / f'{key}.tex'
+        if fragment_file.exists():
+            return fragment_file.read_text(encoding='utf-8')
+        return None
+
+    def _write(self, directory, key, fragment):
+        directory.mkdir(parents=True, exist_ok=True)
+        fragment_file = directory / f'{key}.tex'
+        tmp_file = fragment_file.with_name(f'{key}.{os.getpid()}.{threading.get_ident()}.tmp')
+        tmp_file.write_text(fragment, encoding='utf-8')
+        os.replace(tmp_file, fragment_file)
+
+    def fragment(self, question, render):
+        """Retourne le fragment LaTeX de la question, rendu par render(question) si absent"""
+        key = question_hash(question)
+
+        fragment = _recall(key)
+        if fragment is None:
+            fragment = self._read(self.path, key)
+            if fragment is None and self.shared_path:
+                fragment = self._read(self.shared_path, key)
+                if fragment is not None:
+                    self._write(self.path, key, fragment)
+
+        record_cache('question_bank', fragment is not None)
+        if fragment is not None:
+            self.hits += 1
+            if not (self.path / f'{key}.tex').exists():
+                self._write(self.path, key, fragment)
+        else:
+            self.misses += 1
+            fragment = render(question)
+            self._write(self.path, key, fragment)
+            if self.shared_path:
+                self._write(self.shared_path, key, fragment)
+
+        _remember(key, fragment)
+        return fragment
+
+    def assemble(self, questions, render):
+        """Concatène les fragments de toutes les questions et purge ceux devenus inutiles"""
+        keys = set()
+        parts = []
+        for question in questions:
+            keys.add(question_hash(question))
+            parts.append(self.fragment(question, render))
+        self.prune(keys)
+        return ''.join(parts)
+
+    def prune(self, keep):
+        """Supprime les fragments du projet qui ne correspondent plus à aucune question"""
+        if not self.path.exists():
+            return 0
+        removed = 0
+        for fragment_file in self.path.glob('*.tex'):
+            if fragment_file.stem not in keep:
+                try:
+                    fragment_file.unlink()
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
@@ -0,0 +1,451 @@
+# results_store.py - Stockage colonne (Arrow) et index paginé des résultats de correction
+import base64
+import binascii
+import csv
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from metrics import record_cache
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    ARROW_ENABLED = True
+except ImportError:
+    ARROW_ENABLED = False
+
+# Moteur d'écriture XLSX (optionnel)
+try:
+    import openpyxl  # noqa: F401
+    XLSX_ENABLED = True
+except ImportError:
+    XLSX_ENABLED = False
+
+RESULTS_CSV = 'notes.csv'
+RESULTS_ARROW = 'notes.arrow'
+RESULTS_XLSX = 'notes.xlsx'
+
+# Colonnes de notes globales converties en nombres
+SCORE_COLUMNS = ('Note', 'Total', 'Max')
+# Préfixe des colonnes de score par question dans l'export AMC
+QUESTION_PREFIX = 'Q:'
+
+
+def is_numeric_column(name):
+    """Indique si une colonne de l'export AMC contient des scores"""
+    return name in SCORE_COLUMNS or name.startswith(QUESTION_PREFIX)
+
+
+def _typed_frame(df):
+    """Convertit les scores en float et les identifiants/noms en texte"""
+    for col in df.columns:
+        if is_numeric_column(col):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+        else:
+            df[col] = df[col].astype('string')
+    return df
+
+
+def read_results_csv(csv_file, columns=None):
+    """Lit notes.csv en DataFrame typé (scores en float, identifiants en texte)"""
+    return _typed_frame(pd.read_csv(csv_file, usecols=columns, dtype=str,
+                                    keep_default_na=False, na_values=['']))
+
+
+def write_columnar_results(csv_file, arrow_file=None):
+    """Écrit le fichier Arrow typé correspondant à notes.csv.
+
+    Le fichier est non compressé pour pouvoir être projeté en mémoire (mmap)
+    par les lecteurs. Retourne un dictionnaire de résultat comme les autres étapes.
+    """
+    csv_file = Path(csv_file)
+    if arrow_file is None:
+        arrow_file = csv_file.with_name(RESULTS_ARROW)
+
+    if not ARROW_ENABLED:
+        return {'success': False, 'error': 'pyarrow non installé, stockage colonne désactivé'}
+
+    if not csv_file.exists():
+        return {'success': False, 'error': f'{csv_file} introuvable'}
+
+    try:
+        return write_columnar_frame(read_results_csv(csv_file), arrow_file)
+    except Exception as e:
+        return {'success': False, 'error': f'Erreur écriture Arrow: {e}'}
+
+
+def write_columnar_frame(df, arrow_file):
+    """Écrit un DataFrame déjà typé au format Arrow, de façon atomique"""
+    arrow_file = Path(arrow_file)
+    tmp_file = arrow_file.with_name(arrow_file.name + '.tmp')
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    feather.write_feather(table, tmp_file, compression='uncompressed')
+    os.replace(tmp_file, arrow_file)
+    return {'success': True, 'file_path': str(arrow_file), 'rows': table.num_rows}
+
+
+def write_spreadsheet(df, output_file, engine):
+    """Écrit le tableau des notes en XLSX via pandas, de façon atomique"""
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(f"{output_file.stem}.tmp{output_file.suffix}")
+    df.to_excel(tmp_file, index=False, sheet_name='Notes', engine=engine)
+    os.replace(tmp_file, output_file)
+    return {'success': True, 'file_path': str(output_file), 'rows': len(df)}
+
+
+def export_frame(df, exports_path, formats=('arrow', 'xlsx')):
+    """Écrit en parallèle les formats dérivés d'un même DataFrame.
+
+    Les données ne sont lues qu'une fois (par l'appelant) quel que soit le nombre
+    de formats. Retourne {format: résultat} ; un format dont le moteur n'est pas
+    installé est signalé en échec pour permettre un repli.
+    """
+    exports_path = Path(exports_path)
+    available = {
+        'arrow': (ARROW_ENABLED, lambda: write_columnar_frame(df, exports_path / RESULTS_ARROW), 'pyarrow'),
+        'xlsx': (XLSX_ENABLED, lambda: write_spreadsheet(df, exports_path / RESULTS_XLSX, 'openpyxl'), 'openpyxl'),
+    }
+
+    results, writers = {}, {}
+    for fmt in formats:
+        enabled, writer, package = available[fmt]
+        if enabled:
+            writers[fmt] = writer
+        else:
+            results[fmt] = {'success': False, 'error': f'{package} non installé'}
+
+    with ThreadPoolExecutor(max_workers=max(1, len(writers))) as pool:
+        futures = {fmt: pool.submit(writer) for fmt, writer in writers.items()}
+        for fmt, future in futures.items():
+            try:
+                results[fmt] = future.result()
+            except Exception as e:
+                results[fmt] = {'success': False, 'error': f'Erreur écriture {fmt}: {e}'}
+
+    return results
+
+
+def _arrow_is_fresh(csv_file, arrow_file):
+    if not arrow_file.exists():
+        return False
+    if not csv_file.exists():
+        return True
+    return arrow_file.stat().st_mtime_ns >= csv_file.stat().st_mtime_ns
+
+
+def result_columns(exports_path):
+    """Liste des colonnes disponibles, lue depuis le schéma Arrow sans charger les données"""
+    exports_path = Path(exports_path)
+    csv_file = exports_path / RESULTS_CSV
+    arrow_file = exports_path / RESULTS_ARROW
+
+    if ARROW_ENABLED and _ensure_arrow(csv_file, arrow_file):
+        with pa.memory_map(str(arrow_file), 'r') as source:
+            return pa.ipc.open_file(source).schema.names
+
+    if csv_file.exists():
+        return list(pd.read_csv(csv_file, nrows=0).columns)
+    return []
+
+
+def _ensure_arrow(csv_file, arrow_file):
+    """Régénère le fichier Arrow s'il est absent ou plus ancien que notes.csv"""
+    if _arrow_is_fresh(csv_file, arrow_file):
+        return True
+    if csv_file.exists():
+        return write_columnar_results(csv_file, arrow_file)['success']
+    return False
+
+
+def load_results(exports_path, columns=None, include_questions=False):
+    """Charge les résultats d'un projet avec projection de colonnes.
+
+    columns: colonnes souhaitées (None = toutes). Les colonnes absentes sont ignorées.
+    include_questions: ajoute toutes les colonnes de score par question ('Q:...').
+    Retourne None si aucun résultat n'est disponible.
+    """
+    exports_path = Path(exports_path)
+    csv_file = exports_path / RESULTS_CSV
+    arrow_file = exports_path / RESULTS_ARROW
+
+    if columns is not None:
+        available = result_columns(exports_path)
+        wanted = [c for c in columns if c in available]
+        if include_questions:
+            wanted += [c for c in available if c.startswith(QUESTION_PREFIX) and c not in wanted]
+        columns = wanted
+
+    if ARROW_ENABLED and _ensure_arrow(csv_file, arrow_file):
+        table = feather.read_table(arrow_file, columns=columns, memory_map=True)
+        return table.to_pandas()
+
+    if csv_file.exists():
+        return read_results_csv(csv_file, columns)
+    return None
+
+
+RESULTS_INDEX = 'results_index.sqlite'
+
+# Tris autorisés : nom de paramètre -> colonne SQL indexée
+SORT_COLUMNS = {'row': 'rowid', 'score': 'score_key', 'name': 'name_key'}
+
+# Valeur de tri des copies sans note (placées avant toutes les notes)
+MISSING_SCORE_KEY = -1.0e308
+
+
+# Un verrou par index : des premiers affichages simultanés ne reconstruisent l'index qu'une fois
+_rebuild_locks = {}
+_rebuild_locks_guard = threading.Lock()
+
+
+def _rebuild_lock(db_path):
+    with _rebuild_locks_guard:
+        return _rebuild_locks.setdefault(str(Path(db_path).resolve()), threading.Lock())
+
+
+class ResultsIndex:
+    """Index SQLite des résultats d'un projet pour la pagination côté serveur.
+
+    La table est reconstruite depuis notes.csv uniquement quand celui-ci change ;
+    les pages sont servies par pagination à curseur (keyset) sur des index,
+    sans relire le fichier.
+    """
+
+    def __init__(self, exports_path):
+        self.exports_path = Path(exports_path)
+        self.csv_file = self.exports_path / RESULTS_CSV
+        self.db_path = self.exports_path / RESULTS_INDEX
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _source_signature(self):
+        stat = self.csv_file.stat()
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def is_fresh(self):
+        if not self.db_path.exists() or not self.csv_file.exists():
+            return False
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'source'").fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return False
+        return row is not None and row['value'] == self._source_signature()
+
+    def ensure(self):
+        """Construit l'index si nécessaire ; retourne False si aucun résultat n'existe"""
+        if not self.csv_file.exists():
+            return False
+        if not self.is_fresh():
+            with _rebuild_lock(self.db_path):
+                # Un autre thread a pu reconstruire l'index pendant l'attente du verrou
+                if not self.is_fresh():
+                    self.rebuild()
+        return True
+
+    def rebuild(self):
+        """Reconstruit l'index en une lecture de notes.csv (écriture atomique)"""
+        signature = self._source_signature()
+        # Fichier temporaire propre à cet appel (autres processus servant le même projet)
+        fd, tmp_name = tempfile.mkstemp(prefix=self.db_path.name + '.', suffix='.tmp', dir=self.exports_path)
+        os.close(fd)
+        tmp_path = Path(tmp_name)
+
+        conn = sqlite3.connect(tmp_path)
+        try:
+            conn.executescript("""
+                CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE results (
+                    rowid INTEGER PRIMARY KEY,
+                    student TEXT,
+                    name TEXT,
+                    name_key TEXT,
+                    score REAL,
+                    score_key REAL NOT NULL,
+                    data TEXT
+                );
+            """)
+
+            with open(self.csv_file, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.DictReader(f)
+                fields = reader.fieldnames or []
+                student_col = fields[0] if fields else None
+                name_col = next((c for c in fields if c.strip().lower() in ('nom', 'name')),
+                                fields[2] if len(fields) > 2 else None)
+
+                def rows():
+                    for position, row in enumerate(reader, 1):
+                        name = (row.get(name_col) if name_col else '') or ''
+                        score = _to_float(row.get('Note'))
+                        yield (
+                            position,
+                            row.get(student_col, '') if student_col else '',
+                            name,
+                            name.lower(),
+                            score,
+                            score if score is not None else MISSING_SCORE_KEY,
+                            json.dumps(row, ensure_ascii=False)
+                        )
+
+                conn.executemany("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", rows())
+
+            conn.executescript("""
+                CREATE INDEX idx_results_score ON results(score_key, rowid);
+                CREATE INDEX idx_results_name ON results(name_key, rowid);
+            """)
+            conn.execute("INSERT INTO meta VALUES ('source', ?)", (signature,))
+            conn.execute("INSERT INTO meta VALUES ('columns', ?)", (json.dumps(fields, ensure_ascii=False),))
+            conn.commit()
+        except BaseException:
+            conn.close()
+            tmp_path.unlink(missing_ok=True)
+            raise
+        conn.close()
+
+        os.replace(tmp_path, self.db_path)
+
+    @staticmethod
+    def _filters(min_score=None, max_score=None, search=None):
+        clauses, params = [], []
+        if min_score is not None:
+            clauses.append("score >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            clauses.append("score <= ?")
+            params.append(max_score)
+        if search:
+            clauses.append("name_key LIKE ?")
+            params.append(f"%{search.lower()}%")
+        return clauses, params
+
+    def columns(self):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'columns'").fetchone()
+            return json.loads(row['value']) if row else []
+        finally:
+            conn.close()
+
+    def summary(self, min_score=None, max_score=None, search=None, passing_score=10):
+        """Statistiques calculées en SQL sur les lignes filtrées"""
+        clauses, params = self._filters(min_score, max_score, search)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        conn = self._connect()
+        try:
+            row = conn.execute(f"""
+                SELECT COUNT(*) AS total, COUNT(score) AS scored, AVG(score) AS average,
+                       MIN(score) AS min_score, MAX(score) AS max_score,
+                       SUM(CASE WHEN score >= ? THEN 1 ELSE 0 END) AS passed
+                FROM results {where}
+            """, [passing_score] + params).fetchone()
+            return dict(row)
+        finally:
+            conn.close()
+
+    def page(self, sort='row', order='asc', min_score=None, max_score=None,
+             search=None, cursor=None, limit=50):
+        """Retourne une page de résultats et le curseur de la page suivante"""
+        column = SORT_COLUMNS.get(sort, 'rowid')
+        descending = order == 'desc'
+        comparator = '<' if descending else '>'
+        direction = 'DESC' if descending else 'ASC'
+
+        clauses, params = self._filters(min_score, max_score, search)
+
+        if cursor:
+            last_value, last_rowid = decode_cursor(cursor)
+            if column == 'rowid':
+                clauses.append(f"rowid {comparator} ?")
+                params.append(last_rowid)
+            else:
+                clauses.append(f"({column} {comparator} ? OR ({column} = ? AND rowid {comparator} ?))")
+                params.extend([last_value, last_value, last_rowid])
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        order_by = f"rowid {direction}" if column == 'rowid' else f"{column} {direction}, rowid {direction}"
+
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f"SELECT rowid, {column} AS sort_value, data FROM results {where} "
+                f"ORDER BY {order_by} LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+        finally:
+            conn.close()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = None
+        if has_more and rows:
+            last = rows[-1]
+            next_cursor = encode_cursor(last['sort_value'], last['rowid'])
+
+        return {
+            'rows': [json.loads(row['data']) for row in rows],
+            'next_cursor': next_cursor
+        }
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def encode_cursor(value, rowid):
+    payload = json.dumps([value, rowid]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        value, rowid = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, int(rowid)
+    except (ValueError, TypeError, binascii.Error):
+        raise ValueError('Curseur de pagination invalide')
+
+
+class ResultsContext:
+    """Notes d'une exécution, chargées une seule fois puis partagées.
+
+    Statistiques, contrôle qualité et réponse HTTP lisent le même DataFrame
+    (note globale et scores par question) ; il n'est relu que si notes.csv change.
+    """
+
+    def __init__(self, exports_path):
+        self.exports_path = Path(exports_path)
+        self._signature = None
+        self._frame = None
+
+    def _current_signature(self):
+        csv_file = self.exports_path / RESULTS_CSV
+        if not csv_file.exists():
+            return None
+        stat = csv_file.stat()
+        return stat.st_size, stat.st_mtime_ns
+
+    def frame(self):
+        """DataFrame des notes, ou None si aucun résultat n'est disponible"""
+        signature = self._current_signature()
+        if signature is None:
+            return None
+        record_cache('results_context', signature == self._signature)
+        if signature != self._signature:
+            self._frame = load_results(self.exports_path, columns=['Note'], include_questions=True)
+            self._signature = signature
+        return self._frame
@@ -0,0 +1,360 @@
+# scan_filter.py - Pré-filtrage des pages scannées (pages blanches, doublons, marques de calage) avant l'analyse AMC
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    import numpy as np
+    NUMPY_ENABLED = True
+except ImportError:
+    NUMPY_ENABLED = False
+
+try:
+    from PIL import Image
+    PIL_ENABLED = True
+except ImportError:
+    PIL_ENABLED = False
+
+# Contrôle des marques de calage : lecture des pixels (Pillow) et densités (numpy)
+CORNER_CHECK_ENABLED = PIL_ENABLED and NUMPY_ENABLED
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
+
+# Taux d'encre (pixels sombres) en dessous duquel une page est considérée blanche.
+# Une page AMC imprimée (marques de calage, énoncé) est largement au-dessus.
+BLANK_INK_THRESHOLD = float(os.environ.get('AMC_BLANK_INK_THRESHOLD', '0.002'))
+# Niveau de gris (0-255) sous lequel un pixel est compté comme encre
+INK_LEVEL = 128
+# Détection des quasi-doublons (désactivée par défaut) : sur des sujets photocopiés, deux
+# élèves ayant répondu pareil (ou laissé la page vierge) ont la même empreinte, et une case
+# cochée ne change le taux d'encre que d'environ 1e-5. Seuls les doublons exacts (octets ou
+# pixels identiques) et les pages blanches sont écartés sans cette option.
+NEAR_DUPLICATE_DETECTION = os.environ.get('AMC_NEAR_DUPLICATE_DETECTION', '0') == '1'
+# Distance de Hamming maximale entre empreintes pour un quasi-doublon (0 = identiques)
+NEAR_DUPLICATE_DISTANCE = int(os.environ.get('AMC_NEAR_DUPLICATE_DISTANCE', '0'))
+# Écart de taux d'encre toléré entre deux quasi-doublons
+NEAR_DUPLICATE_INK_DELTA = float(os.environ.get('AMC_NEAR_DUPLICATE_INK_DELTA', '0.000005'))
+
+HASH_SIZE = 16
+INK_SAMPLE_WIDTH = 400
+
+PREFILTER_WORKERS = int(os.environ.get('AMC_PREFILTER_WORKERS', str(os.cpu_count() or 2)))
+SKIPPED_DIR = 'skipped'
+REPORT_FILE = 'scan_prefilter.json'
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(image_path):
+    """Empreintes peu coûteuses d'une page : dHash perceptuel, taux d'encre, hash des pixels"""
+    with Image.open(image_path) as img:
+        img.draft('L', (INK_SAMPLE_WIDTH * 2, INK_SAMPLE_WIDTH * 3))
+        gray = img.convert('L')
+
+    ratio = INK_SAMPLE_WIDTH / float(gray.width)
+    sample = gray.resize((INK_SAMPLE_WIDTH, max(1, int(gray.height * ratio))))
+    histogram = sample.histogram()
+    ink = sum(histogram[:INK_LEVEL]) / float(sample.width * sample.height)
+
+    # dHash : signe du gradient horizontal sur une vignette (HASH_SIZE + 1) x HASH_SIZE
+    thumb = gray.resize((HASH_SIZE + 1, HASH_SIZE))
+    pixels = list(thumb.getdata())
+    dhash = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            dhash = (dhash << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+
+    return {
+        'dhash': dhash,
+        'ink': ink,
+        'pixels': hashlib.sha256(sample.tobytes()).hexdigest(),
+        'file': _file_digest(image_path)
+    }
+
+
+def _hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def prefilter_images(image_paths, report_dir=None, skipped_dir=None):
+    """Écarte les pages blanches et les doublons d'une liste d'images.
+
+    Les empreintes sont calculées en parallèle ; les pages écartées sont déplacées
+    dans skipped_dir (si fourni) et la raison de chaque exclusion est enregistrée
+    dans report_dir/scan_prefilter.json. Retourne un dictionnaire de résultat.
+    """
+    image_paths = sorted(Path(p) for p in image_paths)
+
+    if not PIL_ENABLED:
+        return {'success': True, 'kept': [str(p) for p in image_paths], 'skipped': [],
+                'warning': 'Pillow non installé, pré-filtrage désactivé'}
+
+    def safe_fingerprint(path):
+        try:
+            return fingerprint(path)
+        except Exception as e:
+            return {'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=max(1, PREFILTER_WORKERS)) as pool:
+        prints = list(pool.map(safe_fingerprint, image_paths))
+
+    kept, skipped = [], []
+    seen_files, seen_pixels, kept_prints = {}, {}, []
+    for path, fp in zip(image_paths, prints):
+        if 'error' in fp:
+            # Image illisible par Pillow : la laisser à AMC qui tranchera
+            kept.append(path)
+            continue
+
+        reason, duplicate_of = None, None
+        if fp['ink'] < BLANK_INK_THRESHOLD:
+            reason = 'blank'
+        elif fp['file'] in seen_files:
+            reason, duplicate_of = 'duplicate', seen_files[fp['file']]
+        elif fp['pixels'] in seen_pixels:
+            reason, duplicate_of = 'duplicate', seen_pixels[fp['pixels']]
+        elif NEAR_DUPLICATE_DETECTION:
+            for other_path, other in kept_prints:
+                if (_hamming(fp['dhash'], other['dhash']) <= NEAR_DUPLICATE_DISTANCE
+                        and abs(fp['ink'] - other['ink']) < NEAR_DUPLICATE_INK_DELTA):
+                    reason, duplicate_of = 'near_duplicate', other_path
+                    break
+
+        if reason:
+            skipped.append({
+                'file': path.name,
+                'reason': reason,
+                'duplicate_of': duplicate_of.name if duplicate_of else None,
+                'ink': round(fp['ink'], 5)
+            })
+            if skipped_dir is not None:
+                skipped_dir = Path(skipped_dir)
+                skipped_dir.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(path), str(skipped_dir / path.name))
+        else:
+            kept.append(path)
+            kept_prints.append((path, fp))
+            seen_files[fp['file']] = path
+            seen_pixels[fp['pixels']] = path
+
+    report = {
+        'total': len(image_paths),
+        'kept': len(kept),
+        'skipped': skipped
+    }
+    if report_dir is not None:
+        with open(Path(report_dir) / REPORT_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    return {'success': True, 'kept': [str(p) for p in kept], 'skipped': skipped}
+
+
+# --- Prépasse de détection des marques de calage (coins) ---
+
+CORNER_SAMPLE_WIDTH = 600
+# Demi-largeur de la fenêtre de recherche autour de la position attendue (fraction de la page)
+CORNER_SEARCH_MARGIN = 0.06
+# Côté du carré inscrit dans une marque AMC (disque de ~2 mm sur A4), en fraction de largeur
+CORNER_MARK_SIZE = 0.006
+# Densité d'encre minimale dans ce carré pour considérer la marque trouvée
+CORNER_MARK_DENSITY = 0.8
+
+
+def load_corner_marks(layout_db):
+    """Positions moyennes normalisées (0-1) des quatre marques de calage d'après layout_mark"""
+    import sqlite3
+
+    layout_db = Path(layout_db)
+    if not layout_db.exists():
+        return None
+    conn = sqlite3.connect(layout_db)
+    try:
+        rows = conn.execute("""
+            SELECT m.corner, AVG(1.0 * m.x / p.width), AVG(1.0 * m.y / p.height)
+            FROM layout_mark m
+            JOIN layout_page p ON p.student = m.student AND p.page = m.page
+            WHERE p.width > 0 AND p.height > 0
+            GROUP BY m.corner ORDER BY m.corner
+        """).fetchall()
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+    return {corner: (x, y) for corner, x, y in rows} or None
+
+
+def _corner_density(dark, center, margin, size):
+    """Densité d'encre maximale d'un carré size x size dans la fenêtre autour de center"""
+    height, width = dark.shape
+    cx, cy = int(center[0] * width), int(center[1] * height)
+    mx, my = int(margin * width), int(margin * height)
+    window = dark[max(0, cy - my):cy + my, max(0, cx - mx):cx + mx]
+    if window.shape[0] < size or window.shape[1] < size:
+        return 0.0
+
+    # Image intégrale : somme de chaque carré size x size en une opération vectorisée
+    integral = np.pad(window.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    sums = (integral[size:, size:] - integral[:-size, size:]
+            - integral[size:, :-size] + integral[:-size, :-size])
+    return float(sums.max()) / (size * size)
+
+
+def check_corner_marks(image_paths, marks, workers=None):
+    """Vérifie sur des vignettes que les quatre marques de calage sont repérables.
+
+    Retourne une entrée par image : marques trouvées, coins manquants et
+    'registrable' (False si AMC ne pourra pas recaler la page).
+    """
+    def check(path):
+        path = Path(path)
+        try:
+            with Image.open(path) as img:
+                img.draft('L', (CORNER_SAMPLE_WIDTH * 2, CORNER_SAMPLE_WIDTH * 3))
+                gray = img.convert('L')
+            ratio = CORNER_SAMPLE_WIDTH / float(gray.width)
+            gray = gray.resize((CORNER_SAMPLE_WIDTH, max(1, int(gray.height * ratio))))
+            dark = (np.asarray(gray) < INK_LEVEL).astype(np.int32)
+        except Exception as e:
+            return {'file': path.name, 'registrable': False, 'error': str(e)}
+
+        size = max(3, int(round(CORNER_MARK_SIZE * CORNER_SAMPLE_WIDTH)))
+        missing = [corner for corner, center in marks.items()
+                   if _corner_density(dark, center, CORNER_SEARCH_MARGIN, size) < CORNER_MARK_DENSITY]
+        return {
+            'file': path.name,
+            'registrable': not missing,
+            'marks_found': len(marks) - len(missing),
+            'missing_corners': missing
+        }
+
+    with ThreadPoolExecutor(max_workers=max(1, workers or PREFILTER_WORKERS)) as pool:
+        return list(pool.map(check, image_paths))
+
+
+# --- Inspection légère des fichiers scannés (sans rastérisation) ---
+
+# Résolution en dessous de laquelle la lecture des cases devient peu fiable
+MIN_SCAN_DPI = 200
+PDF_TOOL_TIMEOUT = 30
+
+
+def _pdf_page_count(pdf_path):
+    """Nombre de pages via pdfinfo (poppler), sinon comptage des objets /Page"""
+    try:
+        output = subprocess.run(['pdfinfo', str(pdf_path)], capture_output=True, text=True,
+                                timeout=PDF_TOOL_TIMEOUT, check=True).stdout
+        for line in output.splitlines():
+            if line.startswith('Pages:'):
+                return int(line.split(':', 1)[1])
+    except (OSError, subprocess.SubprocessError, ValueError):
+        pass
+    with open(pdf_path, 'rb') as f:
+        return len(re.findall(rb'/Type\s*/Page(?![a-zA-Z])', f.read()))
+
+
+def _pdf_images(pdf_path):
+    """Images intégrées (dimensions et résolution effective) lues par pdfimages -list"""
+    try:
+        output = subprocess.run(['pdfimages', '-list', str(pdf_path)], capture_output=True, text=True,
+                                timeout=PDF_TOOL_TIMEOUT, check=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+    images = []
+    # Colonnes : page num type width height color comp bpc enc interp object ID x-ppi y-ppi size ratio
+    for line in output.splitlines()[2:]:
+        fields = line.split()
+        if len(fields) < 14 or fields[2] != 'image':
+            continue
+        try:
+            images.append({
+                'page': int(fields[0]),
+                'width': int(fields[3]),
+                'height': int(fields[4]),
+                'dpi': min(int(fields[12]), int(fields[13]))
+            })
+        except ValueError:
+            continue
+    return images
+
+
+def extract_pdf_images(pdf_path, output_dir):
+    """Extrait les images intégrées d'un PDF scanné (pdfimages), sans rastériser les pages.
+
+    Les JPEG sont copiés tels quels (-j), les autres images écrites en PNM ;
+    output_dir est propre à ce PDF. Retourne (fichiers extraits, erreur ou None).
+    """
+    pdf_path, output_dir = Path(pdf_path), Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        subprocess.run(['pdfimages', '-j', str(pdf_path), str(output_dir / pdf_path.stem)], capture_output=True,
+                       text=True, timeout=PDF_TOOL_TIMEOUT, check=True)
+    except (OSError, subprocess.SubprocessError) as e:
+        return [], str(e)
+    return sorted(p for p in output_dir.iterdir() if p.is_file()), None
+
+
+def extract_scans_images(pdf_files, output_dir, workers=None):
+    """Extrait en parallèle les images intégrées de plusieurs PDF : (fichiers, erreurs)"""
+    # Un sous-dossier par PDF ; les pages extraites sont préfixées par son nom (<nom>-000.jpg)
+    jobs = [(Path(pdf_file), Path(output_dir) / f"{index:03d}") for index, pdf_file in enumerate(pdf_files)]
+    files, errors = [], []
+    with ThreadPoolExecutor(max_workers=max(1, workers or PREFILTER_WORKERS)) as pool:
+        for (pdf_file, _), (extracted, error) in zip(jobs, pool.map(lambda job: extract_pdf_images(*job), jobs)):
+            files.extend(extracted)
+            if error:
+                errors.append({'file': pdf_file.name, 'error': error})
+    return files, errors
+
+
+def inspect_scan_file(scan_path):
+    """Pages, dimensions et résolution d'un scan lues dans la structure du fichier"""
+    scan_path = Path(scan_path)
+    info = {'file': str(scan_path), 'size_bytes': scan_path.stat().st_size, 'warnings': []}
+    try:
+        if scan_path.suffix.lower() == '.pdf':
+            info['pages'] = _pdf_page_count(scan_path)
+            images = _pdf_images(scan_path)
+            if images:
+                info['width'] = max(image['width'] for image in images)
+                info['height'] = max(image['height'] for image in images)
+                info['dpi'] = min(image['dpi'] for image in images)
+            elif images is not None:
+                info['warnings'].append('Aucune image intégrée : PDF vectoriel, pas un scan')
+        else:
+            if not PIL_ENABLED:
+                raise RuntimeError('Pillow non installé')
+            # Image.open ne lit que l'en-tête : pas de décodage des pixels
+            with Image.open(scan_path) as img:
+                info['pages'] = getattr(img, 'n_frames', 1)
+                info['width'], info['height'] = img.size
+                dpi = img.info.get('dpi')
+                if dpi:
+                    info['dpi'] = int(round(min(dpi)))
+        info['detected'] = info.get('pages', 0) > 0
+    except Exception as e:
+        info['detected'] = False
+        info['error'] = str(e)
+        return info
+
+    if info.get('dpi') and info['dpi'] < MIN_SCAN_DPI:
+        info['warnings'].append(f"Résolution faible ({info['dpi']} DPI), {MIN_SCAN_DPI} DPI minimum conseillés")
+    return info
+
+
+def inspect_scans(scan_files, workers=None):
+    """Inspecte tous les fichiers téléversés en parallèle"""
+    with ThreadPoolExecutor(max_workers=max(1, workers or PREFILTER_WORKERS)) as pool:
+        return list(pool.map(inspect_scan_file, scan_files))
@@ -0,0 +1,211 @@
+# scan_retention.py - Rétention des pages préparées (prepared_scans) une fois la correction terminée
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from file_hashes import file_sha256
+
+try:
+    from PIL import Image
+    PIL_ENABLED = True
+except ImportError:
+    PIL_ENABLED = False
+
+# keep : ne rien toucher ; compact : réencoder sans perte ; prune : supprimer les pages
+# régénérables depuis leur source (upload inchangé), réencoder les autres
+SCAN_RETENTION_POLICY = os.environ.get('AMC_SCAN_RETENTION', 'compact')
+RETENTION_POLICIES = ('keep', 'compact', 'prune')
+
+PREPARED_DIR = 'prepared_scans'
+# Origine de chaque page préparée (fichier uploadé, empreinte, méthode de conversion)
+SOURCES_FILE = 'scan_sources.json'
+REPORT_FILE = 'scan_retention.json'
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
+# Formats réencodables sans perte ; un JPEG recompressé en PNG grossirait
+LOSSLESS_EXTENSIONS = {'.png', '.tif', '.tiff'}
+
+
+# Un seul worker dédié : la rétention ne retarde pas la fin des corrections
+# et n'occupe pas leurs workers
+_executor = None
+_pending = {}
+_pending_lock = threading.Lock()
+# Verrou par projet : la rétention et la régénération des pages ne se chevauchent pas
+_project_locks = {}
+
+
+def project_lock(project_path):
+    key = str(Path(project_path).resolve())
+    with _pending_lock:
+        return _project_locks.setdefault(key, threading.Lock())
+
+
+def _write_json(path, data):
+    tmp_file = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_scan_sources(project_path, sources):
+    """Enregistre l'origine des pages préparées : {nom de page: {source, sha256, method, path, ...}}"""
+    _write_json(Path(project_path) / SOURCES_FILE, sources)
+
+
+def load_scan_sources(project_path):
+    return _read_json(Path(project_path) / SOURCES_FILE) or {}
+
+
+def load_retention_report(project_path):
+    return _read_json(Path(project_path) / REPORT_FILE)
+
+
+def prepared_images(project_path):
+    prepared_path = Path(project_path) / PREPARED_DIR
+    if not prepared_path.exists():
+        return []
+    return sorted(p for p in prepared_path.rglob('*')
+                  if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def compact_image(path):
+    """Réencode une image PNG/TIFF sans perte ; retourne les octets gagnés (0 si l'original est plus petit)"""
+    path = Path(path)
+    before = path.stat()
+    tmp_file = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with Image.open(path) as image:
+        image.load()
+        options = {}
+        if 'dpi' in image.info:
+            options['dpi'] = image.info['dpi']
+        if path.suffix.lower() == '.png':
+            image.save(tmp_file, 'PNG', optimize=True, **options)
+        else:
+            # Pages noir et blanc : CCITT groupe 4, bien plus compact que deflate
+            compression = 'group4' if image.mode == '1' else 'tiff_adobe_deflate'
+            image.save(tmp_file, 'TIFF', compression=compression, **options)
+
+    # Page supprimée ou régénérée entre-temps (nouvelle préparation) : on ne la remplace pas
+    try:
+        current = path.stat()
+    except FileNotFoundError:
+        current = None
+    if current is None or (current.st_size, current.st_mtime_ns) != (before.st_size, before.st_mtime_ns):
+        tmp_file.unlink()
+        return 0
+    saved = current.st_size - tmp_file.stat().st_size
+    if saved > 0:
+        os.replace(tmp_file, path)
+        return saved
+    tmp_file.unlink()
+    return 0
+
+
+def apply_scan_retention(project_path, policy=None):
+    """Applique la politique de rétention aux pages préparées d'un projet.
+
+    Une page n'est supprimée (politique prune) que si scan_sources.json indique
+    une source encore présente avec la même empreinte : elle peut alors être
+    régénérée à l'identique (la galerie et l'annotation la régénèrent à la
+    demande, voir AMCManager.ensure_prepared_scans). Le rapport (octets récupérés) est enregistré dans
+    scan_retention.json, avec le cumul des passes précédentes.
+    """
+    project_path = Path(project_path)
+    policy = policy or SCAN_RETENTION_POLICY
+    if policy not in RETENTION_POLICIES:
+        return {'success': False, 'error': f"Politique de rétention inconnue: {policy}"}
+    with project_lock(project_path):
+        return _apply_scan_retention(project_path, policy)
+
+
+def _apply_scan_retention(project_path, policy):
+
+    images = prepared_images(project_path)
+    bytes_before = sum(p.stat().st_size for p in images)
+    pruned, compacted, errors = [], [], []
+
+    if policy != 'keep':
+        sources = load_scan_sources(project_path)
+        source_hashes = {}
+
+        def is_regenerable(entry):
+            source = project_path / entry['source']
+            if entry['source'] not in source_hashes:
+                source_hashes[entry['source']] = file_sha256(source) if source.is_file() else None
+            return source_hashes[entry['source']] == entry.get('sha256')
+
+        for image_file in images:
+            entry = sources.get(image_file.name)
+            try:
+                if policy == 'prune' and entry and is_regenerable(entry):
+                    image_file.unlink()
+                    pruned.append(image_file.name)
+                elif PIL_ENABLED and image_file.suffix.lower() in LOSSLESS_EXTENSIONS:
+                    saved = compact_image(image_file)
+                    if saved:
+                        compacted.append({'file': image_file.name, 'saved': saved})
+            except (OSError, ValueError) as e:
+                errors.append({'file': image_file.name, 'error': str(e)})
+
+    bytes_after = sum(p.stat().st_size for p in prepared_images(project_path))
+    previous = load_retention_report(project_path) or {}
+    report = {
+        'success': True,
+        'policy': policy,
+        'date': datetime.now().isoformat(),
+        'bytes_before': bytes_before,
+        'bytes_after': bytes_after,
+        'bytes_reclaimed': bytes_before - bytes_after,
+        'total_bytes_reclaimed': previous.get('total_bytes_reclaimed', 0) + bytes_before - bytes_after,
+        'pruned': pruned,
+        'compacted': compacted,
+        'errors': errors
+    }
+    if not PIL_ENABLED and policy != 'keep':
+        report['warning'] = 'Pillow non installé, réencodage sans perte désactivé'
+    _write_json(project_path / REPORT_FILE, report)
+    return report
+
+
+def schedule_scan_retention(project_path, task):
+    """Exécute task() (rétention d'un projet) en tâche de fond, une seule fois à la fois par projet.
+
+    Retourne le Future de la rétention déjà planifiée pour ce projet s'il y en a une.
+    """
+    global _executor
+    key = str(Path(project_path).resolve())
+    with _pending_lock:
+        future = _pending.get(key)
+        if future is not None and not future.done():
+            return future
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scan-retention')
+        future = _executor.submit(task)
+        _pending[key] = future
+        future.add_done_callback(lambda done, k=key: _forget(k, done))
+    return future
+
+
+def _forget(key, future):
+    with _pending_lock:
+        if _pending.get(key) is future:
+            del _pending[key]
+
+
+def missing_pages(project_path):
+    """Pages de scan_sources.json absentes de prepared_scans (supprimées par la rétention)"""
+    prepared_path = Path(project_path) / PREPARED_DIR
+    return {name: entry for name, entry in load_scan_sources(project_path).items()
+            if not (prepared_path / entry.get('path', name)).exists()}
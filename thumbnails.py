@@ -0,0 +1,287 @@
+# thumbnails.py - Vignettes des pages scannées : génération paresseuse, cache disque LRU borné en taille
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+
+from flask import abort, jsonify, render_template, request, send_file, url_for
+
+from amc_manager import AMCManager
+from metrics import record_cache
+
+try:
+    from PIL import Image, features
+    PIL_ENABLED = True
+    WEBP_ENABLED = features.check('webp')
+except ImportError:
+    PIL_ENABLED = False
+    WEBP_ENABLED = False
+
+# Cache commun à tous les projets, borné en taille totale (les vignettes les moins récemment servies partent d'abord) ;
+# par défaut dans le dossier des projets, hors de data/ qui contient les bases AMC versionnées
+THUMBNAIL_CACHE_DIR = os.environ.get('AMC_THUMBNAIL_CACHE_DIR') or os.path.join(
+    os.environ.get('AMC_PROJECTS_FOLDER', 'amc-projects'), '.thumbnails')
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('AMC_THUMBNAIL_CACHE_MAX_MB', '512')) * 1024 * 1024
+THUMBNAIL_WORKERS = int(os.environ.get('AMC_THUMBNAIL_WORKERS', str(min(4, os.cpu_count() or 2))))
+# Durée de cache navigateur : les URL listées portent la version du scan (?v=...)
+THUMBNAIL_MAX_AGE = int(os.environ.get('AMC_THUMBNAIL_MAX_AGE', '86400'))
+
+THUMBNAIL_WIDTHS = (160, 320, 640, 1024)
+DEFAULT_WIDTH = 320
+WEBP_QUALITY = 75
+JPEG_QUALITY = 80
+
+SCANS_DIR = 'prepared_scans'
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.tif', '.tiff'}
+
+MIMETYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+
+
+def render_thumbnail(source, target, width, fmt):
+    """Réduit une page à la largeur demandée et l'écrit (écriture atomique)"""
+    with Image.open(source) as image:
+        height = max(1, round(image.height * width / image.width))
+        # draft : décodage JPEG directement à une résolution réduite (beaucoup plus rapide)
+        image.draft('RGB', (width, height))
+        image = image.convert('L' if image.mode in ('1', 'L', 'I;16') else 'RGB')
+        image.thumbnail((width, height), Image.LANCZOS)
+
+        tmp_file = target.with_name(f"{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        if fmt == 'webp':
+            image.save(tmp_file, 'WEBP', quality=WEBP_QUALITY, method=4)
+        else:
+            image.save(tmp_file, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(tmp_file, target)
+
+
+class ThumbnailCache:
+    """Vignettes sur disque, clé = (fichier source, taille, date, largeur, format).
+
+    Une vignette en cours de génération n'est produite qu'une fois, même si
+    plusieurs requêtes la demandent en même temps ; au-delà de max_bytes les
+    vignettes les moins récemment servies sont supprimées.
+    """
+
+    def __init__(self, cache_dir=THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES,
+                 workers=THUMBNAIL_WORKERS):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._executor = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._total_bytes = None
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnail')
+        return self._executor
+
+    def key(self, source, width, fmt):
+        stat = os.stat(source)
+        identity = f"{Path(source).resolve()}\0{stat.st_size}\0{stat.st_mtime_ns}\0{width}\0{fmt}"
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def path_for(self, key, fmt):
+        extension = 'webp' if fmt == 'webp' else 'jpg'
+        return self.cache_dir / key[:2] / f"{key}.{extension}"
+
+    def _cached_files(self):
+        if not self.cache_dir.exists():
+            return []
+        return [p for p in self.cache_dir.glob('*/*') if p.suffix in ('.webp', '.jpg')]
+
+    def _add_bytes(self, size, keep=None):
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = sum(p.stat().st_size for p in self._cached_files())
+            else:
+                self._total_bytes += size
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict(keep=keep)
+
+    def evict(self, keep=None):
+        """Supprime les vignettes les moins récemment servies jusqu'à repasser sous 90 % du budget.
+
+        keep : vignette à conserver (celle qui vient d'être générée pour la requête en cours).
+        """
+        entries = []
+        for cached in self._cached_files():
+            try:
+                stat = cached.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, cached))
+        entries.sort()
+
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        for _, size, cached in entries:
+            if total <= target:
+                break
+            if cached == keep:
+                continue
+            try:
+                cached.unlink()
+                total -= size
+                removed += 1
+            except OSError:
+                pass
+
+        with self._lock:
+            self._total_bytes = total
+        return removed
+
+    def _generate(self, source, target, width, fmt):
+        target.parent.mkdir(parents=True, exist_ok=True)
+        render_thumbnail(source, target, width, fmt)
+        self._add_bytes(target.stat().st_size, keep=target)
+        return target
+
+    def submit(self, source, width=DEFAULT_WIDTH, fmt='webp'):
+        """Future de la vignette (immédiatement résolue si elle est déjà en cache)"""
+        key = self.key(source, width, fmt)
+        target = self.path_for(key, fmt)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return key, future
+
+        if target.exists():
+            record_cache('thumbnails', True)
+            # La date de modification sert d'horodatage LRU
+            try:
+                os.utime(target)
+            except OSError:
+                pass
+            future = Future()
+            future.set_result(target)
+            return key, future
+
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                record_cache('thumbnails', False)
+                future = self._pool().submit(self._generate, source, target, width, fmt)
+                self._pending[key] = future
+                future.add_done_callback(lambda _, k=key: self._forget(k))
+        return key, future
+
+    def _forget(self, key):
+        with self._lock:
+            self._pending.pop(key, None)
+
+    def get(self, source, width=DEFAULT_WIDTH, fmt='webp'):
+        """Chemin de la vignette, générée au besoin (attend la fin de la génération)"""
+        key, future = self.submit(source, width, fmt)
+        return key, future.result()
+
+    def warm(self, sources, width=DEFAULT_WIDTH, fmt='webp'):
+        """Lance en tâche de fond la génération des vignettes manquantes"""
+        return [self.submit(source, width, fmt)[1] for source in sources]
+
+
+thumbnail_cache = ThumbnailCache()
+
+
+def list_scan_pages(project_path):
+    """Pages préparées d'un projet (chemins relatifs à prepared_scans), dans l'ordre"""
+    scans_path = Path(project_path) / SCANS_DIR
+    if not scans_path.exists():
+        return []
+    return sorted(p.relative_to(scans_path).as_posix() for p in scans_path.rglob('*')
+                  if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+
+def resolve_scan_page(project_path, filename):
+    """Chemin d'une page préparée ; None si le nom sort de prepared_scans ou n'est pas une image"""
+    scans_path = (Path(project_path) / SCANS_DIR).resolve()
+    source = (scans_path / filename).resolve()
+    if scans_path not in source.parents or source.suffix.lower() not in IMAGE_EXTENSIONS:
+        return None
+    return source if source.is_file() else None
+
+
+def negotiate_format(accept_header, requested=None):
+    """WebP si le navigateur l'accepte (et Pillow sait l'écrire), sinon JPEG"""
+    if requested in MIMETYPES:
+        return 'webp' if requested == 'webp' and WEBP_ENABLED else 'jpeg'
+    return 'webp' if WEBP_ENABLED and 'image/webp' in (accept_header or '') else 'jpeg'
+
+
+def nearest_width(width):
+    """Largeur normalisée (limite le nombre de variantes en cache)"""
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        return DEFAULT_WIDTH
+    return min(THUMBNAIL_WIDTHS, key=lambda w: abs(w - width))
+
+
+def register_thumbnail_routes(app, AMC_PROJECTS_FOLDER):
+    """Enregistre les routes de prévisualisation des pages scannées"""
+
+    @app.route('/api/scans/<project_id>')
+    def api_scan_pages(project_id):
+        """Liste des pages préparées avec l'URL de leur vignette"""
+        project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
+        if not os.path.exists(project_path):
+            return jsonify({'success': False, 'error': 'Projet non trouvé'}), 404
+
+        # Pages supprimées par la rétention (prune) régénérées avant l'affichage
+        AMCManager(project_path).ensure_prepared_scans()
+        width = nearest_width(request.args.get('w', DEFAULT_WIDTH))
+        pages = list_scan_pages(project_path)
+        scans_path = Path(project_path) / SCANS_DIR
+        items = []
+        for page in pages:
+            version = (scans_path / page).stat().st_mtime_ns
+            items.append({
+                'name': page,
+                'thumbnail_url': url_for('scan_thumbnail', project_id=project_id, filename=page,
+                                         w=width, v=version)
+            })
+
+        # Génération anticipée : les vignettes sont prêtes quand le navigateur les demande
+        if PIL_ENABLED and request.args.get('warm', '1') != '0':
+            fmt = negotiate_format(request.headers.get('Accept'))
+            thumbnail_cache.warm([scans_path / page for page in pages], width, fmt)
+
+        return jsonify({'success': True, 'pages': items, 'total': len(items),
+                        'thumbnails_enabled': PIL_ENABLED})
+
+    @app.route('/thumbnail/<project_id>/<path:filename>')
+    def scan_thumbnail(project_id, filename):
+        """Vignette d'une page préparée (WebP ou JPEG selon le navigateur)"""
+        if not PIL_ENABLED:
+            return jsonify({'success': False, 'error': 'Pillow non installé, vignettes désactivées'}), 503
+
+        project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
+        source = resolve_scan_page(project_path, filename)
+        if source is None:
+            abort(404)
+
+        width = nearest_width(request.args.get('w', DEFAULT_WIDTH))
+        fmt = negotiate_format(request.headers.get('Accept'), request.args.get('format'))
+        try:
+            key, thumbnail = thumbnail_cache.get(source, width, fmt)
+        except (OSError, ValueError) as e:
+            app.logger.error(f"Erreur génération vignette {filename} ({project_id}): {e}")
+            abort(500)
+
+        response = send_file(os.path.abspath(thumbnail), mimetype=MIMETYPES[fmt], etag=key,
+                             conditional=True, max_age=THUMBNAIL_MAX_AGE)
+        response.headers['Cache-Control'] = f'private, max-age={THUMBNAIL_MAX_AGE}'
+        response.vary.add('Accept')
+        return response
+
+    @app.route('/scans/<project_id>')
+    def view_scans(project_id):
+        """Galerie des pages scannées du projet"""
+        project_path = os.path.join(AMC_PROJECTS_FOLDER, project_id)
+        if not os.path.exists(project_path):
+            abort(404)
+        return render_template('scans.html', project_id=project_id)
@@ -0,0 +1,187 @@
+# upload_store.py - Stockage des uploads par contenu : un blob par empreinte, référencé par lien dans uploads/
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+
+# Blobs partagés entre projets : <BLOB_STORE>/<2 premiers caractères>/<sha256>.
+# Par défaut dans le dossier des projets (même système de fichiers que uploads/, liens physiques
+# possibles), hors de data/ qui contient les bases AMC versionnées
+BLOB_STORE_DIR = os.environ.get('AMC_BLOB_STORE') or os.path.join(
+    os.environ.get('AMC_PROJECTS_FOLDER', 'amc-projects'), '.blobs')
+# Index du projet : nom de fichier uploadé -> empreinte
+UPLOAD_INDEX_FILE = 'uploads_index.json'
+CHUNK_SIZE = 1024 * 1024
+
+# Verrou unique du magasin partagé : publication d'un blob, liens depuis uploads/ et libération
+# (st_nlink) ne doivent pas s'entrelacer entre projets
+_store_lock = threading.RLock()
+
+
+def _blob_path(digest, store_dir=None):
+    return Path(store_dir or BLOB_STORE_DIR) / digest[:2] / digest
+
+
+def _index_path(project_path):
+    return Path(project_path) / UPLOAD_INDEX_FILE
+
+
+def load_upload_index(project_path):
+    try:
+        with open(_index_path(project_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_upload_index(project_path, index):
+    index_file = _index_path(project_path)
+    tmp_file = index_file.with_name(f"{index_file.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, index_file)
+
+
+def _stream_to_tmp(stream, store_dir=None):
+    """Écrit le flux dans un fichier temporaire du magasin en calculant son empreinte au fil de l'eau.
+
+    Retourne (empreinte, fichier temporaire, taille) ; le blob est publié par _publish_blob.
+    """
+    store = Path(store_dir or BLOB_STORE_DIR)
+    store.mkdir(parents=True, exist_ok=True)
+    tmp_file = store / f".upload.{os.getpid()}.{threading.get_ident()}.tmp"
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_file, 'wb') as f:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+    except BaseException:
+        try:
+            tmp_file.unlink()
+        except OSError:
+            pass
+        raise
+    return digest.hexdigest(), tmp_file, size
+
+
+def _publish_blob(tmp_file, digest, store_dir=None):
+    """Place le fichier temporaire comme blob (à appeler sous _store_lock) ; un contenu déjà présent n'est pas réécrit"""
+    blob = _blob_path(digest, store_dir)
+    if blob.exists():
+        tmp_file.unlink()
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(tmp_file, blob)
+    return blob
+
+
+def _link(blob, target):
+    """Référence le blob depuis uploads/ (lien physique, copie si le système de fichiers ne le permet pas)"""
+    tmp_target = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        os.link(blob, tmp_target)
+    except OSError:
+        shutil.copyfile(blob, tmp_target)
+    os.replace(tmp_target, target)
+    # Si tmp_target et target étaient déjà le même inode, os.replace ne fait rien :
+    # le lien temporaire resterait et le blob ne serait jamais libéré
+    try:
+        tmp_target.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def _same_file(path, other):
+    try:
+        return os.path.samefile(path, other)
+    except OSError:
+        return False
+
+
+def _release_blob(digest, store_dir=None):
+    """Supprime le blob s'il n'est plus référencé par aucun projet (seul lien restant)"""
+    blob = _blob_path(digest, store_dir)
+    with _store_lock:
+        try:
+            if blob.stat().st_nlink <= 1:
+                blob.unlink()
+        except OSError:
+            pass
+
+
+def store_upload(project_path, filename, stream, store_dir=None):
+    """Enregistre un fichier uploadé dans uploads/ via le magasin de blobs.
+
+    Si le même contenu est déjà présent dans le projet sous un autre nom,
+    rien n'est ajouté : le résultat indique duplicate_of (nom existant).
+    Retourne un dictionnaire {success, filename, sha256, size, added_bytes, duplicate_of}.
+    """
+    project_path = Path(project_path)
+    uploads_path = project_path / 'uploads'
+    uploads_path.mkdir(parents=True, exist_ok=True)
+
+    digest, tmp_file, size = _stream_to_tmp(stream, store_dir)
+    target = uploads_path / filename
+
+    # Publication, lien et libération sous le même verrou : un blob ne peut pas être
+    # supprimé par un autre projet entre sa vérification et le lien qui le référence
+    with _store_lock:
+        try:
+            blob = _publish_blob(tmp_file, digest, store_dir)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+        index = load_upload_index(project_path)
+        duplicate_of = next((name for name, known in index.items()
+                             if known == digest and name != filename and (uploads_path / name).exists()), None)
+        if duplicate_of:
+            result = {'success': True, 'filename': duplicate_of, 'sha256': digest, 'size': size,
+                      'added_bytes': 0, 'duplicate_of': duplicate_of}
+        elif index.get(filename) == digest and _same_file(target, blob):
+            # Même contenu renvoyé sous le même nom : déjà en place
+            result = {'success': True, 'filename': filename, 'sha256': digest, 'size': size,
+                      'added_bytes': 0, 'duplicate_of': None}
+        else:
+            previous_size = target.stat().st_size if target.exists() else 0
+            previous_digest = index.get(filename)
+            _link(blob, target)
+            index[filename] = digest
+            _save_upload_index(project_path, index)
+            if previous_digest and previous_digest != digest:
+                _release_blob(previous_digest, store_dir)
+            # Sans lien physique (copie), le blob n'est plus utile
+            _release_blob(digest, store_dir)
+            result = {'success': True, 'filename': filename, 'sha256': digest, 'size': size,
+                      'added_bytes': size - previous_size, 'duplicate_of': None}
+
+        if duplicate_of:
+            _release_blob(digest, store_dir)
+    return result
+
+
+def remove_upload(project_path, filename, store_dir=None):
+    """Supprime un fichier uploadé et libère son blob s'il n'est plus référencé ; retourne les octets libérés"""
+    project_path = Path(project_path)
+    target = project_path / 'uploads' / filename
+    size = target.stat().st_size if target.exists() else 0
+    with _store_lock:
+        index = load_upload_index(project_path)
+        digest = index.pop(filename, None)
+        if target.exists():
+            target.unlink()
+        _save_upload_index(project_path, index)
+        if digest:
+            _release_blob(digest, store_dir)
+    return size
+
+
+def release_blobs(digests, store_dir=None):
+    """Libère les blobs d'un projet supprimé (ceux encore référencés ailleurs sont conservés)"""
+    with _store_lock:
+        for digest in set(digests):
+            _release_blob(digest, store_dir)